@@ -0,0 +1,257 @@
+import os
+import time
+import shutil
+import hashlib
+import logging
+import tempfile
+
+from cellmaps_generate_hierarchy.exceptions import CellmapsGenerateHierarchyError
+
+logger = logging.getLogger(__name__)
+
+
+def get_file_digest(path, digest=None, blocksize=1048576):
+    """
+    Updates **digest** with contents of file at **path**
+
+    :param path: Path to file
+    :type path: str
+    :param digest: Digest to update, if ``None`` a new
+                   :py:func:`hashlib.sha256` digest is created
+    :param blocksize: Number of bytes to read at a time
+    :type blocksize: int
+    :return: updated digest
+    """
+    if digest is None:
+        digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(blocksize), b''):
+            digest.update(block)
+    return digest
+
+
+class FileCache(object):
+    """
+    Size bounded, on disk cache of files. Each entry is a directory,
+    named by its key, under **cache_dir**. When the cache grows beyond
+    **max_size** bytes the least recently used entries are evicted.
+    Use is tracked by the modification time of the entry directory
+    """
+
+    TMP_PREFIX = '.tmp'
+
+    def __init__(self, cache_dir, max_size=None):
+        """
+        Constructor
+
+        :param cache_dir: Directory to store cache entries in
+        :type cache_dir: str
+        :param max_size: Maximum size of cache in bytes. If ``None``
+                         the cache is never pruned automatically
+        :type max_size: int
+        """
+        if cache_dir is None:
+            raise CellmapsGenerateHierarchyError('cache_dir is None')
+        self._cache_dir = os.path.abspath(cache_dir)
+        self._max_size = max_size
+
+    def get_cache_dir(self):
+        """
+        Gets cache directory
+
+        :return: cache directory
+        :rtype: str
+        """
+        return self._cache_dir
+
+    def get_max_size(self):
+        """
+        Gets maximum size of cache
+
+        :return: maximum size in bytes or ``None`` if unbounded
+        :rtype: int
+        """
+        return self._max_size
+
+    def _get_entry_path(self, key):
+        """
+        Gets path to entry directory for **key**
+
+        :param key:
+        :type key: str
+        :return:
+        :rtype: str
+        """
+        if key is None or len(key) == 0 or os.sep in key or key.startswith('.'):
+            raise CellmapsGenerateHierarchyError('Invalid cache key: ' + str(key))
+        return os.path.join(self._cache_dir, key)
+
+    def get(self, key):
+        """
+        Gets directory of entry matching **key** marking it as
+        most recently used
+
+        :param key:
+        :type key: str
+        :return: path to entry directory or ``None`` if not in cache
+        :rtype: str
+        """
+        entry_path = self._get_entry_path(key)
+        if not os.path.isdir(entry_path):
+            return None
+        try:
+            os.utime(entry_path)
+        except OSError as oe:
+            logger.debug('Unable to update access time of ' + entry_path + ' : ' + str(oe))
+        return entry_path
+
+    def get_new_entry_dir(self):
+        """
+        Creates a temporary directory, within the cache directory, where
+        files for a new entry can be written before calling :py:meth:`put`
+
+        :return: path to temporary directory
+        :rtype: str
+        """
+        os.makedirs(self._cache_dir, exist_ok=True)
+        return tempfile.mkdtemp(prefix=FileCache.TMP_PREFIX, dir=self._cache_dir)
+
+    def put(self, key, entry_dir):
+        """
+        Moves **entry_dir**, usually created by :py:meth:`get_new_entry_dir`,
+        into cache under **key**, replacing any existing entry, and then evicts
+        least recently used entries if cache exceeds its maximum size
+
+        :param key:
+        :type key: str
+        :param entry_dir: Directory with files for entry
+        :type entry_dir: str
+        :return: path to entry directory
+        :rtype: str
+        """
+        entry_path = self._get_entry_path(key)
+        os.makedirs(self._cache_dir, exist_ok=True)
+        self.remove(key)
+        try:
+            os.rename(entry_dir, entry_path)
+        except OSError:
+            if not os.path.isdir(entry_path):
+                raise
+            # another process added the same entry first
+            shutil.rmtree(entry_dir, ignore_errors=True)
+        os.utime(entry_path)
+        if self._max_size is not None:
+            self.prune(max_size=self._max_size, keep=[key])
+        return entry_path
+
+    def remove(self, key):
+        """
+        Removes entry matching **key** from cache
+
+        :param key:
+        :type key: str
+        """
+        entry_path = self._get_entry_path(key)
+        if os.path.isdir(entry_path):
+            shutil.rmtree(entry_path, ignore_errors=True)
+
+    @staticmethod
+    def _get_dir_size(path):
+        """
+        Gets size in bytes of all files under **path**
+
+        :param path:
+        :type path: str
+        :return:
+        :rtype: int
+        """
+        total = 0
+        for root, dirs, files in os.walk(path):
+            for f in files:
+                try:
+                    total += os.path.getsize(os.path.join(root, f))
+                except OSError:
+                    pass
+        return total
+
+    def get_entries(self):
+        """
+        Gets entries in cache ordered from least to most recently used
+
+        :return: list of dicts with ``key``, ``size`` in bytes and
+                 ``last_used`` time in seconds since epoch
+        :rtype: list
+        """
+        if not os.path.isdir(self._cache_dir):
+            return []
+        entries = []
+        for key in os.listdir(self._cache_dir):
+            entry_path = os.path.join(self._cache_dir, key)
+            if key.startswith('.') or not os.path.isdir(entry_path):
+                continue
+            try:
+                last_used = os.path.getmtime(entry_path)
+            except OSError:
+                continue
+            entries.append({'key': key,
+                            'size': self._get_dir_size(entry_path),
+                            'last_used': last_used})
+        entries.sort(key=lambda x: x['last_used'])
+        return entries
+
+    def get_size(self):
+        """
+        Gets size of cache in bytes
+
+        :return:
+        :rtype: int
+        """
+        return sum([e['size'] for e in self.get_entries()])
+
+    def _remove_stale_tmp_dirs(self, max_age=86400):
+        """
+        Removes temporary entry directories older than **max_age** seconds
+        left behind by runs that did not finish
+
+        :param max_age:
+        :type max_age: int
+        """
+        if not os.path.isdir(self._cache_dir):
+            return
+        now = time.time()
+        for name in os.listdir(self._cache_dir):
+            path = os.path.join(self._cache_dir, name)
+            if not name.startswith(FileCache.TMP_PREFIX) or not os.path.isdir(path):
+                continue
+            try:
+                if now - os.path.getmtime(path) > max_age:
+                    shutil.rmtree(path, ignore_errors=True)
+            except OSError:
+                pass
+
+    def prune(self, max_size=0, keep=None):
+        """
+        Evicts least recently used entries until cache size
+        is at most **max_size** bytes
+
+        :param max_size: Size in bytes to shrink cache to, ``0`` empties cache
+        :type max_size: int
+        :param keep: Keys that should not be evicted
+        :type keep: list
+        :return: keys of evicted entries
+        :rtype: list
+        """
+        self._remove_stale_tmp_dirs()
+        entries = self.get_entries()
+        total = sum([e['size'] for e in entries])
+        removed = []
+        for entry in entries:
+            if total <= max_size:
+                break
+            if keep is not None and entry['key'] in keep:
+                continue
+            logger.debug('Evicting cache entry ' + entry['key'] + ' of size ' + str(entry['size']))
+            self.remove(entry['key'])
+            total -= entry['size']
+            removed.append(entry['key'])
+        return removed
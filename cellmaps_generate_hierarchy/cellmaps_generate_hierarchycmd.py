@@ -4,9 +4,11 @@ import argparse
 import json
 import os
 import sys
+import time
 import logging
 import logging.config
 import getpass
+import tempfile
 
 from cellmaps_utils import logutils
 from cellmaps_utils import constants
@@ -16,16 +18,38 @@ from cellmaps_generate_hierarchy.exceptions import CellmapsGenerateHierarchyErro
 from cellmaps_utils.hidefconverter import HierarchyToHiDeFConverter
 from cellmaps_utils.ndexupload import NDExHierarchyUploader
 from cellmaps_generate_hierarchy.ppi import CosineSimilarityPPIGenerator
+from cellmaps_generate_hierarchy.ppi import KNNCosineSimilarityPPIGenerator
+from cellmaps_generate_hierarchy.cache import FileCache
 from cellmaps_generate_hierarchy.hierarchy import CDAPSHiDeFHierarchyGenerator
 from cellmaps_generate_hierarchy.maturehierarchy import HiDeFHierarchyRefiner
 from cellmaps_generate_hierarchy.runner import CellmapsGenerateHierarchy
 from cellmaps_generate_hierarchy.layout import CytoscapeJSBreadthFirstLayout
 from cellmaps_generate_hierarchy.hcx import HCXFromCDAPSCXHierarchy
+from cellmaps_generate_hierarchy.termoverlap import TermOverlap
+from cellmaps_generate_hierarchy.sweep import HierarchyParameterSweep
 
 logger = logging.getLogger(__name__)
 
 CO_EMBEDDINGDIRS = '--coembedding_dirs'
 
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'cellmaps_generate_hierarchy')
+
+EMBEDDING_CACHE_SUBDIR = 'embeddings'
+
+EMBEDDING_CACHE_MAX_SIZE_DEFAULT = 5.0
+
+SIMILARITY_CACHE_SUBDIR = 'similarity'
+
+CACHE_MAX_SIZE_DEFAULT = 10.0
+
+HIDEF_CACHE_SUBDIR = 'hidef'
+
+HIDEF_CACHE_MAX_SIZE_DEFAULT = 1.0
+
+REDUCTION_REPORT_FILE = 'ppi_reduction_report.json'
+
+TERM_STABILITY_FILE = 'term_stability.tsv'
+
 
 def _parse_arguments(desc, args):
     """
@@ -43,14 +67,30 @@ def _parse_arguments(desc, args):
     parser.add_argument('outdir', help='Output directory')
     parser.add_argument(CO_EMBEDDINGDIRS, nargs="+",
                         help='Directories where coembedding was run')
-    parser.add_argument('--mode', choices=['run', 'ndexsave', 'convert'], default='run',
+    parser.add_argument('--mode', choices=['run', 'ndexsave', 'convert', 'compare', 'sweep', 'cache'],
+                        default='run',
                         help='Processing mode. If set to "run" then hierarchy is generated. If '
                              'set to "ndexsave", it is assumes hierarchy has been generated '
                              '(named hierarchy.cx2 and parent_hierarchy.cx2) and '
                              'put in <outdir> passed in via the command line and this tool '
                              'will save the hierarchy to NDEx using --ndexserver, --ndexuser, and '
                              '--ndexpassword credentials. If set to convert, it is assumes hierarchy has been generated'
-                             ' (named hierarchy.cx2) and it converts the hierarchy to HiDeF .nodes and .edges files')
+                             ' (named hierarchy.cx2) and it converts the hierarchy to HiDeF .nodes and .edges files. '
+                             'If set to compare, the terms of the first HiDeF .nodes file passed via '
+                             '--compare_nodes_files are compared to those of the other files and the support '
+                             'of each term is written to ' + TERM_STABILITY_FILE + ' in <outdir>. If set to '
+                             'sweep, PPI networks and edge lists are generated once and a hierarchy is generated '
+                             'for every combination of --sweep_* parameters. If set to cache, entries of the '
+                             'embedding, similarity and HiDeF caches under --cache_dir are listed, after removing '
+                             'least recently used entries beyond their maximum size if --prune_cache is set')
+    parser.add_argument('--compare_nodes_files', nargs='+',
+                        help='HiDeF .nodes files for compare mode. Terms of the first file are compared '
+                             'to terms of the rest, such as bootstrap replicates or hierarchies built '
+                             'with other parameters')
+    parser.add_argument('--compare_jaccard_threshold', type=float,
+                        default=TermOverlap.JACCARD_THRESHOLD,
+                        help='Minimum Jaccard similarity for two terms to be considered the same '
+                             'in compare mode')
     parser.add_argument('--hcx_dir',
                         help='Input directory for convert mode with hierarchy in hcx to be converted to HiDeF .nodes '
                              'and .edges files')
@@ -86,12 +126,102 @@ def _parse_arguments(desc, args):
                              'parent-child pair')
     parser.add_argument('--min_system_size', default=HiDeFHierarchyRefiner.MIN_SYSTEM_SIZE, type=float,
                         help='Minimum number of proteins each system must have to be kept')
+    parser.add_argument('--sweep_algorithms', nargs='+',
+                        help='HiDeF clustering algorithms to try in sweep mode. If unset, --algorithm is used')
+    parser.add_argument('--sweep_maxres', nargs='+', type=float,
+                        help='HiDeF max resolutions to try in sweep mode. If unset, --maxres is used')
+    parser.add_argument('--sweep_k', nargs='+', type=int,
+                        help='HiDeF stability parameters to try in sweep mode. If unset, --k is used')
+    parser.add_argument('--sweep_containment_thresholds', nargs='+', type=float,
+                        help='Containment index thresholds to try in sweep mode. If unset, '
+                             '--containment_threshold is used')
+    parser.add_argument('--sweep_jaccard_thresholds', nargs='+', type=float,
+                        help='Jaccard index thresholds to try in sweep mode. If unset, '
+                             '--jaccard_threshold is used')
     parser.add_argument('--ppi_cutoffs', nargs='+', type=float,
                         default=CosineSimilarityPPIGenerator.PPI_CUTOFFS,
                         help='Cutoffs used to generate PPI input networks. For example, '
                              'a value of 0.1 means to generate PPI input network using the '
                              'top ten percent of coembedding entries. Each cutoff generates '
                              'another PPI network')
+    budget_group = parser.add_mutually_exclusive_group()
+    budget_group.add_argument('--ppi_edge_budget', type=float,
+                              help='If set, the PPI network for the largest --ppi_cutoffs value '
+                                   'has this many edges, whatever the number of proteins, and '
+                                   'networks for the other cutoffs get a proportional share. '
+                                   'For example: 2e6')
+    budget_group.add_argument('--ppi_avg_degree', type=float,
+                              help='If set, the PPI network for the largest --ppi_cutoffs value '
+                                   'has enough edges to give this average node degree and '
+                                   'networks for the other cutoffs get a proportional share')
+    parser.add_argument('--ppi_reduction', choices=CosineSimilarityPPIGenerator.REDUCTIONS,
+                        help='If set, each embedding fold is reduced to fewer dimensions before '
+                             'cosine similarities are computed, using principal component analysis '
+                             'or a random projection. Requires --ppi_reduced_dims, or for pca '
+                             '--ppi_explained_variance')
+    parser.add_argument('--ppi_reduced_dims', type=int,
+                        help='Number of dimensions to reduce embeddings to with --ppi_reduction')
+    parser.add_argument('--ppi_explained_variance', type=float,
+                        help='Fraction of variance, between 0 and 1, to keep with '
+                             '--ppi_reduction pca when --ppi_reduced_dims is not set')
+    parser.add_argument('--ppi_reduction_seed', type=int, default=0,
+                        help='Seed for --ppi_reduction random_projection')
+    parser.add_argument('--ppi_reduction_report', action='store_true',
+                        help='If set, also computes the exact similarities and writes ' +
+                             REDUCTION_REPORT_FILE + ' to output directory comparing top '
+                             'edges found with and without --ppi_reduction')
+    parser.add_argument('--ppi_knn', nargs='+', type=int,
+                        help='If set, PPI input networks are built by connecting each protein to '
+                             'its K most similar proteins, one network per value, instead of '
+                             'using --ppi_cutoffs. Scales to much larger numbers of proteins. '
+                             '--ppi_reduction flags also apply, but --ppi_edge_budget, '
+                             '--ppi_avg_degree and --ppi_reduction_report cannot be used. '
+                             'For example: 5 10 20')
+    parser.add_argument('--ppi_knn_mode', choices=KNNCosineSimilarityPPIGenerator.MODES,
+                        default=KNNCosineSimilarityPPIGenerator.SYMMETRIC_MODE,
+                        help='Used with --ppi_knn. ' + KNNCosineSimilarityPPIGenerator.SYMMETRIC_MODE +
+                             ' keeps an edge if either protein is a nearest neighbor of the other, ' +
+                             KNNCosineSimilarityPPIGenerator.MUTUAL_MODE + ' requires both')
+    parser.add_argument('--ppi_knn_index', choices=KNNCosineSimilarityPPIGenerator.INDEXES,
+                        default=KNNCosineSimilarityPPIGenerator.EXACT_INDEX,
+                        help='Used with --ppi_knn. ' + KNNCosineSimilarityPPIGenerator.EXACT_INDEX +
+                             ' compares all pairs of proteins, ' +
+                             KNNCosineSimilarityPPIGenerator.RANDOM_PROJECTION_INDEX +
+                             ' is approximate and only compares proteins hashed to the same '
+                             'bucket by random hyperplanes')
+    parser.add_argument('--ppi_knn_seed', type=int, default=0,
+                        help='Seed for random hyperplanes of --ppi_knn_index ' +
+                             KNNCosineSimilarityPPIGenerator.RANDOM_PROJECTION_INDEX)
+    parser.add_argument('--fold_weights', nargs='+', type=float,
+                        help='Weight of each embedding fold, in the same order as '
+                             + CO_EMBEDDINGDIRS + ', used when averaging similarities '
+                             'across folds. If unset, all folds are weighted equally')
+    parser.add_argument('--workers', default=1, type=int,
+                        help='Number of processes used to compute cosine similarities for '
+                             '--ppi_cutoffs networks and threads used to write HiDeF edge list '
+                             'files. Nearest neighbors for --ppi_knn are found in a single process')
+    parser.add_argument('--cache_dir', default=DEFAULT_CACHE_DIR,
+                        help='Directory where cached data, such as binary copies of .tsv '
+                             'embeddings and top cosine similarity edges, is stored and '
+                             'reused across runs')
+    parser.add_argument('--embedding_cache_max_size', default=EMBEDDING_CACHE_MAX_SIZE_DEFAULT, type=float,
+                        help='Maximum size in gigabytes of cached binary copies of .tsv embeddings. When '
+                             'exceeded, least recently used entries are removed')
+    parser.add_argument('--cache_max_size', default=CACHE_MAX_SIZE_DEFAULT, type=float,
+                        help='Maximum size in gigabytes of cached similarity edges, which are '
+                             'only cached for --ppi_cutoffs networks. When exceeded, least '
+                             'recently used entries are removed')
+    parser.add_argument('--hidef_cache_max_size', default=HIDEF_CACHE_MAX_SIZE_DEFAULT, type=float,
+                        help='Maximum size in gigabytes of cached HiDeF output. HiDeF output is reused '
+                             'when edge lists and HiDeF parameters match a previous run. When '
+                             'exceeded, least recently used entries are removed')
+    parser.add_argument('--prune_cache', action='store_true',
+                        help='In cache mode, removes least recently used entries of each cache until '
+                             'it is no larger than --embedding_cache_max_size, --cache_max_size or '
+                             '--hidef_cache_max_size. Set all to 0 to empty the caches')
+    parser.add_argument('--no_cache', action='store_true',
+                        help='If set, cached data is neither read nor written and '
+                             'all similarities are recomputed')
     parser.add_argument('--weighted_edgelist', action='store_true',
                         help='If set, generates a single weighted edge list with cosine '
                              'similarity values instead of multiple cutoff-based edge lists. '
@@ -104,6 +234,15 @@ def _parse_arguments(desc, args):
     parser.add_argument('--bootstrap_edges', type=validate_percentage,
                         default=CDAPSHiDeFHierarchyGenerator.BOOTSTRAP_EDGES,
                         help='Percentage of edges that will be removed randomly for bootstrapping, up to 99.')
+    parser.add_argument('--bootstrap_seed', type=int,
+                        help='Seed for random removal of edges with --bootstrap_edges. If unset, '
+                             'a different set of edges is removed every run')
+    parser.add_argument('--bootstrap_replicates', type=int, default=0,
+                        help='If greater than 0, HiDeF is also run on this many replicates of the PPI '
+                             'networks, each with --bootstrap_edges percent of edges removed, and each '
+                             'term of the hierarchy gets the fraction of replicates that found it as '
+                             'its HiDeF_bootstrap_support attribute. Up to --workers HiDeF runs happen '
+                             'at once. Requires --bootstrap_edges')
     parser.add_argument('--skip_layout', action='store_true',
                         help='If set, skips layout of hierarchy step')
     parser.add_argument('--ndexserver', default='ndexbio.org',
@@ -117,7 +256,26 @@ def _parse_arguments(desc, args):
                         help='If set, makes Hierarchy and interactome network loaded onto '
                              'NDEx publicly visible')
     parser.add_argument('--keep_intermediate_files', action='store_true',
-                        help='If set, ppi network cx files will be saved.')
+                        help='If set, ppi network cx files will be saved. Otherwise '
+                             'ppi networks are kept in memory and not written as cx files')
+    parser.add_argument('--ppi_edge_store', action='store_true',
+                        help='If set, edges of all ppi networks are written once to a compact, '
+                             'memory mapped, edge store in the output directory and the per '
+                             'network edge lists given to HiDeF are only written temporarily to '
+                             '--scratch_dir')
+    parser.add_argument('--scratch_dir',
+                        help='Directory where temporary edge lists given to HiDeF are written '
+                             'and removed once HiDeF finishes. If unset, edge lists are kept in '
+                             'the output directory unless --ppi_edge_store is set, in which case '
+                             'the system temporary directory is used')
+    parser.add_argument('--hidef_in_process', action='store_true',
+                        help='If set, HiDeF is imported and run within this process on the '
+                             'in memory networks instead of invoking --hidef_cmd as a separate '
+                             'python process. Falls back to --hidef_cmd if HiDeF cannot be imported')
+    parser.add_argument('--hidef_timeout', type=float,
+                        default=CDAPSHiDeFHierarchyGenerator.HIDEF_TIMEOUT,
+                        help='Seconds --hidef_cmd may run before it, and any processes it '
+                             'started, are killed')
     parser.add_argument('--gene_node_attributes', nargs="+",
                         help='Accepts ro-crates that are output of imagedownloader or ppidownloader, '
                              'or tsv files with gene node attributes')
@@ -152,6 +310,87 @@ def validate_percentage(value):
     return f_value
 
 
+def _compare_hierarchies(theargs):
+    """
+    Compares terms of first HiDeF nodes file in **theargs.compare_nodes_files**
+    to terms of the rest and writes support of each term to
+    :py:const:`TERM_STABILITY_FILE` in **theargs.outdir**
+
+    :param theargs: arguments parsed by :py:mod:`argparse`
+    :type theargs: :py:class:`argparse.Namespace`
+    :return: ``0`` upon success
+    :rtype: int
+    """
+    if theargs.compare_nodes_files is None or len(theargs.compare_nodes_files) < 2:
+        raise CellmapsGenerateHierarchyError('In compare mode, at least two files must be '
+                                             'passed via --compare_nodes_files')
+    if not os.path.isdir(theargs.outdir):
+        os.makedirs(theargs.outdir, mode=0o755)
+    term_overlap = TermOverlap(jaccard_threshold=theargs.compare_jaccard_threshold)
+    stability_df = term_overlap.compare_nodes_files(theargs.compare_nodes_files[0],
+                                                    theargs.compare_nodes_files[1:])
+    stability_df.to_csv(os.path.join(theargs.outdir, TERM_STABILITY_FILE), sep='\t', index=False)
+    return 0
+
+
+def _check_knn_arguments(theargs):
+    """
+    Checks that no flag that only applies to PPI networks built
+    from --ppi_cutoffs is set along with --ppi_knn
+
+    :param theargs: arguments parsed by :py:mod:`argparse`
+    :type theargs: :py:class:`argparse.Namespace`
+    :raises CellmapsGenerateHierarchyError: If such a flag is set
+    """
+    if theargs.ppi_knn is None:
+        return
+    for flag, is_set in [('--ppi_edge_budget', theargs.ppi_edge_budget is not None),
+                         ('--ppi_avg_degree', theargs.ppi_avg_degree is not None),
+                         ('--ppi_reduction_report', theargs.ppi_reduction_report)]:
+        if is_set:
+            raise CellmapsGenerateHierarchyError(flag + ' cannot be used with --ppi_knn')
+
+
+def _get_caches(theargs):
+    """
+    Gets embedding, similarity and HiDeF caches under **theargs.cache_dir**
+
+    :param theargs: arguments parsed by :py:mod:`argparse`
+    :type theargs: :py:class:`argparse.Namespace`
+    :return: (embedding cache, similarity cache, HiDeF cache)
+    :rtype: tuple
+    """
+    return (FileCache(os.path.join(theargs.cache_dir, EMBEDDING_CACHE_SUBDIR),
+                      max_size=int(theargs.embedding_cache_max_size * 1024 ** 3)),
+            FileCache(os.path.join(theargs.cache_dir, SIMILARITY_CACHE_SUBDIR),
+                      max_size=int(theargs.cache_max_size * 1024 ** 3)),
+            FileCache(os.path.join(theargs.cache_dir, HIDEF_CACHE_SUBDIR),
+                      max_size=int(theargs.hidef_cache_max_size * 1024 ** 3)))
+
+
+def _show_caches(theargs):
+    """
+    Prints entries of embedding, similarity and HiDeF caches, least recently
+    used first, pruning them first if **theargs.prune_cache** is set
+
+    :param theargs: arguments parsed by :py:mod:`argparse`
+    :type theargs: :py:class:`argparse.Namespace`
+    :return: ``0`` upon success
+    :rtype: int
+    """
+    for cache in _get_caches(theargs):
+        if theargs.prune_cache:
+            removed = cache.prune(max_size=cache.get_max_size())
+            print('Removed ' + str(len(removed)) + ' entries from ' + cache.get_cache_dir())
+        entries = cache.get_entries()
+        print(cache.get_cache_dir() + ' : ' + str(len(entries)) + ' entries, ' +
+              str(sum([e['size'] for e in entries])) + ' bytes')
+        for entry in entries:
+            print('\t'.join([entry['key'], str(entry['size']),
+                             time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(entry['last_used']))]))
+    return 0
+
+
 def main(args):
     """
     Main entry point for program
@@ -211,9 +450,15 @@ def main(args):
                 os.makedirs(theargs.outdir, mode=0o755)
             hidef_converter = HierarchyToHiDeFConverter(theargs.outdir, input_dir=hcx_dir)
             return hidef_converter.generate_hidef_files()
+        if theargs.mode == 'compare':
+            return _compare_hierarchies(theargs)
+        if theargs.mode == 'cache':
+            return _show_caches(theargs)
 
         if theargs.coembedding_dirs is None:
-            raise CellmapsGenerateHierarchyError('In run mode, coembedding_dirs parameter is required.')
+            raise CellmapsGenerateHierarchyError('In ' + theargs.mode + ' mode, coembedding_dirs parameter '
+                                                 'is required.')
+        _check_knn_arguments(theargs)
 
         provenance = ProvenanceUtil()
         
@@ -223,8 +468,42 @@ def main(args):
         else:
             cutoffs = theargs.ppi_cutoffs
         
-        ppigen = CosineSimilarityPPIGenerator(embeddingdirs=theargs.coembedding_dirs,
-                                              cutoffs=cutoffs)
+        if theargs.no_cache:
+            embedding_cache = None
+            similarity_cache = None
+            hidef_cache = None
+        else:
+            embedding_cache, similarity_cache, hidef_cache = _get_caches(theargs)
+        reduction_report_file = None
+        if theargs.ppi_reduction_report and theargs.ppi_reduction is not None:
+            reduction_report_file = os.path.join(theargs.outdir, REDUCTION_REPORT_FILE)
+        if theargs.ppi_knn is not None:
+            k_values = [theargs.ppi_knn[0]] if theargs.weighted_edgelist else theargs.ppi_knn
+            ppigen = KNNCosineSimilarityPPIGenerator(embeddingdirs=theargs.coembedding_dirs,
+                                                     k_values=k_values,
+                                                     mode=theargs.ppi_knn_mode,
+                                                     index=theargs.ppi_knn_index,
+                                                     fold_weights=theargs.fold_weights,
+                                                     embedding_cache=embedding_cache,
+                                                     random_seed=theargs.ppi_knn_seed,
+                                                     reduction=theargs.ppi_reduction,
+                                                     reduced_dims=theargs.ppi_reduced_dims,
+                                                     explained_variance=theargs.ppi_explained_variance,
+                                                     reduction_seed=theargs.ppi_reduction_seed)
+        else:
+            ppigen = CosineSimilarityPPIGenerator(embeddingdirs=theargs.coembedding_dirs,
+                                                  cutoffs=cutoffs,
+                                                  fold_weights=theargs.fold_weights,
+                                                  embedding_cache=embedding_cache,
+                                                  similarity_cache=similarity_cache,
+                                                  workers=theargs.workers,
+                                                  edge_budget=theargs.ppi_edge_budget,
+                                                  avg_degree=theargs.ppi_avg_degree,
+                                                  reduction=theargs.ppi_reduction,
+                                                  reduced_dims=theargs.ppi_reduced_dims,
+                                                  explained_variance=theargs.ppi_explained_variance,
+                                                  random_seed=theargs.ppi_reduction_seed,
+                                                  reduction_report_file=reduction_report_file)
 
         refiner = HiDeFHierarchyRefiner(ci_thre=theargs.containment_threshold,
                                         ji_thre=theargs.jaccard_threshold,
@@ -234,6 +513,10 @@ def main(args):
 
         converter = HCXFromCDAPSCXHierarchy()
 
+        scratch_dir = theargs.scratch_dir
+        if scratch_dir is None and theargs.ppi_edge_store:
+            scratch_dir = tempfile.gettempdir()
+
         hiergen = CDAPSHiDeFHierarchyGenerator(author='cellmaps_generate_hierarchy',
                                                refiner=refiner,
                                                hcxconverter=converter,
@@ -241,7 +524,30 @@ def main(args):
                                                version=cellmaps_generate_hierarchy.__version__,
                                                provenance_utils=provenance,
                                                bootstrap_edges=theargs.bootstrap_edges,
-                                               weighted_mode=theargs.weighted_edgelist)
+                                               weighted_mode=theargs.weighted_edgelist,
+                                               bootstrap_seed=theargs.bootstrap_seed,
+                                               workers=theargs.workers,
+                                               scratch_dir=scratch_dir,
+                                               hidef_in_process=theargs.hidef_in_process,
+                                               hidef_timeout=theargs.hidef_timeout,
+                                               bootstrap_replicates=theargs.bootstrap_replicates,
+                                               hidef_cache=hidef_cache)
+        if theargs.mode == 'sweep':
+            return HierarchyParameterSweep(outdir=theargs.outdir,
+                                           ppigen=ppigen,
+                                           hiergen=hiergen,
+                                           algorithms=theargs.sweep_algorithms or [theargs.algorithm],
+                                           maxres_values=theargs.sweep_maxres or [theargs.maxres],
+                                           k_values=theargs.sweep_k or [theargs.k],
+                                           containment_thresholds=(theargs.sweep_containment_thresholds or
+                                                                   [theargs.containment_threshold]),
+                                           jaccard_thresholds=(theargs.sweep_jaccard_thresholds or
+                                                               [theargs.jaccard_threshold]),
+                                           min_term_size=theargs.min_system_size,
+                                           min_diff=theargs.min_diff,
+                                           workers=theargs.workers,
+                                           skip_logging=theargs.skip_logging).run()
+
         if theargs.skip_layout is True:
             layoutalgo = None
         else:
@@ -272,7 +578,8 @@ def main(args):
                                          ndexpassword=theargs.ndexpassword,
                                          visibility=theargs.visibility,
                                          keep_intermediate_files=theargs.keep_intermediate_files,
-                                         provenance=json_prov
+                                         provenance=json_prov,
+                                         ppi_edge_store=theargs.ppi_edge_store
                                          ).run()
     except Exception as e:
         logger.exception('Caught exception: ' + str(e))
@@ -217,7 +217,7 @@ class HCXFromCDAPSCXHierarchy(object):
 
         return converted_network
 
-    def _add_hcx_attributes_to_hierarchy(self, hierarchy, parent_network):
+    def _add_hcx_attributes_to_hierarchy(self, hierarchy, parent_network, interactome_name_map=None):
         """
         Updates the provided hierarchy with HCX attributes. These attributes applied to
         network structure, root nodes, and member nodes.
@@ -226,6 +226,9 @@ class HCXFromCDAPSCXHierarchy(object):
         :type hierarchy: :py:class:`~ndex2.nice_cx_network.NiceCXNetwork`
         :param parent_network: The parent network.
         :type parent_network: :py:class:`~ndex2.nice_cx_network.NiceCXNetwork`
+        :param interactome_name_map: Node names to node ids of **parent_network**. If ``None``
+                                     the mapping is built from **parent_network**
+        :type interactome_name_map: dict
         :return: The updated hierarchy with the added HCX attributes.
         :rtype: :py:class:`~ndex2.nice_cx_network.NiceCXNetwork`
         """
@@ -237,13 +240,14 @@ class HCXFromCDAPSCXHierarchy(object):
         self._add_isroot_node_attribute(hierarchy, root_nodes=root_nodes)
 
         # get mapping of node names to node ids
-        interactome_name_map = self._get_mapping_of_node_names_to_ids(parent_network)
+        if interactome_name_map is None:
+            interactome_name_map = self._get_mapping_of_node_names_to_ids(parent_network)
 
         self._add_members_node_attribute(hierarchy,
                                          interactome_name_map=interactome_name_map)
         return hierarchy
 
-    def get_converted_hierarchy(self, hierarchy=None, parent_network=None):
+    def get_converted_hierarchy(self, hierarchy=None, parent_network=None, interactome_name_map=None):
         """
         Converts hierarchy in CX CDAPS format into HCX format and parent network
         from CX format into CX2 format
@@ -266,12 +270,16 @@ class HCXFromCDAPSCXHierarchy(object):
         :type hierarchy: :py:class:`~ndex2.nice_cx_network.NiceCXNetwork`
         :param parent_network: Parent network
         :type parent_network: :py:class:`~ndex2.nice_cx_network.NiceCXNetwork`
+        :param interactome_name_map: Node names to node ids of **parent_network**, if
+                                     already known, to avoid building it again
+        :type interactome_name_map: dict
         :return: (hierarchy as :py:class:`~ndex2.cx2.CX2Network`,
                   parent ppi as :py:class:`~ndex2.cx2.CX2Network`)
         :rtype: tuple
         """
         parent_network_cx2 = self._convert_and_style_network(parent_network, 'interactome_style.cx2')
-        hierarchy_with_hcx_attributes = self._add_hcx_attributes_to_hierarchy(hierarchy, parent_network)
+        hierarchy_with_hcx_attributes = self._add_hcx_attributes_to_hierarchy(hierarchy, parent_network,
+                                                                              interactome_name_map=interactome_name_map)
         hierarchy_hcx = self._convert_and_style_network(hierarchy_with_hcx_attributes, 'hierarchy_style.cx2')
 
         return hierarchy_hcx, parent_network_cx2
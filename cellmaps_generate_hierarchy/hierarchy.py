@@ -1,17 +1,28 @@
 import os
 import sys
 import csv
+import time
+import hashlib
+import shutil
+import signal
+import tempfile
 import logging
+import threading
 import subprocess
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date
-import random
 
+import numpy as np
+import pandas as pd
 import ndex2
 import cdapsutil
 import cellmaps_generate_hierarchy
 from cellmaps_utils import constants
 from cellmaps_utils.provenance import ProvenanceUtil
 from cellmaps_generate_hierarchy.exceptions import CellmapsGenerateHierarchyError
+from cellmaps_generate_hierarchy.termoverlap import TermOverlap
+from cellmaps_generate_hierarchy.cache import get_file_digest
 
 logger = logging.getLogger(__name__)
 
@@ -34,6 +45,7 @@ class HierarchyGenerator(object):
         self._author = author
         self._version = version
         self._generated_dataset_ids = []
+        self._resource_usage = []
 
     def get_generated_dataset_ids(self):
         """
@@ -43,11 +55,27 @@ class HierarchyGenerator(object):
         """
         return self._generated_dataset_ids
 
-    def get_hierarchy(self, networks, algorithm='leiden', maxres=80, k=10):
+    def get_resource_usage(self):
         """
-        Gets hierarchy
+        Gets resources used by external commands run by this object
+
+        :return: :py:class:`dict` per command with ``cmd``, ``exit_code``,
+                 ``wall_time``, ``user_cpu_time`` and ``system_cpu_time``
+                 in seconds and ``peak_rss`` in bytes
+        :rtype: list
+        """
+        return self._resource_usage
 
+    def get_hierarchy(self, networks, algorithm='leiden', maxres=80, k=10, network_edges=None):
+        """
+        Gets hierarchy
 
+        :param networks: Paths (without suffix ie .cx) to PPI networks
+        :type networks: list
+        :param network_edges: If set, edges of each network in **networks**,
+                              in the same order, used instead of reading
+                              the networks from disk
+        :type network_edges: list
         :return: (hierarchy as :py:class:`list`,
                   parent ppi as :py:class:`list`)
         :rtype: tuple
@@ -76,10 +104,48 @@ class CDAPSHiDeFHierarchyGenerator(HierarchyGenerator):
 
     PERSISTENCE_COL_NAME = 'HiDeF_persistence'
 
+    BOOTSTRAP_SUPPORT_COL_NAME = 'HiDeF_bootstrap_support'
+
+    BOOTSTRAP_SUPPORT_TSV = 'bootstrap_support.tsv'
+
+    # minimum jaccard similarity for a term of a bootstrap replicate
+    # to count as the same term, same as HiDeF's default tau
+    BOOTSTRAP_SUPPORT_JACCARD = 0.75
+
     HIERARCHY_PARENT_CUTOFF = 0.1
 
     BOOTSTRAP_EDGES = 0
 
+    EDGELIST_WEIGHT_FORMAT = '%.6g'
+
+    # HiDeF parameters not exposed by this tool, set to
+    # the defaults of hidef_finder.py so both ways of
+    # running HiDeF give the same result
+    HIDEF_MINRES = 0.001
+
+    HIDEF_DENSITY = 0.1
+
+    HIDEF_TAU = 0.75
+
+    HIDEF_SAMPLE = 1.0
+
+    HIDEF_CONSENSUS = 75
+
+    HIDEF_TIMEOUT = 86400
+
+    HEARTBEAT_INTERVAL = 300
+
+    # seconds between SIGTERM and SIGKILL of a timed out command
+    KILL_GRACE_PERIOD = 10
+
+    # lines of standard out/error kept for error messages
+    CMD_OUTPUT_TAIL_LINES = 100
+
+    # bump when format of cached HiDeF output changes
+    HIDEF_CACHE_VERSION = '1'
+
+    HIDEF_OUTPUT_SUFFIXES = ['.nodes', '.edges', '.weaver']
+
     def __init__(self, hidef_cmd='hidef_finder.py',
                  provenance_utils=ProvenanceUtil(),
                  refiner=None,
@@ -88,7 +154,15 @@ class CDAPSHiDeFHierarchyGenerator(HierarchyGenerator):
                  author='cellmaps_generate_hierarchy',
                  version=cellmaps_generate_hierarchy.__version__,
                  bootstrap_edges=BOOTSTRAP_EDGES,
-                 weighted_mode=False):
+                 weighted_mode=False,
+                 bootstrap_seed=None,
+                 workers=1,
+                 scratch_dir=None,
+                 hidef_in_process=False,
+                 hidef_timeout=HIDEF_TIMEOUT,
+                 heartbeat_interval=HEARTBEAT_INTERVAL,
+                 bootstrap_replicates=0,
+                 hidef_cache=None):
         """
 
         :param hidef_cmd: HiDeF command line binary
@@ -97,8 +171,48 @@ class CDAPSHiDeFHierarchyGenerator(HierarchyGenerator):
         :param author:
         :type author: str
         :param version:
+        :param bootstrap_edges: Percentage of edges to randomly remove from each network
+        :type bootstrap_edges: int
         :param weighted_mode: If True, generates weighted edge lists with 3 columns
         :type weighted_mode: bool
+        :param bootstrap_seed: Seed for random removal of edges, if ``None``
+                               a different set of edges is removed every run
+        :type bootstrap_seed: int
+        :param workers: Number of threads used to write edge list files
+        :type workers: int
+        :param scratch_dir: If set, edge list files given to HiDeF are written to a
+                            temporary directory created under this directory and
+                            removed once HiDeF finishes, instead of being written,
+                            and registered, next to the PPI networks
+        :type scratch_dir: str
+        :param hidef_in_process: If ``True``, HiDeF is run within this process through
+                                 the :py:mod:`hidef` package, given graphs built from
+                                 edges held in memory, instead of running **hidef_cmd**.
+                                 If :py:mod:`hidef` cannot be imported, **hidef_cmd** is run
+        :type hidef_in_process: bool
+        :param hidef_timeout: Seconds HiDeF command may run before it, and
+                              any processes it started, are killed
+        :type hidef_timeout: int or float
+        :param heartbeat_interval: Seconds between log messages noting
+                                   HiDeF command is still running
+        :type heartbeat_interval: int or float
+        :param bootstrap_replicates: If greater than ``0``, HiDeF is run on the
+                                     networks with no edges removed and on this
+                                     many replicates of the networks each with
+                                     **bootstrap_edges** percent of edges removed.
+                                     Each term of the resulting hierarchy gets
+                                     the fraction of replicates that found it
+                                     as its :py:const:`BOOTSTRAP_SUPPORT_COL_NAME`
+                                     attribute. Up to **workers** replicates run
+                                     at once
+        :type bootstrap_replicates: int
+        :param hidef_cache: Cache used to store and reuse HiDeF output, keyed by
+                            the contents of the edge list files, the HiDeF
+                            parameters and the version of HiDeF, so only
+                            changing refiner or output settings skips HiDeF
+        :type hidef_cache: :py:class:`~cellmaps_generate_hierarchy.cache.FileCache`
+        :raises CellmapsGenerateHierarchyError: If **bootstrap_replicates** is
+                                                set, but **bootstrap_edges** is not
         """
         super().__init__(provenance_utils=provenance_utils,
                          author=author,
@@ -113,6 +227,19 @@ class CDAPSHiDeFHierarchyGenerator(HierarchyGenerator):
             self._hidef_cmd = hidef_cmd
         self._bootstrap_edges = bootstrap_edges
         self._weighted_mode = weighted_mode
+        self._bootstrap_seed = bootstrap_seed
+        self._rng = np.random.default_rng(bootstrap_seed)
+        self._workers = max(1, workers)
+        self._scratch_dir = scratch_dir
+        self._hidef_in_process = hidef_in_process
+        self._edgelist_arrays = {}
+        self._hidef_timeout = hidef_timeout
+        self._heartbeat_interval = heartbeat_interval
+        if bootstrap_replicates > 0 and bootstrap_edges <= 0:
+            raise CellmapsGenerateHierarchyError('bootstrap_edges must be greater than 0 '
+                                                 'to use bootstrap_replicates')
+        self._bootstrap_replicates = bootstrap_replicates
+        self._hidef_cache = hidef_cache
 
     def _get_max_node_id(self, nodes_file):
         """
@@ -236,17 +363,24 @@ class CDAPSHiDeFHierarchyGenerator(HierarchyGenerator):
                                  str(cluster_node_map[row[1]]) + ',c-c;')
         out_stream.write('",')
 
-    def write_persistence_node_attribute(self, out_stream, persistence_map):
+    def write_persistence_node_attribute(self, out_stream, persistence_map, support_map=None):
         """
 
         :param out_stream:
         :param persistence_map:
+        :param support_map: If set, map of node id to bootstrap support
+                            written as :py:const:`BOOTSTRAP_SUPPORT_COL_NAME`
+        :type support_map: dict
         :return:
         """
         out_stream.write('"' + CDAPSHiDeFHierarchyGenerator.NODE_CX_KEY_NAME + '": {')
         out_stream.write('"' + CDAPSHiDeFHierarchyGenerator.ATTR_DEC_NAME + '": [{')
         out_stream.write('"nodes": { "' + CDAPSHiDeFHierarchyGenerator.PERSISTENCE_COL_NAME +
-                         '": { "d": "integer", "a": "p1", "v": 0}}}],')
+                         '": { "d": "integer", "a": "p1", "v": 0}')
+        if support_map is not None:
+            out_stream.write(', "' + CDAPSHiDeFHierarchyGenerator.BOOTSTRAP_SUPPORT_COL_NAME +
+                             '": { "d": "double", "a": "p2", "v": 0.0}')
+        out_stream.write('}}],')
         out_stream.write('"nodes": [')
         is_first = True
         for key in persistence_map:
@@ -255,11 +389,14 @@ class CDAPSHiDeFHierarchyGenerator(HierarchyGenerator):
             else:
                 is_first = False
             out_stream.write('{"id": ' + str(key) + ',')
-            out_stream.write('"v": { "p1": ' + str(persistence_map[key]) + '}}')
+            out_stream.write('"v": { "p1": ' + str(persistence_map[key]))
+            if support_map is not None and key in support_map:
+                out_stream.write(', "p2": ' + str(support_map[key]))
+            out_stream.write('}}')
 
         out_stream.write(']}}')
 
-    def convert_hidef_output_to_cdaps(self, out_stream, outdir):
+    def convert_hidef_output_to_cdaps(self, out_stream, outdir, support_map=None):
         """
         Looks for x.nodes and x.edges in `outdir` directory
         to generate output in COMMUNITYDETECTRESULT format:
@@ -279,6 +416,9 @@ class CDAPSHiDeFHierarchyGenerator(HierarchyGenerator):
         :type out_stream: file like object
         :param outdir:
         :type outdir: str
+        :param support_map: If set, map of cluster name to bootstrap
+                            support added as a node attribute
+        :type support_map: dict
         :return: None
         """
         nodefile = os.path.join(outdir,
@@ -299,30 +439,181 @@ class CDAPSHiDeFHierarchyGenerator(HierarchyGenerator):
                                            cur_node_id)
         edge_file = os.path.join(outdir, CDAPSHiDeFHierarchyGenerator.HIDEF_OUT_PREFIX + '.pruned.edges')
         self.write_communities(out_stream, edge_file, cluster_node_map)
-        self.write_persistence_node_attribute(out_stream, persistence_map)
+        if support_map is not None:
+            support_map = {cluster_node_map[c]: v for c, v in support_map.items() if c in cluster_node_map}
+        self.write_persistence_node_attribute(out_stream, persistence_map, support_map=support_map)
         out_stream.write('\n')
         return None
 
-    def _run_cmd(self, cmd, cwd=None, timeout=86400):
+    @staticmethod
+    def _log_cmd_output(stream, stream_name, tail):
+        """
+        Logs each line read from **stream** as it is written by
+        a command, keeping the last lines in **tail**
+
+        :param stream: standard out or error of command
+        :param stream_name: name to prefix log messages with
+        :type stream_name: str
+        :param tail: last lines read
+        :type tail: :py:class:`collections.deque`
+        """
+        for line in iter(stream.readline, b''):
+            line = line.decode('utf-8', errors='replace').rstrip()
+            logger.debug(stream_name + ': ' + line)
+            tail.append(line)
+        stream.close()
+
+    @staticmethod
+    def _poll_cmd(p, block=False):
+        """
+        Checks if process **p** has exited, reaping it so the
+        resources it, and the processes it waited on, used are known
+
+        :param p: process
+        :type p: :py:class:`subprocess.Popen`
+        :param block: If ``True`` wait for process to exit
+        :type block: bool
+        :return: (``True`` if exited, :py:class:`resource.struct_rusage` or
+                 ``None`` if not exited or unavailable on this platform)
+        :rtype: tuple
         """
-        Runs command as a command line process
+        if p.returncode is not None:
+            return True, None
+        if not hasattr(os, 'wait4'):
+            if block:
+                p.wait()
+            return p.poll() is not None, None
+        pid, status, rusage = os.wait4(p.pid, 0 if block else os.WNOHANG)
+        if pid == 0:
+            return False, None
+        if os.WIFSIGNALED(status):
+            p.returncode = -os.WTERMSIG(status)
+        else:
+            p.returncode = os.WEXITSTATUS(status)
+        return True, rusage
+
+    def _kill_cmd(self, p):
+        """
+        Sends SIGTERM to process **p** and the processes it started, then
+        SIGKILL to any still running after
+        :py:const:`KILL_GRACE_PERIOD` seconds
+
+        :param p: process started in its own session
+        :type p: :py:class:`subprocess.Popen`
+        :return: resource usage of process or ``None``
+        :rtype: :py:class:`resource.struct_rusage`
+        """
+        if not hasattr(os, 'killpg'):
+            p.kill()
+            return self._poll_cmd(p, block=True)[1]
+        for sig in [signal.SIGTERM, signal.SIGKILL]:
+            try:
+                os.killpg(p.pid, sig)
+            except ProcessLookupError:
+                break
+            if sig == signal.SIGKILL:
+                break
+            deadline = time.time() + CDAPSHiDeFHierarchyGenerator.KILL_GRACE_PERIOD
+            while p.returncode is None and time.time() < deadline:
+                self._poll_cmd(p)
+                time.sleep(0.1)
+        return self._poll_cmd(p, block=True)[1]
+
+    def _record_resource_usage(self, cmd_name, p, wall_time, rusage):
+        """
+        Logs and adds resources used by command to
+        list returned by :py:meth:`get_resource_usage`
+
+        :param cmd_name:
+        :type cmd_name: str
+        :param p: exited process
+        :type p: :py:class:`subprocess.Popen`
+        :param wall_time: seconds command ran
+        :type wall_time: float
+        :param rusage: resource usage from :py:func:`os.wait4` or ``None``
+        :type rusage: :py:class:`resource.struct_rusage`
+        """
+        usage = {'cmd': cmd_name,
+                 'exit_code': p.returncode,
+                 'wall_time': round(wall_time, 3)}
+        if rusage is not None:
+            usage['user_cpu_time'] = round(rusage.ru_utime, 3)
+            usage['system_cpu_time'] = round(rusage.ru_stime, 3)
+            # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+            usage['peak_rss'] = rusage.ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+        logger.info('Resource usage: ' + str(usage))
+        self._resource_usage.append(usage)
+
+    def _run_cmd(self, cmd, cwd=None, timeout=None):
+        """
+        Runs command as a command line process in its own session, logging
+        standard out and error as they are written along with a message every
+        **heartbeat_interval** seconds, set in constructor, while it runs.
+        Resources used are added to :py:meth:`get_resource_usage`
 
         :param cmd_to_run: command to run as list
         :type cmd_to_run: list
-        :return: (return code, standard out, standard error)
+        :param cwd: working directory
+        :type cwd: str
+        :param timeout: Seconds to wait before killing command and the
+                        processes it started. If ``None``, **hidef_timeout**
+                        set in constructor is used
+        :type timeout: int or float
+        :raises CellmapsGenerateHierarchyError: If **timeout** is exceeded
+        :return: (return code, last lines of standard out, last lines of standard error)
         :rtype: tuple
         """
+        if timeout is None:
+            timeout = self._hidef_timeout
         logger.debug('Running command under ' + str(cwd) +
                      ' path: ' + str(cmd))
+        if len(cmd) > 1 and cmd[0] == self._python:
+            cmd_name = os.path.basename(str(cmd[1]))
+        else:
+            cmd_name = os.path.basename(str(cmd[0]))
+        start_time = time.time()
         p = subprocess.Popen(cmd, cwd=cwd,
                              stdout=subprocess.PIPE,
-                             stderr=subprocess.PIPE)
+                             stderr=subprocess.PIPE,
+                             start_new_session=hasattr(os, 'killpg'))
+        out_tail = deque(maxlen=CDAPSHiDeFHierarchyGenerator.CMD_OUTPUT_TAIL_LINES)
+        err_tail = deque(maxlen=CDAPSHiDeFHierarchyGenerator.CMD_OUTPUT_TAIL_LINES)
+        readers = [threading.Thread(target=self._log_cmd_output, args=(p.stdout, cmd_name, out_tail), daemon=True),
+                   threading.Thread(target=self._log_cmd_output, args=(p.stderr, cmd_name, err_tail), daemon=True)]
+        for reader in readers:
+            reader.start()
+
+        timed_out = False
+        next_heartbeat = start_time + self._heartbeat_interval
+        poll_interval = 0.01
         try:
-            out, err = p.communicate(timeout=timeout)
-        except subprocess.TimeoutExpired:
-            logger.warning('Timeout reached. Killing process')
-            p.kill()
-            out, err = p.communicate()
+            while True:
+                exited, rusage = self._poll_cmd(p)
+                if exited:
+                    break
+                now = time.time()
+                if timeout is not None and now - start_time > timeout:
+                    logger.warning('Timeout reached. Killing process group of ' + cmd_name)
+                    timed_out = True
+                    rusage = self._kill_cmd(p)
+                    break
+                if now >= next_heartbeat:
+                    logger.info(cmd_name + ' still running after ' + str(int(now - start_time)) + ' seconds')
+                    next_heartbeat += self._heartbeat_interval
+                time.sleep(poll_interval)
+                poll_interval = min(poll_interval * 2, 1.0)
+        except BaseException:
+            if p.returncode is None:
+                logger.warning('Killing process group of ' + cmd_name)
+                self._kill_cmd(p)
+            raise
+
+        for reader in readers:
+            reader.join(timeout=CDAPSHiDeFHierarchyGenerator.KILL_GRACE_PERIOD)
+        self._record_resource_usage(cmd_name, p, time.time() - start_time, rusage)
+        out = '\n'.join(out_tail)
+        err = '\n'.join(err_tail)
+        if timed_out:
             raise CellmapsGenerateHierarchyError('Process timed out. exit code: ' +
                                                  str(p.returncode) +
                                                  ' stdout: ' + str(out) +
@@ -402,15 +693,224 @@ class CDAPSHiDeFHierarchyGenerator(HierarchyGenerator):
             id_to_name[node_id] = node_obj['n']
         return id_to_name
 
-    def _create_edgelist_files_for_networks(self, networks):
+    @staticmethod
+    def _get_edge_weights(network, edge_ids):
+        """
+        Gets weights of edges in **network** reading all
+        edge attributes in a single pass
+
+        :param network:
+        :type network: :py:class:`~ndex2.nice_cx_network.NiceCXNetwork`
+        :param edge_ids: ids of edges to get weights for
+        :type edge_ids: list
+        :return: weights with ``NaN`` for edges lacking a weight
+        :rtype: :py:class:`numpy.ndarray`
+        """
+        weight_by_edge = {}
+        for edge_id, edge_attrs in network.edgeAttributes.items():
+            for edge_attr in edge_attrs:
+                if edge_attr.get('n') == constants.WEIGHTED_PPI_EDGELIST_WEIGHT_COL:
+                    weight_by_edge[edge_id] = edge_attr.get('v')
+                    break
+        return pd.to_numeric(pd.Series([weight_by_edge.get(edge_id) for edge_id in edge_ids],
+                                        dtype=object), errors='coerce').values.astype(np.float64)
+
+    def _get_edge_arrays(self, network, name_to_id):
+        """
+        Gets edges of **network** as arrays of node ids taken from
+        **name_to_id**, so every network uses the node ids of the
+        largest network
+
+        :param network:
+        :type network: :py:class:`~ndex2.nice_cx_network.NiceCXNetwork`
+        :param name_to_id: node name to node id of largest network
+        :type name_to_id: dict
+        :return: (sources as :py:class:`numpy.ndarray`,
+                  targets as :py:class:`numpy.ndarray`,
+                  weights as :py:class:`numpy.ndarray` with ``NaN`` for edges
+                  lacking a weight, or ``None`` if not in weighted mode)
+        :rtype: tuple
+        """
+        id_map = {node_id: name_to_id[node_obj['n']] for node_id, node_obj in network.get_nodes()}
+        edge_ids = []
+        sources = []
+        targets = []
+        for edge_id, edge_obj in network.get_edges():
+            edge_ids.append(edge_id)
+            sources.append(id_map[edge_obj['s']])
+            targets.append(id_map[edge_obj['t']])
+        weights = None
+        if self._weighted_mode:
+            weights = self._get_edge_weights(network, edge_ids)
+        return np.array(sources, dtype=np.int64), np.array(targets, dtype=np.int64), weights
+
+    def _get_edge_arrays_from_network_edges(self, network_edges, gene_index):
+        """
+        Same as :py:meth:`_get_edge_arrays` but for edges held in memory.
+        Edges that share **gene_index**, the index of the largest network,
+        are used as is, otherwise their gene ids are mapped by name
+
+        :param network_edges:
+        :type network_edges: :py:class:`~cellmaps_generate_hierarchy.ppi.PPINetworkEdges`
+        :param gene_index: gene index of largest network
+        :type gene_index: :py:class:`~cellmaps_generate_hierarchy.ppi.GeneIndex`
+        :return: (sources, targets, weights)
+        :rtype: tuple
+        """
+        edge_table = network_edges.get_edge_table()
+        sources = edge_table.get_sources()
+        targets = edge_table.get_targets()
+        if edge_table.get_gene_index() is not gene_index:
+            names = edge_table.get_gene_index().get_names()
+            sources = gene_index.get_ids(names[sources])
+            targets = gene_index.get_ids(names[targets])
+            if np.any(sources < 0) or np.any(targets < 0):
+                raise CellmapsGenerateHierarchyError('Network ' + str(network_edges.get_name()) +
+                                                     ' has proteins missing from largest network')
+        weights = None
+        if self._weighted_mode:
+            if edge_table.get_weights() is None:
+                weights = np.full(len(edge_table), np.nan)
+            else:
+                weights = edge_table.get_weights().astype(np.float64)
+        return sources.astype(np.int64), targets.astype(np.int64), weights
+
+    @staticmethod
+    def _get_edge_keys(sources, targets, num_nodes):
+        """
+        Gets a single integer per edge that does not depend
+        on edge direction
+
+        :param sources:
+        :type sources: :py:class:`numpy.ndarray`
+        :param targets:
+        :type targets: :py:class:`numpy.ndarray`
+        :param num_nodes: upper bound on node ids
+        :type num_nodes: int
+        :return: edge keys
+        :rtype: :py:class:`numpy.ndarray`
+        """
+        return np.minimum(sources, targets) * num_nodes + np.maximum(sources, targets)
+
+    def _get_num_edges_to_remove(self, num_edges):
+        """
+        Gets number of edges to remove from a network with **num_edges**
+        edges for bootstrapping
+
+        :param num_edges:
+        :type num_edges: int
+        :return:
+        :rtype: int
+        """
+        return int(num_edges * (self._bootstrap_edges / 100))
+
+    def _get_removed_edge_keys(self, edge_keys, rng=None):
+        """
+        Randomly picks keys of edges to remove for bootstrapping from
+        **edge_keys** of the largest network
+
+        :param edge_keys:
+        :type edge_keys: :py:class:`numpy.ndarray`
+        :param rng: Random generator to pick edges with, if ``None``
+                    the generator seeded with **bootstrap_seed** is used
+        :type rng: :py:class:`numpy.random.Generator`
+        :return: sorted keys of removed edges
+        :rtype: :py:class:`numpy.ndarray`
+        """
+        num_edges_to_remove = self._get_num_edges_to_remove(len(edge_keys))
+        if num_edges_to_remove == 0:
+            return np.empty(0, dtype=edge_keys.dtype)
+        if rng is None:
+            rng = self._rng
+        idx = rng.choice(len(edge_keys), size=num_edges_to_remove, replace=False)
+        return np.sort(edge_keys[idx])
+
+    def _get_removed_edge_mask(self, edge_keys, removed_edge_keys):
+        """
+        Flags edges in **edge_keys** found in **removed_edge_keys**.
+        At most the bootstrap percentage of edges is flagged, in
+        edge order, so nested networks lose the same edges
+
+        :param edge_keys:
+        :type edge_keys: :py:class:`numpy.ndarray`
+        :param removed_edge_keys: sorted keys of removed edges
+        :type removed_edge_keys: :py:class:`numpy.ndarray`
+        :return: ``True`` for each edge to remove
+        :rtype: :py:class:`numpy.ndarray`
+        """
+        removed = np.isin(edge_keys, removed_edge_keys, assume_unique=False)
+        num_edges_to_remove = self._get_num_edges_to_remove(len(edge_keys))
+        positions = np.flatnonzero(removed)
+        removed[positions[num_edges_to_remove:]] = False
+        return removed
+
+    @staticmethod
+    def _write_edgelist_file(dest_path, sources, targets, weights=None):
+        """
+        Writes tab delimited edge list to **dest_path** in a single write,
+        formatting each column at once. If **weights** is set, weight is
+        added, formatted with
+        :py:const:`CDAPSHiDeFHierarchyGenerator.EDGELIST_WEIGHT_FORMAT`,
+        as a third column to every line where it is not ``NaN``
+
+        :param dest_path:
+        :type dest_path: str
+        :param sources:
+        :type sources: :py:class:`numpy.ndarray`
+        :param targets:
+        :type targets: :py:class:`numpy.ndarray`
+        :param weights:
+        :type weights: :py:class:`numpy.ndarray`
+        """
+        lines = np.char.add(np.char.add(sources.astype(str), '\t'), targets.astype(str))
+        if weights is not None and len(weights) > 0:
+            has_weight = ~np.isnan(weights)
+            weight_cols = np.full(len(weights), '', dtype=object)
+            if np.any(has_weight):
+                weight_cols[has_weight] = np.char.add('\t', np.char.mod(
+                    CDAPSHiDeFHierarchyGenerator.EDGELIST_WEIGHT_FORMAT, weights[has_weight]))
+            lines = np.char.add(lines, weight_cols.astype(str))
+        with open(dest_path, 'w') as f:
+            if len(lines) > 0:
+                f.write('\n'.join(lines.tolist()))
+                f.write('\n')
+
+    def _create_edgelist_files_for_networks(self, networks, network_edges=None, edgelist_dir=None,
+                                            bootstrap=True, rng=None, removed_edges_dir=None):
         """
         Iterates through **networks** prefix paths and loads the
         CX files. Method then creates a PREFIX_PATH
         :py:const:`CDAPSHiDeFHierarchyGenerator.EDGELIST_TSV`
-        file for each network and returns those paths as a list
+        file for each network and returns those paths as a list.
+
+        If **network_edges** is set, the edges are taken from it
+        instead of the CX files, which need not exist, and only the
+        largest and parent networks are built.
+
+        If bootstrapping is enabled, a random set of edges is picked
+        from the largest network and removed from every network, up to
+        the bootstrap percentage of each network's edges. Removed edges
+        are written to PREFIX_PATH ``_removed_edges.tsv``
+
+        Edge list files are written concurrently by a pool of
+        **workers** threads and registered once all are written
+
+        If **edgelist_dir** is set, edge list files are written to
+        that directory and, being temporary, are not registered
 
         :param networks: Prefix paths of input PPI networks
         :type networks: list
+        :param network_edges: Edges of each network in **networks**
+        :type network_edges: list
+        :param edgelist_dir: Directory to write edge list files to
+        :type edgelist_dir: str
+        :param bootstrap: If ``False`` no edges are removed
+        :type bootstrap: bool
+        :param rng: Random generator used to pick edges to remove
+        :type rng: :py:class:`numpy.random.Generator`
+        :param removed_edges_dir: Directory to write removed edges files
+                                  to instead of next to the PPI networks
+        :type removed_edges_dir: str
         :return: (parent network path,
                   :py:class:`~ndex2.nice_cx_network.NiceCXNetwork`,
                   largest network path,
@@ -419,80 +919,86 @@ class CDAPSHiDeFHierarchyGenerator(HierarchyGenerator):
         """
         net_paths = []
 
-        largest_network_path = self._get_largest_network(networks)
-        largest_network = ndex2.create_nice_cx_from_file(largest_network_path + constants.CX_SUFFIX)
-        logger.debug('Largest network name: ' + largest_network.get_name())
-        largest_name_to_id = self._get_name_to_id_dict(largest_network)
+        if network_edges is None:
+            largest_network_path = self._get_largest_network(networks)
+            largest_network = ndex2.create_nice_cx_from_file(largest_network_path + constants.CX_SUFFIX)
+            logger.debug('Largest network name: ' + largest_network.get_name())
+            largest_name_to_id = self._get_name_to_id_dict(largest_network)
+            num_nodes = max(largest_name_to_id.values()) + 1 if len(largest_name_to_id) > 0 else 1
+            largest_sources, largest_targets, _ = self._get_edge_arrays(largest_network, largest_name_to_id)
+        else:
+            largest_idx = 0
+            for idx, cur_edges in enumerate(network_edges):
+                if cur_edges.get_num_edges() >= network_edges[largest_idx].get_num_edges():
+                    largest_idx = idx
+            largest_network_path = networks[largest_idx]
+            largest_network = network_edges[largest_idx].get_network()
+            logger.debug('Largest network name: ' + largest_network.get_name())
+            largest_gene_index = network_edges[largest_idx].get_edge_table().get_gene_index()
+            num_nodes = max(len(largest_gene_index), 1)
+            largest_sources, largest_targets, _ = self._get_edge_arrays_from_network_edges(
+                network_edges[largest_idx], largest_gene_index)
 
         # Bootstrap edges
-        all_edges = [(edge_obj['s'], edge_obj['t']) for _, edge_obj in largest_network.get_edges()]
-        num_edges_to_remove = int(len(all_edges) * (self._bootstrap_edges / 100))
-        all_removed_edges = random.sample(all_edges, num_edges_to_remove)
+        if bootstrap:
+            removed_edge_keys = self._get_removed_edge_keys(self._get_edge_keys(largest_sources,
+                                                                                largest_targets,
+                                                                                num_nodes), rng=rng)
+        else:
+            removed_edge_keys = np.empty(0, dtype=np.int64)
 
         parent_net = None
         parent_path = None
         min_difference = float('inf')
-        for n in networks:
-            if largest_network_path == n:
-                net = largest_network
-            else:
-                logger.debug('Creating NiceCXNetwork object from: ' + n + constants.CX_SUFFIX)
-                net = ndex2.create_nice_cx_from_file(n + constants.CX_SUFFIX)
-            dest_path = n + CDAPSHiDeFHierarchyGenerator.EDGELIST_TSV
-            net_paths.append(dest_path)
-            logger.debug('Writing out id edgelist: ' + str(dest_path))
-            id_to_name = self._get_id_to_name_dict(net)
-
-            remaining_edges = list()
-            removed_edges = list()
-            for edge_id, edge_obj in net.get_edges():
-                edge = (edge_obj['s'], edge_obj['t'])
-                weight = None
-
-                # If in weighted mode, extract the edge weight
-                if self._weighted_mode:
-                    weight_attr = net.get_edge_attribute(edge_id, constants.WEIGHTED_PPI_EDGELIST_WEIGHT_COL)
-                    if isinstance(weight_attr, dict):
-                        weight = weight_attr.get('v')
-
-                if len(removed_edges) >= int(len(net.get_edges()) * (self._bootstrap_edges / 100)):
-                    remaining_edges.append((edge[0], edge[1], weight))
-                elif edge not in all_removed_edges:
-                    remaining_edges.append((edge[0], edge[1], weight))
+        write_futures = []
+        with ThreadPoolExecutor(max_workers=self._workers) as executor:
+            for idx, n in enumerate(networks):
+                if network_edges is not None:
+                    net = network_edges[idx]
+                elif largest_network_path == n:
+                    net = largest_network
                 else:
-                    removed_edges.append((edge[0], edge[1], weight))
-
-            with open(dest_path, 'w') as f:
-                for edge_data in remaining_edges:
-                    s, t = edge_data[0], edge_data[1]
-                    line = str(largest_name_to_id[id_to_name[s]]) + '\t' + \
-                           str(largest_name_to_id[id_to_name[t]])
-
-                    # Add weight as third column if in weighted mode and weight exists
-                    if self._weighted_mode and edge_data[2] is not None:
-                        line += '\t' + str(edge_data[2])
-
-                    line += '\n'
-                    f.write(line)
-
-            if len(removed_edges) > 0:
-                removed_edges_path = n + '_removed_edges.tsv'
-                with open(removed_edges_path, 'w') as f:
-                    for edge_data in removed_edges:
-                        s, t = edge_data[0], edge_data[1]
-                        line = str(largest_name_to_id[id_to_name[s]]) + '\t' + \
-                               str(largest_name_to_id[id_to_name[t]])
-
-                        # Add weight as third column if in weighted mode and weight exists
-                        if self._weighted_mode and edge_data[2] is not None:
-                            line += '\t' + str(edge_data[2])
-
-                        line += '\n'
-                        f.write(line)
-
-            if len(remaining_edges) == 0:
-                raise CellmapsGenerateHierarchyError(f"PPI network {n} has no edges. Cannot create hierarchy.")
+                    logger.debug('Creating NiceCXNetwork object from: ' + n + constants.CX_SUFFIX)
+                    net = ndex2.create_nice_cx_from_file(n + constants.CX_SUFFIX)
+                if edgelist_dir is None:
+                    dest_path = n + CDAPSHiDeFHierarchyGenerator.EDGELIST_TSV
+                else:
+                    dest_path = os.path.join(edgelist_dir,
+                                             os.path.basename(n) + CDAPSHiDeFHierarchyGenerator.EDGELIST_TSV)
+                net_paths.append(dest_path)
 
+                if network_edges is None:
+                    sources, targets, weights = self._get_edge_arrays(net, largest_name_to_id)
+                else:
+                    sources, targets, weights = self._get_edge_arrays_from_network_edges(net, largest_gene_index)
+                removed = self._get_removed_edge_mask(self._get_edge_keys(sources, targets, num_nodes),
+                                                      removed_edge_keys)
+                remaining = ~removed
+                if not np.any(remaining):
+                    raise CellmapsGenerateHierarchyError(f"PPI network {n} has no edges. Cannot create hierarchy.")
+
+                logger.debug('Writing out id edgelist: ' + str(dest_path))
+                if self._hidef_in_process:
+                    # kept so HiDeF need not parse the file
+                    self._edgelist_arrays[dest_path] = (sources[remaining], targets[remaining],
+                                                        None if weights is None else weights[remaining])
+                write_futures.append(executor.submit(self._write_edgelist_file, dest_path,
+                                                     sources[remaining], targets[remaining],
+                                                     weights=None if weights is None else weights[remaining]))
+                if np.any(removed):
+                    removed_path = n + '_removed_edges.tsv'
+                    if removed_edges_dir is not None:
+                        removed_path = os.path.join(removed_edges_dir, os.path.basename(removed_path))
+                    write_futures.append(executor.submit(self._write_edgelist_file, removed_path,
+                                                         sources[removed], targets[removed],
+                                                         weights=None if weights is None else weights[removed]))
+                if min_difference != 0:
+                    parent_net, parent_path, min_difference = self._get_parent_net_with_specified_cutoff(
+                        net, n, parent_net, parent_path, min_difference)
+            for future in write_futures:
+                future.result()
+
+        for dest_path in net_paths if edgelist_dir is None else []:
             # register edgelist file with fairscape
             data_dict = {'name': os.path.basename(dest_path) + ' PPI id edgelist file',
                          'description': 'PPI id edgelist file',
@@ -505,10 +1011,12 @@ class CDAPSHiDeFHierarchyGenerator(HierarchyGenerator):
                                                                  source_file=dest_path,
                                                                  data_dict=data_dict)
             self._generated_dataset_ids.append(dataset_id)
-            if min_difference != 0:
-                parent_net, parent_path, min_difference = self._get_parent_net_with_specified_cutoff(
-                    net, n, parent_net, parent_path, min_difference)
 
+        if network_edges is not None:
+            if parent_path == largest_network_path:
+                parent_net = largest_network
+            else:
+                parent_net = parent_net.get_network()
         logger.debug('Parent network name: ' + parent_net.get_name())
         return parent_path + constants.CX_SUFFIX, parent_net, largest_network, net_paths
 
@@ -536,6 +1044,28 @@ class CDAPSHiDeFHierarchyGenerator(HierarchyGenerator):
                                                                  data_dict=data_dict)
             self._generated_dataset_ids.append(dataset_id)
 
+    def _register_bootstrap_support_file(self, outdir):
+        """
+        Registers :py:const:`BOOTSTRAP_SUPPORT_TSV` file with FAIRSCAPE
+
+        :param outdir:
+        :type outdir: str
+        """
+        outfile = os.path.join(outdir, CDAPSHiDeFHierarchyGenerator.BOOTSTRAP_SUPPORT_TSV)
+        data_dict = {'name': os.path.basename(outfile) + ' HiDeF bootstrap support file',
+                     'description': 'Fraction of ' + str(self._bootstrap_replicates) +
+                                    ' bootstrap replicates, each with ' + str(self._bootstrap_edges) +
+                                    '% of edges randomly removed, that found each term and mean '
+                                    'Jaccard similarity of its best match in each replicate',
+                     'data-format': 'tsv',
+                     'author': str(self._author),
+                     'version': str(self._version),
+                     'date-published': date.today().strftime(self._provenance_utils.get_default_date_format_str())}
+        dataset_id = self._provenance_utils.register_dataset(os.path.dirname(outfile),
+                                                             source_file=outfile,
+                                                             data_dict=data_dict)
+        self._generated_dataset_ids.append(dataset_id)
+
     def _annotate_hierarchy(self, network=None, path=None):
         """
         Adds HCX attributes to network as well as sets
@@ -559,7 +1089,11 @@ class CDAPSHiDeFHierarchyGenerator(HierarchyGenerator):
                                           values='RO-crate: ' + str(rocrate_id))
 
             prov_utils = self._provenance_utils.get_rocrate_provenance_attributes(os.path.dirname(path))
-            if self._bootstrap_edges > 0:
+            if self._bootstrap_replicates > 0:
+                description = (description + ' with term support from ' + str(self._bootstrap_replicates) +
+                               ' bootstrap replicates with ' + str(self._bootstrap_edges) +
+                               '% of edges randomly removed')
+            elif self._bootstrap_edges > 0:
                 description = (description + ' derived from edgeslists with ' + str(self._bootstrap_edges) +
                                '% of edges randomly removed')
             network.set_network_attribute(name='description',
@@ -590,20 +1124,316 @@ class CDAPSHiDeFHierarchyGenerator(HierarchyGenerator):
                                        values='true', type='boolean',
                                        overwrite=True)
 
-    def _run_hidef(self, edgelist_files, outputprefix, algorithm, maxres, k):
+    def _get_edgelist_arrays(self, edgelist_file):
+        """
+        Gets edges written to **edgelist_file** by
+        :py:meth:`_create_edgelist_files_for_networks` if still in
+        memory, otherwise the edges are read from **edgelist_file**
+
+        :param edgelist_file:
+        :type edgelist_file: str
+        :return: (sources, targets, weights or ``None``)
+        :rtype: tuple
+        """
+        if edgelist_file in self._edgelist_arrays:
+            return self._edgelist_arrays.pop(edgelist_file)
+        df = pd.read_csv(edgelist_file, sep='\t', header=None, names=[0, 1, 2])
+        weights = df[2].values.astype(np.float64)
+        return df[0].values, df[1].values, None if np.all(np.isnan(weights)) else weights
+
+    def _get_hidef_graphs(self, edgelist_files):
+        """
+        Builds the :py:class:`igraph.Graph` objects, and node names, that
+        ``hidef_finder.py`` would build when given **edgelist_files**.
+        For multiple networks, nodes are renumbered in order of their
+        names sorted as strings and each graph gets a self edge on the
+        last node so all graphs have the same nodes. For a single network
+        nodes are numbered in order of appearance and weights, rounded as
+        in the file, are kept
+
+        :param edgelist_files:
+        :type edgelist_files: list
+        :return: (list of :py:class:`igraph.Graph`, node names as :py:class:`list`)
+        :rtype: tuple
+        """
+        import igraph
+        edge_arrays = [self._get_edgelist_arrays(f) for f in edgelist_files]
+        if len(edge_arrays) > 1:
+            nodenames = sorted(set(np.concatenate([np.concatenate([e[0], e[1]])
+                                                   for e in edge_arrays]).astype(str).tolist()))
+            name_index = pd.Index(nodenames)
+            max_i = len(nodenames) - 1
+            graphs = []
+            for sources, targets, _ in edge_arrays:
+                edges = np.column_stack([name_index.get_indexer(sources.astype(str)),
+                                         name_index.get_indexer(targets.astype(str))])
+                edges = np.vstack([edges, [[max_i, max_i]]])
+                graphs.append(igraph.Graph(n=max_i + 1, edges=edges.tolist(), directed=False))
+            return graphs, nodenames
+
+        sources, targets, weights = edge_arrays[0]
+        codes, names = pd.factorize(np.column_stack([sources.astype(str), targets.astype(str)]).ravel())
+        graph = igraph.Graph(n=len(names), edges=codes.reshape(-1, 2).tolist(), directed=False)
+        graph.vs['name'] = names.tolist()
+        if weights is not None and not np.all(np.isnan(weights)):
+            rounded = np.char.mod(CDAPSHiDeFHierarchyGenerator.EDGELIST_WEIGHT_FORMAT,
+                                  np.nan_to_num(weights, nan=0.0)).astype(np.float64)
+            graph.es['weight'] = rounded.tolist()
+        return [graph], graph.vs['name']
+
+    def _run_hidef_in_process(self, edgelist_files, outputprefix, algorithm, maxres, k):
+        """
+        Runs HiDeF within this process doing the same steps as
+        ``hidef_finder.py`` with the flags set by :py:meth:`_run_hidef`
+
+        :raises ImportError: If :py:mod:`hidef` could not be imported
+        """
+        import multiprocessing
+        from hidef import hidef_finder
+        from hidef import weaver
+
+        graphs, names = self._get_hidef_graphs(edgelist_files)
+        layer_weights = [1.0 for _ in graphs] if len(graphs) > 1 else None
+        clu_graph = hidef_finder.run(graphs,
+                                     density=CDAPSHiDeFHierarchyGenerator.HIDEF_DENSITY,
+                                     jaccard=CDAPSHiDeFHierarchyGenerator.HIDEF_TAU,
+                                     sample=CDAPSHiDeFHierarchyGenerator.HIDEF_SAMPLE,
+                                     minres=CDAPSHiDeFHierarchyGenerator.HIDEF_MINRES,
+                                     maxres=float(maxres),
+                                     maxn=None,
+                                     alg=algorithm,
+                                     numthreads=multiprocessing.cpu_count(),
+                                     layer_weights=layer_weights)
+        del graphs
+        collapsed_w_len = hidef_finder.consensus(clu_graph, int(k), 1.0,
+                                                 CDAPSHiDeFHierarchyGenerator.HIDEF_CONSENSUS)
+        collapsed = [x[0] for x in collapsed_w_len]
+        len_component = [x[1] for x in collapsed_w_len]
+        collapsed.insert(0, np.ones(len(collapsed[0]), ))
+        len_component.insert(0, 0)
+
+        wv = weaver.Weaver()
+        wv.weave(collapsed, boolean=True, levels=False, merge=True,
+                 cutoff=CDAPSHiDeFHierarchyGenerator.HIDEF_TAU)
+        hidef_finder.output_all(wv, names, outputprefix, persistence=len_component,
+                                iter=False, skipgml=True)
+
+    @staticmethod
+    def _get_hidef_version():
+        """
+        Gets version of installed :py:mod:`hidef` package
+
+        :return: version or ``unknown`` if it could not be found
+        :rtype: str
+        """
+        try:
+            from importlib import metadata
+            return metadata.version('hidef')
+        except Exception as e:
+            logger.debug('Unable to get hidef version: ' + str(e))
+            return 'unknown'
+
+    def _get_hidef_cache_key(self, edgelist_files, algorithm, maxres, k):
+        """
+        Gets key for HiDeF cache derived from the contents of
+        **edgelist_files**, in order, the HiDeF parameters and
+        the version of HiDeF
+
+        :return: key or ``None`` if no HiDeF cache was set or
+                 edge lists differ every run
+        :rtype: str
+        """
+        if self._hidef_cache is None:
+            return None
+        if self._bootstrap_edges > 0 and self._bootstrap_seed is None:
+            # a different set of edges is removed every run
+            return None
+        digest = hashlib.sha256()
+        digest.update(('CDAPSHiDeFHierarchyGenerator|' +
+                       CDAPSHiDeFHierarchyGenerator.HIDEF_CACHE_VERSION + '|' +
+                       '|'.join([str(x) for x in [self._get_hidef_version(), algorithm,
+                                                  float(maxres), int(k),
+                                                  CDAPSHiDeFHierarchyGenerator.HIDEF_MINRES,
+                                                  CDAPSHiDeFHierarchyGenerator.HIDEF_DENSITY,
+                                                  CDAPSHiDeFHierarchyGenerator.HIDEF_TAU,
+                                                  CDAPSHiDeFHierarchyGenerator.HIDEF_SAMPLE,
+                                                  CDAPSHiDeFHierarchyGenerator.HIDEF_CONSENSUS]])
+                       ).encode('utf-8'))
+        for edgelist_file in edgelist_files:
+            digest.update(b'|')
+            get_file_digest(edgelist_file, digest=digest)
+        return digest.hexdigest()
+
+    def _get_hidef_output_from_cache(self, cache_key, outputprefix):
+        """
+        Copies HiDeF output previously stored in HiDeF cache
+        under **cache_key** to files with **outputprefix** prefix
+
+        :param cache_key:
+        :type cache_key: str
+        :param outputprefix:
+        :type outputprefix: str
+        :return: ``True`` if output was found in cache
+        :rtype: bool
+        """
+        if cache_key is None:
+            return False
+        entry_dir = self._hidef_cache.get(cache_key)
+        if entry_dir is None:
+            return False
+        try:
+            for suffix in CDAPSHiDeFHierarchyGenerator.HIDEF_OUTPUT_SUFFIXES:
+                cached_file = os.path.join(entry_dir, CDAPSHiDeFHierarchyGenerator.HIDEF_OUT_PREFIX + suffix)
+                if suffix == '.weaver' and not os.path.isfile(cached_file):
+                    continue
+                shutil.copyfile(cached_file, outputprefix + suffix)
+        except OSError as oe:
+            logger.warning('Unable to read HiDeF cache entry ' + str(cache_key) + ' : ' + str(oe))
+            return False
+        logger.info('Using cached HiDeF output from ' + str(entry_dir))
+        return True
+
+    def _add_hidef_output_to_cache(self, cache_key, outputprefix):
+        """
+        Stores HiDeF output files with **outputprefix** prefix
+        in HiDeF cache under **cache_key**
+
+        :param cache_key:
+        :type cache_key: str
+        :param outputprefix:
+        :type outputprefix: str
+        """
+        if cache_key is None:
+            return
+        try:
+            entry_dir = self._hidef_cache.get_new_entry_dir()
+            for suffix in CDAPSHiDeFHierarchyGenerator.HIDEF_OUTPUT_SUFFIXES:
+                if suffix == '.weaver' and not os.path.isfile(outputprefix + suffix):
+                    continue
+                shutil.copyfile(outputprefix + suffix,
+                                os.path.join(entry_dir, CDAPSHiDeFHierarchyGenerator.HIDEF_OUT_PREFIX + suffix))
+            self._hidef_cache.put(cache_key, entry_dir)
+        except OSError as oe:
+            logger.warning('Unable to store HiDeF output in cache: ' + str(oe))
+
+    def _run_hidef(self, edgelist_files, outputprefix, algorithm, maxres, k, cwd=None):
+        """
+        Runs HiDeF on **edgelist_files** writing output files
+        with **outputprefix** prefix, unless output for the same
+        edge lists and parameters is found in the HiDeF cache
+
+        :param cwd: Working directory for HiDeF command, which
+                    writes temporary files to it
+        :type cwd: str
+        :raises CellmapsGenerateHierarchyError: If HiDeF fails
+        """
+        cache_key = self._get_hidef_cache_key(edgelist_files, algorithm, maxres, k)
+        if self._get_hidef_output_from_cache(cache_key, outputprefix):
+            for edgelist_file in edgelist_files:
+                self._edgelist_arrays.pop(edgelist_file, None)
+            return
+        if self._hidef_in_process:
+            try:
+                logger.debug('Running HiDeF in process')
+                self._run_hidef_in_process(edgelist_files, outputprefix, algorithm, maxres, k)
+                self._add_hidef_output_to_cache(cache_key, outputprefix)
+                return
+            except ImportError as ie:
+                logger.warning('Unable to import hidef, running ' + str(self._hidef_cmd) +
+                               ' instead : ' + str(ie))
+            except Exception as e:
+                logger.exception('HiDeF failed: ' + str(e))
+                raise CellmapsGenerateHierarchyError('HiDeF failed: ' + str(e))
+            finally:
+                for edgelist_file in edgelist_files:
+                    self._edgelist_arrays.pop(edgelist_file, None)
+
         cmd = [self._python, self._hidef_cmd, '--g']
         cmd.extend(edgelist_files)
         cmd.extend(['--o', outputprefix,
                     '--alg', algorithm, '--maxres', str(maxres), '--k', str(k),
                     '--skipgml'])
 
-        exit_code, out, err = self._run_cmd(cmd)
+        exit_code, out, err = self._run_cmd(cmd, cwd=cwd)
 
         if exit_code != 0:
             logger.error('Cmd failed with exit code: ' + str(exit_code) +
                          ' : ' + str(out) + ' : ' + str(err))
             raise CellmapsGenerateHierarchyError('Cmd failed with exit code: ' + str(exit_code) +
                                                  ' : ' + str(out) + ' : ' + str(err))
+        self._add_hidef_output_to_cache(cache_key, outputprefix)
+
+    def _get_bootstrap_support(self, nodes_file, replicate_nodes_files):
+        """
+        Gets support of each term in **nodes_file**, the fraction of
+        **replicate_nodes_files** with a term whose Jaccard similarity
+        to it is at least :py:const:`BOOTSTRAP_SUPPORT_JACCARD`
+
+        :param nodes_file: HiDeF nodes file
+        :type nodes_file: str
+        :param replicate_nodes_files: HiDeF nodes files of bootstrap replicates
+        :type replicate_nodes_files: list
+        :return: table with ``term``, ``size``, ``support`` and
+                 ``mean_best_jaccard`` columns as described in
+                 :py:meth:`~cellmaps_generate_hierarchy.termoverlap.TermOverlap.get_stability`
+        :rtype: :py:class:`pandas.DataFrame`
+        """
+        term_overlap = TermOverlap(jaccard_threshold=CDAPSHiDeFHierarchyGenerator.BOOTSTRAP_SUPPORT_JACCARD)
+        return term_overlap.compare_nodes_files(nodes_file, replicate_nodes_files)
+
+    def _run_bootstrap_replicate(self, networks, network_edges, replicate_dir, rng, algorithm, maxres, k):
+        """
+        Writes edge lists of **networks** with edges randomly removed
+        using **rng** to **replicate_dir** and runs HiDeF, and refiner if
+        set, on them. Edge lists are removed once HiDeF finishes. Refined
+        output of replicates is scratch data, so it is not registered
+        with FAIRSCAPE
+
+        :param replicate_dir: Directory for files of this replicate
+        :type replicate_dir: str
+        :param rng: Random generator used to pick edges to remove
+        :type rng: :py:class:`numpy.random.Generator`
+        :return: path to HiDeF nodes file of replicate
+        :rtype: str
+        """
+        os.makedirs(replicate_dir, exist_ok=True)
+        edgelist_files = self._create_edgelist_files_for_networks(networks, network_edges=network_edges,
+                                                                  edgelist_dir=replicate_dir, rng=rng,
+                                                                  removed_edges_dir=replicate_dir)[3]
+        outputprefix = os.path.join(replicate_dir, CDAPSHiDeFHierarchyGenerator.HIDEF_OUT_PREFIX)
+        self._run_hidef(edgelist_files, outputprefix, algorithm, maxres, k, cwd=replicate_dir)
+        for edgelist_file in edgelist_files:
+            os.remove(edgelist_file)
+        if self._refiner is None:
+            return outputprefix + '.nodes'
+        self._refiner.refine_hierarchy(outprefix=outputprefix, register_outputs=False)
+        return outputprefix + '.pruned.nodes'
+
+    def _run_hidef_with_bootstrap_replicates(self, networks, network_edges, edgelist_files, outdir,
+                                             replicates_dir, algorithm, maxres, k):
+        """
+        Runs HiDeF on **edgelist_files** and on **bootstrap_replicates**
+        bootstrap replicates of **networks** in a pool of **workers**
+        threads, each waiting on its own HiDeF process. Replicates are
+        seeded from **bootstrap_seed** so they are reproducible. If HiDeF
+        runs in process, runs are done one at a time
+
+        :param replicates_dir: Directory for files of replicates
+        :type replicates_dir: str
+        :return: paths to HiDeF nodes files of replicates
+        :rtype: list
+        """
+        seeds = np.random.SeedSequence(self._bootstrap_seed).spawn(self._bootstrap_replicates)
+        outputprefix = os.path.join(outdir, CDAPSHiDeFHierarchyGenerator.HIDEF_OUT_PREFIX)
+        max_workers = 1 if self._hidef_in_process else self._workers
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(self._run_hidef, edgelist_files, outputprefix, algorithm, maxres, k)]
+            for idx, seed in enumerate(seeds):
+                replicate_dir = os.path.join(replicates_dir, 'replicate_' + str(idx))
+                futures.append(executor.submit(self._run_bootstrap_replicate, networks, network_edges,
+                                               replicate_dir, np.random.default_rng(seed),
+                                               algorithm, maxres, k))
+            return [f.result() for f in futures][1:]
 
     def get_hierarchy_from_edgelists(self, outdir, edgelist_files, parent_net, algorithm='leiden', maxres=80, k=10):
         """
@@ -631,15 +1461,39 @@ class CDAPSHiDeFHierarchyGenerator(HierarchyGenerator):
         """
         outputprefix = os.path.join(outdir, CDAPSHiDeFHierarchyGenerator.HIDEF_OUT_PREFIX)
         self._run_hidef(edgelist_files, outputprefix, algorithm, maxres, k)
+        return self._get_hierarchy_from_hidef_output(outdir, parent_net)
+
+    def _get_hierarchy_from_hidef_output(self, outdir, parent_net, replicate_nodes_files=None):
+        """
+        Refines, if refiner is set, HiDeF output in **outdir** and converts it
+        to a hierarchy for **parent_net**
 
+        :param outdir: Directory with HiDeF output
+        :type outdir: str
+        :param parent_net: The parent network on which community detection is performed.
+        :type parent_net: :py:class:`~ndex2.nice_cx_network.NiceCXNetwork` or :py:class:`~ndex2.cx2.CX2Network`
+        :param replicate_nodes_files: If set, HiDeF nodes files of bootstrap replicates
+                                      used to add support of each term to the hierarchy
+        :type replicate_nodes_files: list
+        :return: (hierarchy, path to CDAPS output JSON file) or (None, None) if an error occurs
+        :rtype: tuple
+        """
+        outputprefix = os.path.join(outdir, CDAPSHiDeFHierarchyGenerator.HIDEF_OUT_PREFIX)
         try:
             if self._refiner is not None:
                 self._refiner.refine_hierarchy(outprefix=outputprefix)
 
+            support_map = None
+            if replicate_nodes_files is not None:
+                support_df = self._get_bootstrap_support(outputprefix + '.pruned.nodes', replicate_nodes_files)
+                support_df.to_csv(os.path.join(outdir, CDAPSHiDeFHierarchyGenerator.BOOTSTRAP_SUPPORT_TSV),
+                                  sep='\t', index=False)
+                support_map = dict(zip(support_df['term'], support_df['support']))
+
             cdaps_out_file = os.path.join(outdir,
                                           CDAPSHiDeFHierarchyGenerator.CDAPS_JSON_FILE)
             with open(cdaps_out_file, 'w') as out_stream:
-                self.convert_hidef_output_to_cdaps(out_stream, outdir)
+                self.convert_hidef_output_to_cdaps(out_stream, outdir, support_map=support_map)
 
             cd = cdapsutil.CommunityDetection(runner=cdapsutil.ExternalResultsRunner())
             hier = cd.run_community_detection(parent_net, algorithm=cdaps_out_file)
@@ -648,14 +1502,14 @@ class CDAPSHiDeFHierarchyGenerator(HierarchyGenerator):
             logger.error('No output from hidef: ' + str(fe) + '\n')
         return None, None
 
-    def get_hierarchy(self, networks, algorithm='leiden', maxres=80, k=10):
+    def get_hierarchy(self, networks, algorithm='leiden', maxres=80, k=10, network_edges=None):
         """
         Runs HiDeF to generate hierarchy and registers resulting output
         files with FAIRSCAPE. To do this the method generates edgelist
         files from the CX files corresponding to the **networks** using
         the internal node ids for edge source and target names. These
-        files are written to the same directory as the **networks**
-        with HiDeF
+        files are written to the same directory as the **networks**,
+        or to a temporary directory under **scratch_dir** if set, and HiDeF
         is then given all these networks via ``--g`` flag.
 
 
@@ -675,6 +1529,10 @@ class CDAPSHiDeFHierarchyGenerator(HierarchyGenerator):
         :type maxres: int
         :param k: The k parameter for HiDeF (default is 10).
         :type k: int
+        :param network_edges: If set, edges of each network in **networks**, in the
+                              same order, used to write the edgelist files instead
+                              of reading the CX files, which then need not exist
+        :type network_edges: list
         :raises CellmapsGenerateHierarchyError: If there was an error
         :return: Resulting hierarchy or ``None`` if no hierarchy from HiDeF
         :return: (hierarchy as list,
@@ -687,18 +1545,48 @@ class CDAPSHiDeFHierarchyGenerator(HierarchyGenerator):
             raise CellmapsGenerateHierarchyError('HCX converter must be set')
         outdir = os.path.dirname(networks[0])
 
-        (parent_net_path, parent_net, largest_net, edgelist_files) = self._create_edgelist_files_for_networks(networks)
-
-        hier, cdaps_out_file = self.get_hierarchy_from_edgelists(outdir, edgelist_files, largest_net,
-                                                                 algorithm, maxres, k)
-        self._clean_tmp_edgelist_files(edgelist_files)
+        edgelist_dir = None
+        replicates_dir = None
+        if self._scratch_dir is not None:
+            os.makedirs(self._scratch_dir, exist_ok=True)
+            edgelist_dir = tempfile.mkdtemp(prefix='edgelists_', dir=self._scratch_dir)
+        try:
+            (parent_net_path, parent_net,
+             largest_net, edgelist_files) = self._create_edgelist_files_for_networks(
+                networks, network_edges=network_edges, edgelist_dir=edgelist_dir,
+                bootstrap=self._bootstrap_replicates == 0)
+
+            if self._bootstrap_replicates > 0:
+                replicates_dir = tempfile.mkdtemp(prefix='bootstrap_replicates_',
+                                                  dir=outdir if self._scratch_dir is None else self._scratch_dir)
+                replicate_nodes_files = self._run_hidef_with_bootstrap_replicates(networks, network_edges,
+                                                                                  edgelist_files, outdir,
+                                                                                  replicates_dir,
+                                                                                  algorithm, maxres, k)
+                hier, cdaps_out_file = self._get_hierarchy_from_hidef_output(
+                    outdir, largest_net, replicate_nodes_files=replicate_nodes_files)
+            else:
+                hier, cdaps_out_file = self.get_hierarchy_from_edgelists(outdir, edgelist_files, largest_net,
+                                                                         algorithm, maxres, k)
+            self._clean_tmp_edgelist_files(edgelist_files)
+        finally:
+            for tmp_dir in [edgelist_dir, replicates_dir]:
+                if tmp_dir is not None:
+                    shutil.rmtree(tmp_dir, ignore_errors=True)
         self._annotate_hierarchy(network=hier, path=parent_net_path)
         self._annotate_hierarchy_nodes(network=hier)
+        interactome_name_map = None
+        if network_edges is not None:
+            parent_idx = networks.index(parent_net_path[:-len(constants.CX_SUFFIX)])
+            interactome_name_map = network_edges[parent_idx].get_name_to_id_dict()
         hierarchy_in_hcx = self._hcxconverter.get_converted_hierarchy(hierarchy=hier,
-                                                                      parent_network=parent_net)
+                                                                      parent_network=parent_net,
+                                                                      interactome_name_map=interactome_name_map)
 
         # Register outputs from hierarchy generation
         self._register_hidef_output_files(outdir)
+        if self._bootstrap_replicates > 0:
+            self._register_bootstrap_support_file(outdir)
 
         # register cdaps json file with fairscape
         data_dict = {'name': os.path.basename(cdaps_out_file) + ' CDAPS output JSON file',
@@ -1,17 +1,407 @@
 
 import os
+import heapq
+import itertools
 from datetime import date
+import numpy as np
 import pandas as pd
 
 import networkx as nx
 import logging
+from scipy import sparse
 import cellmaps_generate_hierarchy
 from cellmaps_utils import constants
 from cellmaps_utils.provenance import ProvenanceUtil
+from cellmaps_generate_hierarchy.termoverlap import TermIncidence
+from cellmaps_generate_hierarchy.termoverlap import TermOverlap
 
 logger = logging.getLogger(__name__)
 
 
+class TermMembership(object):
+    """
+    Genes and descendant terms of every term of a hierarchy held as
+    packed bit arrays, one row per term. Rows are computed once by
+    passing genes and descendants up the hierarchy in topological
+    order and are then updated in place as edges are added and terms
+    are removed, so the hierarchy graph need not be walked again
+    """
+
+    # number of bits set in each possible byte value
+    POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+    def __init__(self, nx_graph, hiergeneset):
+        """
+        Constructor
+
+        :param nx_graph: Hierarchy with edges from parent to child
+                         terms and from terms to their genes
+        :type nx_graph: :py:class:`networkx.DiGraph`
+        :param hiergeneset: Genes of the hierarchy, all other
+                            nodes of **nx_graph** are terms
+        :type hiergeneset: set
+        """
+        self._terms = [n for n in nx_graph.nodes() if n not in hiergeneset]
+        self._term_index = {t: i for i, t in enumerate(self._terms)}
+        self._genes = sorted(hiergeneset, key=TermMembership._get_gene_sort_key)
+        self._gene_index = {g: i for i, g in enumerate(self._genes)}
+        num_terms = len(self._terms)
+        self._gene_bits = np.zeros((num_terms, TermMembership._get_num_bytes(len(self._genes))), dtype=np.uint8)
+        self._desc_bits = np.zeros((num_terms, TermMembership._get_num_bytes(num_terms)), dtype=np.uint8)
+        self._alive = np.ones(num_terms, dtype=bool)
+
+        # children come before parents in reverse topological order
+        for node in reversed(list(nx.topological_sort(nx_graph))):
+            if node in hiergeneset:
+                continue
+            t_idx = self._term_index[node]
+            for child in nx_graph.successors(node):
+                if child in self._gene_index:
+                    TermMembership._set_bit(self._gene_bits[t_idx], self._gene_index[child])
+                    continue
+                c_idx = self._term_index[child]
+                self._gene_bits[t_idx] |= self._gene_bits[c_idx]
+                self._desc_bits[t_idx] |= self._desc_bits[c_idx]
+                TermMembership._set_bit(self._desc_bits[t_idx], c_idx)
+        self._sizes = TermMembership._popcount(self._gene_bits)
+
+    @staticmethod
+    def _get_gene_sort_key(gene):
+        """
+        Gets key that orders genes that are HiDeF node ids numerically,
+        followed by any other genes in string order
+
+        :param gene:
+        :type gene: str
+        :return:
+        :rtype: tuple
+        """
+        gene = str(gene)
+        if gene.isdigit():
+            return 0, int(gene), gene
+        return 1, 0, gene
+
+    @staticmethod
+    def _get_num_bytes(num_bits):
+        """
+        Gets number of bytes needed to hold **num_bits** bits
+
+        :param num_bits:
+        :type num_bits: int
+        :return:
+        :rtype: int
+        """
+        return max(1, (num_bits + 7) // 8)
+
+    @staticmethod
+    def _set_bit(bits, idx):
+        """
+        Sets bit **idx** of packed bit array **bits**, using
+        the bit order of :py:func:`numpy.packbits`
+
+        :param bits:
+        :type bits: :py:class:`numpy.ndarray`
+        :param idx:
+        :type idx: int
+        """
+        bits[idx >> 3] |= np.uint8(0x80 >> (idx & 7))
+
+    @staticmethod
+    def _get_bit_column(bits, idx):
+        """
+        Gets bit **idx** of every row of packed bit arrays **bits**
+
+        :param bits:
+        :type bits: :py:class:`numpy.ndarray`
+        :param idx:
+        :type idx: int
+        :return: one value per row of **bits**
+        :rtype: :py:class:`numpy.ndarray` of bool
+        """
+        return (bits[:, idx >> 3] & np.uint8(0x80 >> (idx & 7))) != 0
+
+    @staticmethod
+    def _popcount(bits):
+        """
+        Gets number of bits set in **bits**, per row if
+        **bits** is 2 dimensional
+
+        :param bits:
+        :type bits: :py:class:`numpy.ndarray`
+        :return:
+        :rtype: :py:class:`numpy.ndarray` or int
+        """
+        return TermMembership.POPCOUNT[bits].sum(axis=-1, dtype=np.int64)
+
+    def _get_term_idx(self, term):
+        """
+        Gets row of **term**
+
+        :param term:
+        :type term: str
+        :raises KeyError: If **term** is not in hierarchy
+        :return:
+        :rtype: int
+        """
+        t_idx = self._term_index[term]
+        if not self._alive[t_idx]:
+            raise KeyError(term)
+        return t_idx
+
+    def get_terms(self):
+        """
+        Gets terms of hierarchy
+
+        :return:
+        :rtype: list
+        """
+        return [self._terms[i] for i in np.flatnonzero(self._alive)]
+
+    def has_term(self, term):
+        """
+        Checks if **term** is in hierarchy
+
+        :param term:
+        :type term: str
+        :return: ``True`` if **term** is in hierarchy
+        :rtype: bool
+        """
+        t_idx = self._term_index.get(term)
+        return t_idx is not None and bool(self._alive[t_idx])
+
+    def get_size(self, term):
+        """
+        Gets number of genes in **term**, including
+        those of its descendants
+
+        :param term:
+        :type term: str
+        :return:
+        :rtype: int
+        """
+        return int(self._sizes[self._get_term_idx(term)])
+
+    def get_sizes(self, terms):
+        """
+        Gets number of genes in each term of **terms**
+
+        :param terms:
+        :type terms: list
+        :return: one size per term
+        :rtype: :py:class:`numpy.ndarray`
+        """
+        return self._sizes[[self._get_term_idx(t) for t in terms]]
+
+    def get_genes(self, term):
+        """
+        Gets genes of **term**, including those of its descendants,
+        with HiDeF node ids in numeric order
+
+        :param term:
+        :type term: str
+        :return:
+        :rtype: list
+        """
+        row = np.unpackbits(self._gene_bits[self._get_term_idx(term)], count=len(self._genes))
+        return [self._genes[i] for i in np.flatnonzero(row)]
+
+    def get_descendants(self, term):
+        """
+        Gets descendant terms of **term**
+
+        :param term:
+        :type term: str
+        :return:
+        :rtype: list
+        """
+        row = np.unpackbits(self._desc_bits[self._get_term_idx(term)], count=len(self._terms))
+        return [self._terms[i] for i in np.flatnonzero(row & self._alive)]
+
+    def is_descendant(self, term, other):
+        """
+        Checks if **other** is a descendant of **term**
+
+        :param term:
+        :type term: str
+        :param other:
+        :type other: str
+        :return:
+        :rtype: bool
+        """
+        o_idx = self._get_term_idx(other)
+        return bool(self._desc_bits[self._get_term_idx(term), o_idx >> 3] & np.uint8(0x80 >> (o_idx & 7)))
+
+    def get_jaccard(self, term, other):
+        """
+        Gets Jaccard index of genes of **term** and **other**
+
+        :param term:
+        :type term: str
+        :param other:
+        :type other: str
+        :return:
+        :rtype: float
+        """
+        a = self._gene_bits[self._get_term_idx(term)]
+        b = self._gene_bits[self._get_term_idx(other)]
+        return TermMembership._popcount(a & b) / TermMembership._popcount(a | b)
+
+    def get_shortcut_children(self, term, children):
+        """
+        Gets those of **children**, terms or genes, of **term** that
+        are also descendants, or genes, of another of its children
+
+        :param term:
+        :type term: str
+        :param children: Terms and genes that are children of **term**
+        :type children: list
+        :return:
+        :rtype: list
+        """
+        child_idx = [self._term_index[c] for c in children if c in self._term_index]
+        if len(child_idx) == 0:
+            return []
+        reachable_terms = np.bitwise_or.reduce(self._desc_bits[child_idx], axis=0)
+        reachable_genes = np.bitwise_or.reduce(self._gene_bits[child_idx], axis=0)
+        shortcuts = []
+        for child in children:
+            if child in self._term_index:
+                idx = self._term_index[child]
+                bits = reachable_terms
+            else:
+                idx = self._gene_index[child]
+                bits = reachable_genes
+            if bits[idx >> 3] & np.uint8(0x80 >> (idx & 7)):
+                shortcuts.append(child)
+        return shortcuts
+
+    def get_jaccards(self, pairs, chunk_size=4096):
+        """
+        Gets Jaccard index of genes of the terms of each pair in **pairs**
+
+        :param pairs: ``(term, other term)`` tuples
+        :type pairs: list
+        :param chunk_size: Number of pairs compared at a time
+        :type chunk_size: int
+        :return: one Jaccard index per pair
+        :rtype: :py:class:`numpy.ndarray`
+        """
+        jaccards = np.zeros(len(pairs), dtype=np.float64)
+        for start in range(0, len(pairs), chunk_size):
+            chunk = pairs[start:start + chunk_size]
+            a = self._gene_bits[[self._get_term_idx(t) for t, _ in chunk]]
+            b = self._gene_bits[[self._get_term_idx(o) for _, o in chunk]]
+            jaccards[start:start + len(chunk)] = (TermMembership._popcount(a & b) /
+                                                  TermMembership._popcount(a | b))
+        return jaccards
+
+    def add_edge(self, parent, child):
+        """
+        Updates genes and descendants of **parent** and all its
+        ancestors after an edge from **parent** to **child** is added
+
+        :param parent:
+        :type parent: str
+        :param child:
+        :type child: str
+        """
+        p_idx = self._get_term_idx(parent)
+        c_idx = self._get_term_idx(child)
+        rows = TermMembership._get_bit_column(self._desc_bits, p_idx)
+        rows[p_idx] = True
+        self._gene_bits[rows] |= self._gene_bits[c_idx]
+        self._desc_bits[rows] |= self._desc_bits[c_idx]
+        self._desc_bits[rows, c_idx >> 3] |= np.uint8(0x80 >> (c_idx & 7))
+        self._sizes[rows] = TermMembership._popcount(self._gene_bits[rows])
+
+    def remove_term(self, term):
+        """
+        Removes **term** whose parents are connected to its
+        children and genes, so genes of other terms are unchanged.
+        Bits of **term** left set in descendants of other terms are
+        never read since removed terms are skipped, which saves a
+        pass over every term per removal
+
+        :param term:
+        :type term: str
+        """
+        t_idx = self._get_term_idx(term)
+        self._alive[t_idx] = False
+        self._gene_bits[t_idx] = 0
+        self._desc_bits[t_idx] = 0
+        self._sizes[t_idx] = 0
+
+    def get_term_incidence(self, chunk_size=1024):
+        """
+        Gets genes of every term as a sparse term by gene matrix
+
+        :param chunk_size: Number of terms whose bits are
+                           unpacked at a time
+        :type chunk_size: int
+        :return: rows in the order of :py:meth:`get_terms`
+        :rtype: :py:class:`~cellmaps_generate_hierarchy.termoverlap.TermIncidence`
+        """
+        rows = np.flatnonzero(self._alive)
+        row_idx = []
+        col_idx = []
+        for start in range(0, len(rows), chunk_size):
+            dense = np.unpackbits(self._gene_bits[rows[start:start + chunk_size]], axis=1,
+                                  count=len(self._genes))
+            r, c = np.nonzero(dense)
+            row_idx.append(r + start)
+            col_idx.append(c)
+        row_idx = np.concatenate(row_idx) if len(row_idx) > 0 else np.empty(0, dtype=np.int64)
+        col_idx = np.concatenate(col_idx) if len(col_idx) > 0 else np.empty(0, dtype=np.int64)
+        matrix = sparse.csr_matrix((np.ones(len(row_idx), dtype=np.int32), (row_idx, col_idx)),
+                                   shape=(len(rows), len(self._genes)))
+        return TermIncidence([self._terms[i] for i in rows], matrix, self._genes)
+
+    def get_contained_pairs(self, ci_thre):
+        """
+        Gets every pair of terms where the second is smaller than, and
+        not already a descendant of, the first and shares at least
+        **ci_thre** of its genes with the first. Genes shared by all pairs
+        of terms come from a single product of the sparse term by gene
+        matrix with its transpose, so only pairs sharing genes are looked at
+
+        :param ci_thre: Containment index threshold
+        :type ci_thre: float
+        :return: ``(term, contained term)`` tuples ordered by size of
+                 term then size of contained term, largest first
+        :rtype: list
+        """
+        incidence = self.get_term_incidence()
+        rows = np.flatnonzero(self._alive)
+        sizes = self._sizes[rows]
+        overlap = TermOverlap().get_overlap_matrix(incidence, incidence).tocoo()
+        term, other, shared = overlap.row, overlap.col, overlap.data
+        keep = sizes[other] < sizes[term]
+        term, other, shared = term[keep], other[keep], shared[keep]
+        keep = shared / sizes[other] >= ci_thre
+        term, other = term[keep], other[keep]
+        term_rows, other_rows = rows[term], rows[other]
+        is_desc = (self._desc_bits[term_rows, other_rows >> 3] &
+                   (np.uint8(0x80) >> (other_rows & 7).astype(np.uint8))) != 0
+        term_rows, other_rows = term_rows[~is_desc], other_rows[~is_desc]
+        order = np.lexsort((other_rows, -self._sizes[other_rows], term_rows, -self._sizes[term_rows]))
+        return [(self._terms[t], self._terms[o]) for t, o in zip(term_rows[order], other_rows[order])]
+
+    def get_term_stats(self):
+        """
+        Gets size, genes and descendants of every term
+
+        :return: table indexed by term with ``tsize``, ``genes``
+                 and ``descendent`` columns
+        :rtype: :py:class:`pandas.DataFrame`
+        """
+        terms = self.get_terms()
+        df = pd.DataFrame(index=terms)
+        df['tsize'] = [self.get_size(t) for t in terms]
+        df['genes'] = [self.get_genes(t) for t in terms]
+        df['descendent'] = [self.get_descendants(t) for t in terms]
+        return df
+
+
 class HiDeFHierarchyRefiner(object):
     """
     Refines HiDeF hierarchy output by removing highly similar terms.
@@ -321,22 +711,18 @@ class HiDeFHierarchyRefiner(object):
 
     @staticmethod
     def _get_term_stats(nx_graph, hiergeneset):
-        # TODO: Finish implementing this
-        clusters = list(set(list(nx_graph.nodes())) - hiergeneset)
-        tsize_list = []
-        cgene_list = []
-        descendent_list = []
-        for c in clusters:
-            infoset = nx.descendants(nx_graph, c)
-            cgeneset = infoset.intersection(hiergeneset)
-            tsize_list.append(len(cgeneset))
-            cgene_list.append(list(cgeneset))
-            descendent_list.append(list(infoset - cgeneset))
-        df = pd.DataFrame(index=clusters)
-        df['tsize'] = tsize_list
-        df['genes'] = cgene_list
-        df['descendent'] = descendent_list
-        return df
+        """
+        Gets size, genes and descendants of every term of **nx_graph**
+
+        :param nx_graph:
+        :type nx_graph: :py:class:`networkx.DiGraph`
+        :param hiergeneset: Genes of the hierarchy
+        :type hiergeneset: set
+        :return: table indexed by term with ``tsize``, ``genes``
+                 and ``descendent`` columns
+        :rtype: :py:class:`pandas.DataFrame`
+        """
+        return TermMembership(nx_graph, hiergeneset).get_term_stats()
 
     @staticmethod
     def _jaccard(a, b):
@@ -356,134 +742,201 @@ class HiDeFHierarchyRefiner(object):
             b = set(b)
         return len(a.intersection(b)) / len(a.union(b))
 
-    def _clean_shortcut(self, nx_graph):
-        # TODO: Finish implementing this
-        edge_df = self._to_pandas_dataframe(nx_graph)
-        edge_df.columns = [HiDeFHierarchyRefiner.PARENT_COL,
-                           HiDeFHierarchyRefiner.CHILD_COL,
-                           HiDeFHierarchyRefiner.TYPE_COL]
-        for idx, row in edge_df.iterrows():
-            if len(list(nx.all_simple_paths(nx_graph, row[HiDeFHierarchyRefiner.PARENT_COL],
-                                            row[HiDeFHierarchyRefiner.CHILD_COL]))) > 1:
-                nx_graph.remove_edge(row[HiDeFHierarchyRefiner.PARENT_COL],
-                                     row[HiDeFHierarchyRefiner.CHILD_COL])
-                logger.debug('shortcut edges is removed between {} and {}'.format(row[HiDeFHierarchyRefiner.PARENT_COL],
-                                                                                  row[HiDeFHierarchyRefiner.CHILD_COL]))
-
-    def _reorganize(self, nx_graph, hiergeneset, ci_thre): # Add an edge if the nodes have containment index >=threshold
-        # TODO: Finish implementing this
-        iterate = True
+    def _clean_shortcut(self, nx_graph, membership):
+        """
+        Removes shortcut edges, those from a parent to a child term or
+        gene that is also reachable through another child of the parent,
+        leaving the transitive reduction of **nx_graph**. Since removing
+        a shortcut does not change what is reachable, each edge is
+        checked once against the descendants held by **membership**
+
+        :param nx_graph:
+        :type nx_graph: :py:class:`networkx.DiGraph`
+        :param membership: Genes and descendants of terms of **nx_graph**
+        :type membership: :py:class:`TermMembership`
+        """
+        shortcuts = []
+        for parent in membership.get_terms():
+            for child in membership.get_shortcut_children(parent, list(nx_graph.successors(parent))):
+                shortcuts.append((parent, child))
+        for parent, child in shortcuts:
+            nx_graph.remove_edge(parent, child)
+            logger.debug('shortcut edges is removed between {} and {}'.format(parent, child))
+
+    def _reorganize(self, nx_graph, membership, ci_thre):
+        """
+        Adds an edge from each term to every smaller term, not already its
+        descendant, that shares at least **ci_thre** of its genes with it,
+        then removes shortcut edges, until no more edges are added. All
+        such pairs of an iteration are found at once, from genes of terms
+        as of the start of the iteration, by
+        :py:meth:`TermMembership.get_contained_pairs`
+
+        :param nx_graph:
+        :type nx_graph: :py:class:`networkx.DiGraph`
+        :param membership: Genes and descendants of terms of **nx_graph**
+        :type membership: :py:class:`TermMembership`
+        :param ci_thre: Containment index threshold
+        :type ci_thre: float
+        :return: ``True`` if any edges were added
+        :rtype: bool
+        """
         n_iter = 1
-        while iterate:
-            clear = True
+        while True:
             logger.debug('... starting iteration ' + str(n_iter))
-            ts_df = self._get_term_stats(nx_graph, hiergeneset) # get the termStats from the networkx
-            ts_df.sort_values('tsize', ascending=False, inplace=True)
-            for comp, row in ts_df.iterrows():
-                tmp = ts_df[ts_df['tsize'] < row['tsize']] # get all components smaller than this components
-                if tmp.shape[0] == 0:
-                    continue
-                comp_geneset = set(row['genes']) # get the set of genes
-                descendent = row['descendent'] # get the list of descendent nodes
-                for tmp_comp, tmp_row in tmp.iterrows():
-                    if tmp_comp in descendent: # skip if already in descendent
-                        continue
-                    tmp_comp_geneset = set(tmp_row['genes'])
-                    # Check if satisfy ci_thre
-                    # intersection of two components divided by the term size of the smaller component
-                    if len(comp_geneset.intersection(tmp_comp_geneset))/tmp_row['tsize'] >= ci_thre:
-                        # Check if child having higher weight than parent
-                        logger.debug('{} is contained in {} with a CI bigger than threshold, add edge between'.format(tmp_comp, comp))
-                        nx_graph.add_edge(comp, tmp_comp, type='default')
-                        clear = False
-                        descendent += tmp_row['descendent']
-            # Further clean up using networkx to remove shortcut edges
-            self._clean_shortcut(nx_graph)
-            # Update variables
+            contained_pairs = membership.get_contained_pairs(ci_thre)
+            for comp, tmp_comp in contained_pairs:
+                logger.debug('{} is contained in {} with a CI bigger than threshold, '
+                             'add edge between'.format(tmp_comp, comp))
+                nx_graph.add_edge(comp, tmp_comp, type='default')
+                membership.add_edge(comp, tmp_comp)
+            # pairs where the smaller term is a descendant of another
+            # contained term were added above as shortcut edges
+            self._clean_shortcut(nx_graph, membership)
             n_iter += 1
-            if clear:
-                iterate = False
-        if n_iter == 2:
-            modified = False
-        else:
-            modified = True
-        return modified
+            if len(contained_pairs) == 0:
+                break
+        return n_iter > 2
 
-    def _merge_parent_child(self, nx_graph, hiergeneset, ji_thre):
-        # TODO: Finish implementing this
-        # Delete child term if highly similar with parent term
-        # One parent-child relationship at a time to avoid complicacies involved in potential long tail
+    def _delete_term(self, nx_graph, membership, term):
+        """
+        Removes **term** from **nx_graph** and **membership**, connecting
+        each of its parents to each of its children and genes
+
+        :param nx_graph:
+        :type nx_graph: :py:class:`networkx.DiGraph`
+        :param membership: Genes and descendants of terms of **nx_graph**
+        :type membership: :py:class:`TermMembership`
+        :param term:
+        :type term: str
+        :return: ``(parent, child)`` tuples of edges between terms
+                 that did not exist before
+        :rtype: list
+        """
+        parents = list(nx_graph.predecessors(term))
+        new_edges = []
+        for child_node in list(nx_graph.successors(term)):
+            etype = nx_graph[term][child_node]['type']
+            for pnode in parents:
+                if not nx_graph.has_edge(pnode, child_node) and etype == HiDeFHierarchyRefiner.DEFAULT_TYPE:
+                    new_edges.append((pnode, child_node))
+                nx_graph.add_edge(pnode, child_node, type=etype)
+        # Remove term along with its parent->term and term->child edges
+        nx_graph.remove_node(term)
+        membership.remove_term(term)
+        return new_edges
+
+    def _delete_child_terms(self, nx_graph, membership, get_deletable, message):
+        """
+        Removes the child term of the first parent-child pair, in edge
+        order of **nx_graph**, that **get_deletable** flags, connecting
+        its parents to its children, until no flagged pairs remain.
+        Removing a term does not change genes of remaining terms, so
+        pairs are flagged once and those flagged are kept in a queue
+        ordered as the edges of **nx_graph**. Only pairs created by
+        removing a term are flagged afterwards, so each removal takes
+        time proportional to the number of edges of the removed term
+
+        :param nx_graph:
+        :type nx_graph: :py:class:`networkx.DiGraph`
+        :param membership: Genes and descendants of terms of **nx_graph**
+        :type membership: :py:class:`TermMembership`
+        :param get_deletable: Function given ``(parent, child)`` tuples
+                              that returns a :py:class:`numpy.ndarray`
+                              that is ``True`` for pairs whose child
+                              should be removed
+        :type get_deletable: function
+        :param message: Log message formatted with parent, child
+                        and child of each removed pair
+        :type message: str
+        :return: removed terms
+        :rtype: list
+        """
+        # edges are ordered by position of parent in graph, then
+        # by when the edge was added to the graph
+        node_order = {node: i for i, node in enumerate(nx_graph.nodes())}
+        edge_seq = {}
+        seq_counter = itertools.count()
+        queue = []
+        edges = [(u, v) for u, v, etype in nx_graph.edges(data=HiDeFHierarchyRefiner.TYPE_COL)
+                 if etype == HiDeFHierarchyRefiner.DEFAULT_TYPE]
+        deleted_terms = []
+        while True:
+            deletable = get_deletable(edges) if len(edges) > 0 else []
+            for (parent, child), is_deletable in zip(edges, deletable):
+                edge_seq[(parent, child)] = next(seq_counter)
+                if is_deletable:
+                    heapq.heappush(queue, (node_order[parent], edge_seq[(parent, child)], parent, child))
+            if len(queue) == 0:
+                break
+            _, seq, parent, child = heapq.heappop(queue)
+            if edge_seq.get((parent, child)) != seq:
+                # edge was removed along with an earlier term
+                edges = []
+                continue
+            logger.debug(message.format(parent, child, child))
+            for edge in list(nx_graph.in_edges(child)) + list(nx_graph.out_edges(child)):
+                edge_seq.pop(edge, None)
+            deleted_terms.append(child)
+            edges = self._delete_term(nx_graph, membership, child)
+        return deleted_terms
+
+    def _merge_parent_child(self, nx_graph, membership, ji_thre):
+        """
+        Removes child term of each parent-child pair whose Jaccard index
+        is at least **ji_thre**, connecting its parents to its children.
+        One parent-child pair is merged at a time, always the first in
+        edge order of **nx_graph**, as merging a child can create new
+        pairs over the threshold, such as its parent and its child.
+        Jaccard index of all pairs is computed in one vectorized pass
+        by :py:meth:`TermMembership.get_jaccards`
+
+        :param nx_graph:
+        :type nx_graph: :py:class:`networkx.DiGraph`
+        :param membership: Genes and descendants of terms of **nx_graph**
+        :type membership: :py:class:`TermMembership`
+        :param ji_thre: Jaccard index threshold
+        :type ji_thre: float
+        :return: ``True`` if any terms were merged
+        :rtype: bool
+        """
         logger.debug('... start removing highly similar parent-child relationship')
-        similar = True
-        merged = False
-        while similar:
-            clear = True
-            edge_df = self._to_pandas_dataframe(nx_graph)
-            ts_df = self._get_term_stats(nx_graph, hiergeneset)
-            default_edge = edge_df[edge_df['type'] == 'default'] # edges
-            for idx, row in default_edge.iterrows():
-                if self._jaccard(ts_df.loc[row['source']]['genes'], ts_df.loc[row['target']]['genes']) >= ji_thre:
-                    logger.debug('# Cluster pair {}->{} failed Jaccard, removing cluster {}'.format(row['source'], row['target'],
-                                                                                             row['target']))
-                    clear = False
-                    merged = True
-                    parents = edge_df[edge_df['target'] == row['target']]['source'].values
-                    children = edge_df[edge_df['source'] == row['target']]['target'].values
-                    # Remove all parent->node edges
-                    for pnode in parents:
-                        nx_graph.remove_edge(pnode, row['target'])
-                    for child_node in children:
-                        etype = nx_graph[row['target']][child_node]['type']
-                        # Remove all node->child edges
-                        nx_graph.remove_edge(row['target'], child_node)
-                        # Add all parent->child edges
-                        for pnode in parents:
-                            nx_graph.add_edge(pnode, child_node, type=etype)
-                    # Remove target node
-                    nx_graph.remove_node(row['target'])
-                    break
-            if clear:
-                similar = False
+        merged_terms = self._delete_child_terms(nx_graph, membership,
+                                                lambda edges: membership.get_jaccards(edges) >= ji_thre,
+                                                '# Cluster pair {}->{} failed Jaccard, removing cluster {}')
         # Clean up shortcuts introduced during node deleteing process
-        self._clean_shortcut(nx_graph)
-        return merged
+        self._clean_shortcut(nx_graph, membership)
+        return len(merged_terms) > 0
 
-    def _collapse_redundant(self, nx_graph, hiergeneset, min_diff):
-        # TODO: Finish implementing this
-        # Delete child term if highly similar with parent term
-        # One parent-child relationship at a time to avoid complicacies involved in potential long tail
+    def _collapse_redundant(self, nx_graph, membership, min_diff):
+        """
+        Removes child term of each parent-child pair where the parent has
+        fewer than **min_diff** more genes than the child, connecting its
+        parents to its children. Like :py:meth:`_merge_parent_child`, pairs
+        are collapsed one at a time in edge order of **nx_graph**, using
+        term sizes cached by **membership**
+
+        :param nx_graph:
+        :type nx_graph: :py:class:`networkx.DiGraph`
+        :param membership: Genes and descendants of terms of **nx_graph**
+        :type membership: :py:class:`TermMembership`
+        :param min_diff: Minimum difference in number of genes
+                         of every parent-child pair
+        :type min_diff: int
+        :return: ``True`` if any terms were removed
+        :rtype: bool
+        """
         logger.debug('... start removing highly redundant systems')
-        while True:
-            edge_df = self._to_pandas_dataframe(nx_graph)
-            ts_df = self._get_term_stats(nx_graph, hiergeneset)
-            default_edge = edge_df[edge_df['type'] == 'default']
-            to_collapse = []
-            for idx, row in default_edge.iterrows():
-                parentSys, childSys, _ = row.values
-                if ts_df.loc[parentSys]['tsize'] - ts_df.loc[childSys]['tsize'] < min_diff:
-                    to_collapse.append([parentSys, childSys])
-            if len(to_collapse) == 0:
-                logger.debug('nothing to collapse')
-                return
-            to_collapse = pd.DataFrame(to_collapse, columns=['parent', 'child'])
-            deleteSys = to_collapse.loc['child']
-            logger.debug('# Cluster pair {}->{} highly redundant, removing cluster {}'.format(to_collapse.loc['parent'],
-                                                                                       to_collapse.loc['child'],
-                                                                                       deleteSys))
-            parents = edge_df[edge_df['target'] == deleteSys]['source'].values
-            children = edge_df[edge_df['source'] == deleteSys]['target'].values
-            # Remove all parent->node edges
-            for pnode in parents:
-                nx_graph.remove_edge(pnode, deleteSys)
-            for child_node in children:
-                etype = nx_graph[deleteSys][child_node]['type']
-                # Remove all node->child edges
-                nx_graph.remove_edge(deleteSys, child_node)
-                # Add all parent->child edges
-                for pnode in parents:
-                    nx_graph.add_edge(pnode, child_node, type=etype)
-            # Remove target node
-            nx_graph.remove_node(deleteSys)
+
+        def get_redundant(edges):
+            return (membership.get_sizes([p for p, _ in edges]) -
+                    membership.get_sizes([c for _, c in edges])) < min_diff
+
+        collapsed_terms = self._delete_child_terms(nx_graph, membership, get_redundant,
+                                                   '# Cluster pair {}->{} highly redundant, removing cluster {}')
+        if len(collapsed_terms) == 0:
+            logger.debug('nothing to collapse')
+        return len(collapsed_terms) > 0
 
     def _register_pruned_hidef_output_files(self, outprefix):
         """
@@ -510,13 +963,17 @@ class HiDeFHierarchyRefiner(object):
                                                                   data_dict=data_dict))
         return d_sets
 
-    def refine_hierarchy(self, outprefix=None):
+    def refine_hierarchy(self, outprefix=None, register_outputs=True):
         """
         Removes highly similar systems and dumps out a new HiDeF formatted
         .nodes and .edges file with .pruned.nodes and .pruned.edges suffixes
 
         :param outprefix: output_dir/file_prefix for the output file
         :type outprefix: str
+        :param register_outputs: If ``False``, .pruned.nodes and .pruned.edges
+                                 files are not registered with FAIRSCAPE, such
+                                 as for scratch output of bootstrap replicates
+        :type register_outputs: bool
         :return: dataset ids of .pruned.nodes and .pruned.edges file generated
         :rtype: list
         """
@@ -543,22 +1000,25 @@ class HiDeFHierarchyRefiner(object):
         if not nx.is_directed_acyclic_graph(nx_graph):
             raise ValueError('Input hierarchy is not DAG!')
 
+        # genes and descendants of each term, kept up to date as the graph changes
+        membership = TermMembership(nx_graph, hiergeneset)
+
         while True:
-            modified = self._reorganize(nx_graph, hiergeneset, self._ci_thre)
-            merged = self._merge_parent_child(nx_graph, hiergeneset, self._ji_thre)
+            modified = self._reorganize(nx_graph, membership, self._ci_thre)
+            merged = self._merge_parent_child(nx_graph, membership, self._ji_thre)
             if not modified and not merged:
                 break
 
-        self._collapse_redundant(nx_graph, hiergeneset, self._min_diff)
+        self._collapse_redundant(nx_graph, membership, self._min_diff)
         # Output as ddot edge file
-        self._clean_shortcut(nx_graph)
+        self._clean_shortcut(nx_graph, membership)
 
         edge_df = self._to_pandas_dataframe(nx_graph)
 
         # we need to recreate .nodes file in HiDeF format
         # so create nodes dataframe which has this mapping of
         # all genes for a given cluster (including genes attached to children)
-        nodes = self._get_term_stats(nx_graph, hiergeneset)
+        nodes = membership.get_term_stats()
         logger.debug(nodes.head())
 
         # get rid of the descendent column
@@ -599,7 +1059,7 @@ class HiDeFHierarchyRefiner(object):
         edges.to_csv(outprefix+'.pruned.edges', sep='\t', header=None,index=None)
 
         logger.debug('Number of edges is ' + str(len(edges)) + ', number of nodes are ' + str(len(nodes)))
-        if self._provenance_utils is not None:
+        if self._provenance_utils is not None and register_outputs is True:
             return self._register_pruned_hidef_output_files(outprefix + '.pruned')
         else:
             return list()
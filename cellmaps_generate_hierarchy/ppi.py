@@ -1,11 +1,18 @@
 import os
+import json
 import math
+import hashlib
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
 import pandas as pd
 import numpy as np
 import ndex2
-from cellmaps_utils import music_utils
 from cellmaps_utils import constants
 from cellmaps_generate_hierarchy.exceptions import CellmapsGenerateHierarchyError
+from cellmaps_generate_hierarchy.cache import get_file_digest
+
+logger = logging.getLogger(__name__)
 
 
 class PPINetworkGenerator(object):
@@ -29,6 +36,842 @@ class PPINetworkGenerator(object):
         """
         raise NotImplementedError('subclasses need to implement')
 
+    def get_next_network_edges(self):
+        """
+        Gets edges of next protein to protein interaction network.
+        This implementation converts each network from
+        :py:meth:`get_next_network`, subclasses should override
+        it to avoid building the networks
+
+        :return: Network edges
+        :rtype: :py:class:`PPINetworkEdges`
+        """
+        for network in self.get_next_network():
+            yield PPINetworkEdges.from_network(network)
+
+
+class GeneIndex(object):
+    """
+    Interned gene names where each gene is identified by its
+    position, an ``int32`` id, so edges can be stored as integer
+    arrays and gene names looked up only when needed.
+
+    A single index is created by the PPI generator and shared
+    by all the networks it generates
+    """
+
+    def __init__(self, names):
+        """
+        Constructor
+
+        :param names: Gene names in id order
+        :type names: list or :py:class:`numpy.ndarray`
+        :raises CellmapsGenerateHierarchyError: If **names** has duplicates
+        """
+        self._names = np.asarray(names, dtype=object)
+        self._index = pd.Index(self._names)
+        if not self._index.is_unique:
+            raise CellmapsGenerateHierarchyError('Gene names must be unique')
+
+    def __len__(self):
+        return len(self._names)
+
+    def get_names(self):
+        """
+        Gets gene names in id order
+
+        :return:
+        :rtype: :py:class:`numpy.ndarray`
+        """
+        return self._names
+
+    def get_ids(self, names):
+        """
+        Gets ids of genes in **names**
+
+        :param names:
+        :type names: list or :py:class:`numpy.ndarray`
+        :return: ids with ``-1`` for names not in index
+        :rtype: :py:class:`numpy.ndarray`
+        """
+        return self._index.get_indexer(names).astype(np.int32)
+
+    def get_name_to_id_dict(self, ids=None):
+        """
+        Gets dict of gene name to id
+
+        :param ids: If set, only include genes with these ids
+        :type ids: :py:class:`numpy.ndarray`
+        :return:
+        :rtype: dict
+        """
+        if ids is None:
+            ids = np.arange(len(self._names))
+        return dict(zip(self._names[ids].tolist(), np.asarray(ids).tolist()))
+
+
+class EdgeTable(object):
+    """
+    Columnar table of edges with ``int32`` source and target
+    ids from a :py:class:`GeneIndex` and optional ``float32``
+    weights, where a weight of ``NaN`` denotes a missing weight
+    """
+
+    def __init__(self, gene_index, sources, targets, weights=None):
+        """
+        Constructor
+
+        :param gene_index: Index the source and target ids refer to
+        :type gene_index: :py:class:`GeneIndex`
+        :param sources:
+        :type sources: :py:class:`numpy.ndarray`
+        :param targets:
+        :type targets: :py:class:`numpy.ndarray`
+        :param weights: Edge weights or ``None`` if unweighted
+        :type weights: :py:class:`numpy.ndarray`
+        """
+        self._gene_index = gene_index
+        self._sources = np.asarray(sources, dtype=np.int32)
+        self._targets = np.asarray(targets, dtype=np.int32)
+        self._weights = None if weights is None else np.asarray(weights, dtype=np.float32)
+
+    def __len__(self):
+        return len(self._sources)
+
+    def get_gene_index(self):
+        """
+        Gets gene index
+
+        :return:
+        :rtype: :py:class:`GeneIndex`
+        """
+        return self._gene_index
+
+    def get_sources(self):
+        """
+        Gets source ids
+
+        :return:
+        :rtype: :py:class:`numpy.ndarray`
+        """
+        return self._sources
+
+    def get_targets(self):
+        """
+        Gets target ids
+
+        :return:
+        :rtype: :py:class:`numpy.ndarray`
+        """
+        return self._targets
+
+    def get_weights(self):
+        """
+        Gets weights
+
+        :return: weights or ``None`` if unweighted
+        :rtype: :py:class:`numpy.ndarray`
+        """
+        return self._weights
+
+    def get_node_ids(self):
+        """
+        Gets sorted ids of genes that are in at least one edge
+
+        :return:
+        :rtype: :py:class:`numpy.ndarray`
+        """
+        return np.unique(np.concatenate([self._sources, self._targets]))
+
+    def slice(self, start, end):
+        """
+        Gets edges from **start** up to, but not including, **end** as
+        a new table that shares arrays and gene index with this one
+
+        :param start:
+        :type start: int
+        :param end:
+        :type end: int
+        :return:
+        :rtype: :py:class:`EdgeTable`
+        """
+        return EdgeTable(self._gene_index, self._sources[start:end], self._targets[start:end],
+                         weights=None if self._weights is None else self._weights[start:end])
+
+    def head(self, num_edges):
+        """
+        Gets first **num_edges** edges as a new table
+        that shares arrays and gene index with this one
+
+        :param num_edges:
+        :type num_edges: int
+        :return:
+        :rtype: :py:class:`EdgeTable`
+        """
+        return self.slice(0, num_edges)
+
+    def is_prefix_of(self, other):
+        """
+        Tells if edges in this table are the first edges of **other**
+
+        :param other:
+        :type other: :py:class:`EdgeTable`
+        :return:
+        :rtype: bool
+        """
+        if other.get_gene_index() is not self._gene_index or len(other) < len(self):
+            return False
+        if (self._weights is None) != (other.get_weights() is None):
+            return False
+        head = other.head(len(self))
+        return (np.array_equal(head.get_sources(), self._sources) and
+                np.array_equal(head.get_targets(), self._targets) and
+                (self._weights is None or np.array_equal(head.get_weights(), self._weights, equal_nan=True)))
+
+    def to_dataframe(self):
+        """
+        Gets edges with gene names
+
+        :return: edges with
+                 :py:const:`~cellmaps_utils.constants.PPI_EDGELIST_GENEA_COL`,
+                 :py:const:`~cellmaps_utils.constants.PPI_EDGELIST_GENEB_COL` and, if
+                 weighted, :py:const:`~cellmaps_utils.constants.WEIGHTED_PPI_EDGELIST_WEIGHT_COL`
+                 columns
+        :rtype: :py:class:`pandas.DataFrame`
+        """
+        names = self._gene_index.get_names()
+        df = pd.DataFrame({constants.PPI_EDGELIST_GENEA_COL: names[self._sources],
+                           constants.PPI_EDGELIST_GENEB_COL: names[self._targets]})
+        if self._weights is not None:
+            df[constants.WEIGHTED_PPI_EDGELIST_WEIGHT_COL] = self._weights.astype(np.float64)
+        return df
+
+    @staticmethod
+    def from_dataframe(df):
+        """
+        Creates table from **df** with columns described in
+        :py:meth:`to_dataframe`. Gene ids are assigned in order of
+        first appearance, source before target, which matches the
+        node ids given by :py:func:`ndex2.create_nice_cx_from_pandas`
+
+        :param df:
+        :type df: :py:class:`pandas.DataFrame`
+        :return:
+        :rtype: :py:class:`EdgeTable`
+        """
+        codes, names = pd.factorize(np.column_stack([df[constants.PPI_EDGELIST_GENEA_COL].values,
+                                                     df[constants.PPI_EDGELIST_GENEB_COL].values]).ravel())
+        weights = None
+        if constants.WEIGHTED_PPI_EDGELIST_WEIGHT_COL in df.columns:
+            weights = pd.to_numeric(df[constants.WEIGHTED_PPI_EDGELIST_WEIGHT_COL]).values
+        return EdgeTable(GeneIndex(np.asarray(names, dtype=object)), codes[0::2], codes[1::2],
+                         weights=weights)
+
+
+class PPINetworkEdges(object):
+    """
+    Edges of a protein to protein interaction network, as an
+    :py:class:`EdgeTable`, along with network name, description
+    and attributes.
+
+    This lets networks be passed to a hierarchy generator without
+    building, writing and parsing a CX network for each one. Like
+    :py:class:`ndex2.nice_cx_network.NiceCXNetwork`, it offers
+    :py:meth:`get_name` and :py:meth:`get_network_attribute`
+    """
+
+    def __init__(self, edges, name=None, description=None, attributes=None):
+        """
+        Constructor
+
+        :param edges: Edges, a :py:class:`pandas.DataFrame` as described in
+                      :py:meth:`EdgeTable.to_dataframe` is also accepted
+        :type edges: :py:class:`EdgeTable`
+        :param name: Name of network
+        :type name: str
+        :param description: Description of network
+        :type description: str
+        :param attributes: Other network attributes as name to value
+        :type attributes: dict
+        """
+        if isinstance(edges, pd.DataFrame):
+            edges = EdgeTable.from_dataframe(edges)
+        self._edge_table = edges
+        self._name = name
+        self._description = description
+        self._attributes = {} if attributes is None else attributes
+
+    def get_edge_table(self):
+        """
+        Gets edges
+
+        :return:
+        :rtype: :py:class:`EdgeTable`
+        """
+        return self._edge_table
+
+    def get_edges(self):
+        """
+        Gets edges with gene names
+
+        :return:
+        :rtype: :py:class:`pandas.DataFrame`
+        """
+        return self._edge_table.to_dataframe()
+
+    def get_num_edges(self):
+        """
+        Gets number of edges
+
+        :return:
+        :rtype: int
+        """
+        return len(self._edge_table)
+
+    def get_name(self):
+        """
+        Gets name of network
+
+        :return:
+        :rtype: str
+        """
+        return self._name
+
+    def get_name_to_id_dict(self):
+        """
+        Gets dict of name to id for genes in this network. The
+        ids match the node ids of :py:meth:`get_network`
+
+        :return:
+        :rtype: dict
+        """
+        return self._edge_table.get_gene_index().get_name_to_id_dict(ids=self._edge_table.get_node_ids())
+
+    def get_network_attribute(self, name):
+        """
+        Gets network attribute in same format as
+        :py:meth:`ndex2.nice_cx_network.NiceCXNetwork.get_network_attribute`
+
+        :param name: Name of attribute
+        :type name: str
+        :return: ``{'n': name, 'v': value}`` or ``None`` if not found
+        :rtype: dict
+        """
+        if name == 'description' and self._description is not None:
+            return {'n': name, 'v': self._description}
+        if name not in self._attributes:
+            return None
+        return {'n': name, 'v': self._attributes[name]}
+
+    def get_network_attribute_names(self):
+        """
+        Gets names of network attributes other than name and description
+
+        :return:
+        :rtype: list
+        """
+        return list(self._attributes.keys())
+
+    def get_network(self):
+        """
+        Builds network from edges. Node ids are the gene ids
+        from the :py:class:`GeneIndex` of the edges
+
+        :return: Network
+        :rtype: :py:class:`ndex2.nice_cx_network.NiceCXNetwork`
+        """
+        net = ndex2.nice_cx_network.NiceCXNetwork()
+        names = self._edge_table.get_gene_index().get_names()
+        node_ids = self._edge_table.get_node_ids().tolist()
+        for node_id, node_name in zip(node_ids, names[node_ids].tolist()):
+            net.nodes[node_id] = {'@id': node_id, 'n': node_name, 'r': node_name}
+        sources = self._edge_table.get_sources().tolist()
+        targets = self._edge_table.get_targets().tolist()
+        for edge_id in range(len(sources)):
+            net.edges[edge_id] = {'@id': edge_id, 's': sources[edge_id], 't': targets[edge_id],
+                                  'i': 'interacts-with'}
+        weights = self._edge_table.get_weights()
+        if weights is not None:
+            for edge_id, weight in enumerate(weights.astype(np.float64).tolist()):
+                if weight == weight:
+                    net.edgeAttributes[edge_id] = [{'po': edge_id,
+                                                    'n': constants.WEIGHTED_PPI_EDGELIST_WEIGHT_COL,
+                                                    'v': weight, 'd': 'double'}]
+        net.node_int_id_generator = node_ids[-1] + 1 if len(node_ids) > 0 else 0
+        net.edge_int_id_generator = len(sources)
+        net.set_name(self._name)
+        if self._description is not None:
+            net.set_network_attribute(name='description', values=self._description)
+        for name, value in self._attributes.items():
+            net.set_network_attribute(name=name, values=value)
+        return net
+
+    @staticmethod
+    def from_network(network):
+        """
+        Gets edges, name and network attributes from **network**.
+        Genes are given ids in node id order, so node ids are kept
+        if they run from ``0`` to number of nodes minus one
+
+        :param network:
+        :type network: :py:class:`ndex2.nice_cx_network.NiceCXNetwork`
+        :return: Network edges
+        :rtype: :py:class:`PPINetworkEdges`
+        """
+        node_ids = sorted([node_id for node_id, node_obj in network.get_nodes()])
+        id_to_pos = {node_id: pos for pos, node_id in enumerate(node_ids)}
+        gene_index = GeneIndex([network.get_node(node_id)['n'] for node_id in node_ids])
+        num_edges = len(network.get_edges())
+        sources = np.empty(num_edges, dtype=np.int32)
+        targets = np.empty(num_edges, dtype=np.int32)
+        weights = np.full(num_edges, np.nan, dtype=np.float32)
+        for idx, (edge_id, edge_obj) in enumerate(network.get_edges()):
+            sources[idx] = id_to_pos[edge_obj['s']]
+            targets[idx] = id_to_pos[edge_obj['t']]
+            weight_attr = network.get_edge_attribute(edge_id, constants.WEIGHTED_PPI_EDGELIST_WEIGHT_COL)
+            if isinstance(weight_attr, dict) and weight_attr.get('v') is not None:
+                weights[idx] = float(weight_attr.get('v'))
+        description = None
+        attributes = {}
+        for attr in network.get_network_attribute_names():
+            value = network.get_network_attribute(attr)['v']
+            if attr == 'description':
+                description = value
+            elif attr != 'name':
+                attributes[attr] = value
+        return PPINetworkEdges(EdgeTable(gene_index, sources, targets,
+                                         weights=None if np.all(np.isnan(weights)) else weights),
+                               name=network.get_name(), description=description, attributes=attributes)
+
+
+class EdgeStore(object):
+    """
+    Compact on disk store of the edges of a set of networks.
+
+    Edges are kept in a single binary
+    :py:const:`EdgeStore.EDGES_SUFFIX` file, that is memory mapped
+    when read, holding ``int32`` source and target gene ids and
+    ``float32`` weights. Networks whose edges are the first edges of
+    a larger network, such as the nested networks from
+    :py:class:`CosineSimilarityPPIGenerator`, are stored as the number
+    of edges of the larger network they use, so shared edges are
+    written once. Gene names and network names, descriptions, attributes
+    and offsets are kept in a :py:const:`EdgeStore.INDEX_SUFFIX` file
+    """
+
+    EDGES_SUFFIX = '.npy'
+
+    INDEX_SUFFIX = '.json'
+
+    VERSION = '1'
+
+    EDGE_DTYPE = np.dtype([('source', np.int32), ('target', np.int32), ('weight', np.float32)])
+
+    def __init__(self, prefix_path):
+        """
+        Constructor
+
+        :param prefix_path: Path to store files without suffix
+        :type prefix_path: str
+        """
+        self._prefix_path = prefix_path
+        self._index = None
+        self._edge_table = None
+
+    def get_files(self):
+        """
+        Gets paths of files making up the store
+
+        :return: (edges file, index file)
+        :rtype: tuple
+        """
+        return self._prefix_path + EdgeStore.EDGES_SUFFIX, self._prefix_path + EdgeStore.INDEX_SUFFIX
+
+    def _load(self):
+        """
+        Reads index and memory maps edges if not already done
+
+        :raises CellmapsGenerateHierarchyError: If store could not be read
+        """
+        if self._index is not None:
+            return
+        edges_file, index_file = self.get_files()
+        try:
+            with open(index_file, 'r') as f:
+                index = json.load(f)
+            edges = np.load(edges_file, mmap_mode='r', allow_pickle=False)
+        except (OSError, ValueError) as e:
+            raise CellmapsGenerateHierarchyError('Unable to read edge store ' +
+                                                 str(self._prefix_path) + ' : ' + str(e))
+        if index.get('version') != EdgeStore.VERSION or edges.dtype != EdgeStore.EDGE_DTYPE:
+            raise CellmapsGenerateHierarchyError('Unsupported edge store ' + str(self._prefix_path))
+        self._edge_table = EdgeTable(GeneIndex(index['genes']), edges['source'], edges['target'],
+                                     weights=edges['weight'] if index['weighted'] else None)
+        self._index = index
+
+    def get_num_networks(self):
+        """
+        Gets number of networks in store
+
+        :return:
+        :rtype: int
+        """
+        self._load()
+        return len(self._index['networks'])
+
+    def get_gene_index(self):
+        """
+        Gets gene index whose ids are the source and target
+        gene ids of the edges of every network in store
+
+        :return:
+        :rtype: :py:class:`GeneIndex`
+        """
+        self._load()
+        return self._edge_table.get_gene_index()
+
+    def get_network_edges(self, idx):
+        """
+        Gets edges of network at position **idx**. The edges
+        are backed by the memory mapped edges file
+
+        :param idx:
+        :type idx: int
+        :return:
+        :rtype: :py:class:`PPINetworkEdges`
+        """
+        self._load()
+        network = self._index['networks'][idx]
+        return PPINetworkEdges(self._edge_table.slice(network['start'], network['start'] + network['num_edges']),
+                               name=network['name'], description=network['description'],
+                               attributes=network['attributes'])
+
+    def get_all_network_edges(self):
+        """
+        Gets edges of all networks in the order they were stored
+
+        :return:
+        :rtype: list
+        """
+        return [self.get_network_edges(idx) for idx in range(self.get_num_networks())]
+
+    @staticmethod
+    def _get_common_gene_index(network_edges):
+        """
+        Gets gene index shared by all of **network_edges** or,
+        if they differ, a new index with genes from all of them
+
+        :param network_edges:
+        :type network_edges: list
+        :return:
+        :rtype: :py:class:`GeneIndex`
+        """
+        gene_index = network_edges[0].get_edge_table().get_gene_index()
+        if all(e.get_edge_table().get_gene_index() is gene_index for e in network_edges):
+            return gene_index
+        return GeneIndex(pd.unique(np.concatenate([e.get_edge_table().get_gene_index().get_names()
+                                                   for e in network_edges])))
+
+    @staticmethod
+    def create(prefix_path, network_edges):
+        """
+        Writes **network_edges** to a new store
+
+        :param prefix_path: Path to store files without suffix
+        :type prefix_path: str
+        :param network_edges: Edges of each network
+        :type network_edges: list
+        :raises CellmapsGenerateHierarchyError: If **network_edges** is empty
+        :return: store
+        :rtype: :py:class:`EdgeStore`
+        """
+        if network_edges is None or len(network_edges) == 0:
+            raise CellmapsGenerateHierarchyError('No networks to store')
+        gene_index = EdgeStore._get_common_gene_index(network_edges)
+        weighted = any(e.get_edge_table().get_weights() is not None for e in network_edges)
+
+        # largest networks first so smaller networks can reuse their edges
+        order = sorted(range(len(network_edges)), key=lambda i: -network_edges[i].get_num_edges())
+        segments = []
+        starts = {}
+        num_stored = 0
+        for idx in order:
+            edge_table = network_edges[idx].get_edge_table()
+            for start, segment in segments:
+                if edge_table.is_prefix_of(segment):
+                    starts[idx] = start
+                    break
+            else:
+                starts[idx] = num_stored
+                segments.append((num_stored, edge_table))
+                num_stored += len(edge_table)
+
+        edges = np.empty(num_stored, dtype=EdgeStore.EDGE_DTYPE)
+        for start, edge_table in segments:
+            end = start + len(edge_table)
+            sources = edge_table.get_sources()
+            targets = edge_table.get_targets()
+            if edge_table.get_gene_index() is not gene_index:
+                names = edge_table.get_gene_index().get_names()
+                sources = gene_index.get_ids(names[sources])
+                targets = gene_index.get_ids(names[targets])
+            edges['source'][start:end] = sources
+            edges['target'][start:end] = targets
+            edges['weight'][start:end] = np.nan if edge_table.get_weights() is None else edge_table.get_weights()
+
+        networks = []
+        for idx, cur_edges in enumerate(network_edges):
+            attributes = {}
+            for name in cur_edges.get_network_attribute_names():
+                attributes[name] = cur_edges.get_network_attribute(name)['v']
+            desc_attr = cur_edges.get_network_attribute('description')
+            networks.append({'name': cur_edges.get_name(),
+                             'description': None if desc_attr is None else desc_attr['v'],
+                             'attributes': attributes,
+                             'start': starts[idx],
+                             'num_edges': cur_edges.get_num_edges()})
+
+        store = EdgeStore(prefix_path)
+        edges_file, index_file = store.get_files()
+        np.save(edges_file, edges, allow_pickle=False)
+        with open(index_file, 'w') as f:
+            json.dump({'version': EdgeStore.VERSION,
+                       'weighted': weighted,
+                       'genes': gene_index.get_names().tolist(),
+                       'networks': networks}, f)
+        return store
+
+
+class EdgeBuffer(object):
+    """
+    Compact, append only buffer of weighted edges stored as
+    chunks of ``int32`` source and target indices and ``float32``
+    weights. Chunks are only concatenated when :py:meth:`get_edges`
+    is called
+    """
+
+    def __init__(self):
+        """
+        Constructor
+        """
+        self._sources = []
+        self._targets = []
+        self._weights = []
+        self._num_edges = 0
+
+    def __len__(self):
+        return self._num_edges
+
+    def append(self, sources, targets, weights):
+        """
+        Adds a chunk of edges to buffer
+
+        :param sources: source indices
+        :type sources: :py:class:`numpy.ndarray`
+        :param targets: target indices
+        :type targets: :py:class:`numpy.ndarray`
+        :param weights: edge weights
+        :type weights: :py:class:`numpy.ndarray`
+        """
+        self._sources.append(np.asarray(sources, dtype=np.int32))
+        self._targets.append(np.asarray(targets, dtype=np.int32))
+        self._weights.append(np.asarray(weights, dtype=np.float32))
+        self._num_edges += len(self._sources[-1])
+
+    def get_edges(self):
+        """
+        Gets all edges in buffer
+
+        :return: (sources, targets, weights)
+        :rtype: tuple
+        """
+        if self._num_edges == 0:
+            return (np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int32),
+                    np.empty(0, dtype=np.float32))
+        return (np.concatenate(self._sources), np.concatenate(self._targets),
+                np.concatenate(self._weights))
+
+    def get_top_edges(self, num_edges):
+        """
+        Gets a new buffer holding only the **num_edges** edges with
+        the largest weights. This uses a partial selection so the
+        edges in the new buffer are **NOT** sorted
+
+        :param num_edges: Number of edges to keep
+        :type num_edges: int
+        :return: buffer with at most **num_edges** edges
+        :rtype: :py:class:`EdgeBuffer`
+        """
+        sources, targets, weights = self.get_edges()
+        top = EdgeBuffer()
+        if num_edges <= 0:
+            return top
+        if len(weights) > num_edges:
+            keep = np.argpartition(-weights, num_edges - 1)[:num_edges]
+            sources, targets, weights = sources[keep], targets[keep], weights[keep]
+        top.append(sources, targets, weights)
+        return top
+
+    def get_sorted_edges(self):
+        """
+        Gets all edges sorted by weight in descending order. Ties
+        are ordered by source and then target index
+
+        :return: (sources, targets, weights)
+        :rtype: tuple
+        """
+        sources, targets, weights = self.get_edges()
+        order = np.lexsort((targets, sources, -weights))
+        return sources[order], targets[order], weights[order]
+
+
+_WORKER_STATE = {}
+
+
+def _init_similarity_worker(shm_name, shape, tile_size):
+    """
+    Initializer for worker processes that attaches the shared
+    memory segment holding the L2 normalized embeddings
+
+    :param shm_name: Name of shared memory segment
+    :type shm_name: str
+    :param shape: ``(folds, proteins, dimensions)`` of embeddings
+    :type shape: tuple
+    :param tile_size: Number of proteins per side of each block
+    :type tile_size: int
+    """
+    shm = shared_memory.SharedMemory(name=shm_name)
+    _WORKER_STATE['shm'] = shm
+    _WORKER_STATE['embeddings'] = np.ndarray(shape, dtype=np.float32, buffer=shm.buf)
+    _WORKER_STATE['tile_size'] = tile_size
+
+
+def _iter_stripe_tiles(num_rows, row_start, tile_size):
+    """
+    Generator of the ``(col start, col end)`` blocks, on or above the
+    diagonal, for the row stripe starting at **row_start**
+
+    :param num_rows:
+    :type num_rows: int
+    :param row_start:
+    :type row_start: int
+    :param tile_size:
+    :type tile_size: int
+    """
+    for col_start in range(row_start, num_rows, tile_size):
+        yield col_start, min(col_start + tile_size, num_rows)
+
+
+def _get_stripe_similarity_range(row_bounds):
+    """
+    Worker function that gets the minimum and maximum cosine
+    similarity of each fold for a row stripe
+
+    :param row_bounds: ``(row start, row end)``
+    :type row_bounds: tuple
+    :return: ``(min, max)`` for each fold
+    :rtype: list
+    """
+    row_start, row_end = row_bounds
+    embeddings = _WORKER_STATE['embeddings']
+    res = []
+    for embedding in embeddings:
+        min_sim = np.inf
+        max_sim = -np.inf
+        for col_start, col_end in _iter_stripe_tiles(embedding.shape[0], row_start, _WORKER_STATE['tile_size']):
+            block = embedding[row_start:row_end] @ embedding[col_start:col_end].T
+            min_sim = min(min_sim, float(block.min()))
+            max_sim = max(max_sim, float(block.max()))
+        res.append((min_sim, max_sim))
+    return res
+
+
+def _get_stripe_similarity_edges(task):
+    """
+    Worker function that computes the scaled, fold averaged, similarity
+    edges for a row stripe keeping at most **max_num_edges** of them.
+    The edges are written to a new shared memory segment, as ``int32``
+    sources, ``int32`` targets and ``float32`` weights, so they are not
+    pickled back to the parent process
+
+    :param task: ``(row start, row end, scalings, max_num_edges)``
+    :type task: tuple
+    :return: ``(shared memory segment name, number of edges)``, name is
+             ``None`` if there are no edges
+    :rtype: tuple
+    """
+    row_start, row_end, scalings, max_num_edges = task
+    embeddings = _WORKER_STATE['embeddings']
+    edges = EdgeBuffer()
+    for col_start, col_end in _iter_stripe_tiles(embeddings.shape[1], row_start, _WORKER_STATE['tile_size']):
+        edges.append(*_get_tile_edges(embeddings, scalings, row_start, row_end, col_start, col_end))
+        if max_num_edges is not None and len(edges) > 2 * max_num_edges:
+            edges = edges.get_top_edges(max_num_edges)
+    if max_num_edges is not None:
+        edges = edges.get_top_edges(max_num_edges)
+    num_edges = len(edges)
+    if num_edges == 0:
+        return None, 0
+    sources, targets, weights = edges.get_edges()
+    shm = shared_memory.SharedMemory(create=True, size=3 * 4 * num_edges)
+    shared = np.ndarray((3, num_edges), dtype=np.int32, buffer=shm.buf)
+    shared[0] = sources
+    shared[1] = targets
+    shared[2] = weights.view(np.int32)
+    del shared
+    shm.close()
+    return shm.name, num_edges
+
+
+def _read_shared_edges(shm_name, num_edges):
+    """
+    Copies edges written by :py:func:`_get_stripe_similarity_edges`
+    out of shared memory and then releases the shared memory
+
+    :param shm_name: Name of shared memory segment
+    :type shm_name: str
+    :param num_edges:
+    :type num_edges: int
+    :return: (sources, targets, weights)
+    :rtype: tuple
+    """
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        shared = np.ndarray((3, num_edges), dtype=np.int32, buffer=shm.buf)
+        sources = shared[0].copy()
+        targets = shared[1].copy()
+        weights = shared[2].copy().view(np.float32)
+        del shared
+    finally:
+        shm.close()
+        shm.unlink()
+    return sources, targets, weights
+
+
+def _get_tile_edges(embeddings, scalings, row_start, row_end, col_start, col_end):
+    """
+    Computes the scaled, fold averaged, cosine similarity for the
+    pairs of a block that lie above the diagonal
+
+    :param embeddings: L2 normalized embeddings, one per fold
+    :type embeddings: list
+    :param scalings: ``(multiplier, offset)`` for each fold, including fold weight
+    :type scalings: list
+    :return: (rows, cols, weights)
+    :rtype: tuple
+    """
+    block = np.zeros((row_end - row_start, col_end - col_start), dtype=np.float32)
+    for embedding, (multiplier, offset) in zip(embeddings, scalings):
+        fold_block = embedding[row_start:row_end] @ embedding[col_start:col_end].T
+        fold_block *= multiplier
+        fold_block += offset
+        block += fold_block
+
+    rows = np.arange(row_start, row_end)
+    cols = np.arange(col_start, col_end)
+    row_idx, col_idx = np.nonzero(cols[np.newaxis, :] > rows[:, np.newaxis])
+    return rows[row_idx], cols[col_idx], block[row_idx, col_idx]
+
 
 class CosineSimilarityPPIGenerator(PPINetworkGenerator):
     """
@@ -39,49 +882,441 @@ class CosineSimilarityPPIGenerator(PPINetworkGenerator):
         ID # # # #
 
     Where ID is gene and #'s is embedding vector
+
+    The embedding can also be stored in binary form by replacing
+    the ``.tsv`` suffix of the embedding file name with one of
+    :py:const:`BINARY_EMBEDDING_SUFFIXES`. For ``.npy`` files,
+    and ``.npz`` files lacking an ``ids`` array, the IDs are read,
+    one per line, from a sidecar file with the same name, but with
+    :py:const:`IDS_SUFFIX` suffix. ``.npy`` files are memory mapped.
+
+    Similarities are computed block by block over the upper
+    triangle of the protein by protein matrix so peak memory
+    is bounded by **tile_size** rather than the number of proteins
+    squared. Setting **workers** above ``1`` computes row stripes
+    of blocks in a pool of processes that read the embeddings
+    from, and return edges through, shared memory.
+
+    If **edge_budget** or **avg_degree** is set, the network for the
+    largest cutoff gets that many edges, or enough edges for that
+    average node degree, whatever the number of proteins, and the
+    other networks get a proportional share. For example, with cutoffs
+    ``[0.05, 0.1]`` and an **edge_budget** of ``1000`` the networks
+    will have ``500`` and ``1000`` edges.
+
+    If **reduction** is set, each L2 normalized fold is first projected
+    to fewer dimensions, with :py:const:`PCA_REDUCTION` (uncentered, so
+    dot products are preserved) or a seeded Gaussian
+    :py:const:`RANDOM_PROJECTION_REDUCTION`, lowering the cost of the
+    similarity step which grows linearly with the number of dimensions.
     """
     PPI_CUTOFFS = [0.001, 0.002, 0.003, 0.004, 0.005, 0.006,
                    0.007, 0.008, 0.009, 0.01, 0.02, 0.03,
                    0.04, 0.05, 0.10]
 
+    TILE_SIZE = 2048
+
+    TSV_SUFFIX = '.tsv'
+
+    BINARY_EMBEDDING_SUFFIXES = ['.npy', '.npz', '.parquet', '.h5']
+
+    IDS_SUFFIX = '.ids.txt'
+
+    NPZ_EMBEDDING_KEY = 'embedding'
+
+    NPZ_IDS_KEY = 'ids'
+
+    EMBEDDING_CACHE_FILE = 'embedding.npy'
+
+    SIMILARITY_CACHE_FILE = 'ppi_edges.npz'
+
+    SIMILARITY_CACHE_VERSION = '1'
+
+    PCA_REDUCTION = 'pca'
+
+    RANDOM_PROJECTION_REDUCTION = 'random_projection'
+
+    REDUCTIONS = [PCA_REDUCTION, RANDOM_PROJECTION_REDUCTION]
+
     def __init__(self, embeddingdirs=[],
-                 cutoffs=PPI_CUTOFFS):
+                 cutoffs=PPI_CUTOFFS,
+                 tile_size=TILE_SIZE,
+                 fold_weights=None,
+                 embedding_cache=None,
+                 similarity_cache=None,
+                 workers=1,
+                 edge_budget=None,
+                 avg_degree=None,
+                 reduction=None,
+                 reduced_dims=None,
+                 explained_variance=None,
+                 random_seed=None,
+                 reduction_report_file=None):
         """
         Constructor
+
+        :param embeddingdirs: Directories containing embeddings, one per fold
+        :type embeddingdirs: list
+        :param cutoffs: Fraction of top edges to keep for each network generated
+        :type cutoffs: list
+        :param tile_size: Number of proteins per side of each block of the
+                          similarity matrix computed at once
+        :type tile_size: int
+        :param fold_weights: Weight of each fold, in same order as **embeddingdirs**,
+                             when averaging similarities across folds. If ``None``
+                             every fold is weighted equally
+        :type fold_weights: list
+        :param embedding_cache: Cache where ``.tsv`` embeddings are stored,
+                                after conversion, as ``.npy`` files that later
+                                runs can memory map. If ``None``, no conversion
+                                is cached
+        :type embedding_cache: :py:class:`~cellmaps_generate_hierarchy.cache.FileCache`
+        :param similarity_cache: Cache used to store and reuse the fold averaged,
+                                 top fraction, edges across runs. If ``None``
+                                 similarities are always computed
+        :type similarity_cache: :py:class:`~cellmaps_generate_hierarchy.cache.FileCache`
+        :param workers: Number of processes used to compute similarities
+        :type workers: int
+        :param edge_budget: Number of edges in network for the largest cutoff
+        :type edge_budget: int
+        :param avg_degree: Average node degree of network for the largest cutoff
+        :type avg_degree: float
+        :param reduction: Dimensionality reduction applied to each fold before
+                          computing similarities, one of :py:const:`REDUCTIONS`
+                          or ``None`` to use all dimensions
+        :type reduction: str
+        :param reduced_dims: Number of dimensions to reduce each fold to
+        :type reduced_dims: int
+        :param explained_variance: For :py:const:`PCA_REDUCTION`, fraction, in
+                                   ``(0, 1]``, of variance that must be kept. Used
+                                   to pick the number of dimensions when
+                                   **reduced_dims** is ``None``
+        :type explained_variance: float
+        :param random_seed: Seed for :py:const:`RANDOM_PROJECTION_REDUCTION`
+        :type random_seed: int
+        :param reduction_report_file: If set, path to JSON file where a report
+                                      comparing the top edges found with and
+                                      without **reduction** is written. This
+                                      requires computing the exact similarities
+                                      as well
+        :type reduction_report_file: str
         """
         super().__init__()
         if embeddingdirs is None or len(embeddingdirs) < 1:
             raise CellmapsGenerateHierarchyError('embeddingdir is None')
+        if tile_size is None or tile_size < 1:
+            raise CellmapsGenerateHierarchyError('tile_size must be a positive integer')
+        if workers is None or workers < 1:
+            raise CellmapsGenerateHierarchyError('workers must be a positive integer')
+        if edge_budget is not None and avg_degree is not None:
+            raise CellmapsGenerateHierarchyError('Only one of edge_budget and avg_degree can be set')
+        if edge_budget is not None and edge_budget < 1:
+            raise CellmapsGenerateHierarchyError('edge_budget must be 1 or larger')
+        if avg_degree is not None and avg_degree <= 0:
+            raise CellmapsGenerateHierarchyError('avg_degree must be larger than 0')
+        if reduction is not None:
+            if reduction not in CosineSimilarityPPIGenerator.REDUCTIONS:
+                raise CellmapsGenerateHierarchyError('Invalid reduction: ' + str(reduction) + ' must be one of ' +
+                                                     str(CosineSimilarityPPIGenerator.REDUCTIONS))
+            if reduced_dims is None and (explained_variance is None or
+                                         reduction != CosineSimilarityPPIGenerator.PCA_REDUCTION):
+                raise CellmapsGenerateHierarchyError('reduced_dims must be set for ' + str(reduction) +
+                                                     ' reduction unless explained_variance is set for ' +
+                                                     CosineSimilarityPPIGenerator.PCA_REDUCTION)
+            if reduced_dims is not None and reduced_dims < 1:
+                raise CellmapsGenerateHierarchyError('reduced_dims must be a positive integer')
+            if explained_variance is not None and not 0 < explained_variance <= 1:
+                raise CellmapsGenerateHierarchyError('explained_variance must be in (0, 1]')
 
         self._embeddingdirs = embeddingdirs
         self._cutoffs = cutoffs
+        self._tile_size = int(tile_size)
+        self._fold_weights = self._get_normalized_fold_weights(fold_weights, len(embeddingdirs))
+        self._embedding_cache = embedding_cache
+        self._similarity_cache = similarity_cache
+        self._workers = int(workers)
+        self._edge_budget = None if edge_budget is None else int(edge_budget)
+        self._avg_degree = avg_degree
+        self._reduction = reduction
+        self._reduced_dims = None if reduced_dims is None else int(reduced_dims)
+        self._explained_variance = explained_variance
+        self._random_seed = random_seed
+        self._reduction_report_file = reduction_report_file
 
-    def _get_ppi_dataframe(self):
+    @staticmethod
+    def _get_normalized_fold_weights(fold_weights, num_folds):
         """
+        Gets **fold_weights** scaled to sum to one
 
-        :return:
+        :param fold_weights: Weight of each fold or ``None`` for equal weights
+        :type fold_weights: list
+        :param num_folds: Number of folds
+        :type num_folds: int
+        :raises CellmapsGenerateHierarchyError: If number of weights does not
+                                                match number of folds or weights
+                                                are invalid
+        :return: weights that sum to one
+        :rtype: list
+        """
+        if fold_weights is None:
+            return [1.0 / num_folds] * num_folds
+        if len(fold_weights) != num_folds:
+            raise CellmapsGenerateHierarchyError('Number of fold weights (' + str(len(fold_weights)) +
+                                                 ') does not match number of embedding '
+                                                 'directories (' + str(num_folds) + ')')
+        if min(fold_weights) < 0 or sum(fold_weights) <= 0:
+            raise CellmapsGenerateHierarchyError('Fold weights must be non-negative and '
+                                                 'sum to a value greater than 0')
+        total = float(sum(fold_weights))
+        return [float(w) / total for w in fold_weights]
+
+    @staticmethod
+    def _find_embedding_file(embeddingdir, embedding_file_name):
+        """
+        Looks for **embedding_file_name**, or a binary version of it,
+        in **embeddingdir**. Binary versions are preferred
+
+        :param embeddingdir:
+        :type embeddingdir: str
+        :param embedding_file_name: name of ``.tsv`` embedding file
+        :type embedding_file_name: str
+        :return: path to embedding file or ``None`` if not found
+        :rtype: str
+        """
+        prefix = os.path.join(embeddingdir, embedding_file_name)
+        if prefix.endswith(CosineSimilarityPPIGenerator.TSV_SUFFIX):
+            prefix = prefix[:-len(CosineSimilarityPPIGenerator.TSV_SUFFIX)]
+        for suffix in CosineSimilarityPPIGenerator.BINARY_EMBEDDING_SUFFIXES:
+            if os.path.exists(prefix + suffix):
+                return prefix + suffix
+        if os.path.exists(os.path.join(embeddingdir, embedding_file_name)):
+            return os.path.join(embeddingdir, embedding_file_name)
+        return None
+
+    @staticmethod
+    def _get_embedding_file(embeddingdir):
+        """
+        Gets path to embedding file in **embeddingdir** preferring
+        PPI embedding, then image embedding and finally coembedding
+
+        :param embeddingdir:
+        :type embeddingdir: str
+        :return: path to embedding file
+        :rtype: str
+        """
+        for embedding_file_name in [constants.PPI_EMBEDDING_FILE,
+                                    constants.IMAGE_EMBEDDING_FILE,
+                                    constants.CO_EMBEDDING_FILE]:
+            embeddingfile = CosineSimilarityPPIGenerator._find_embedding_file(embeddingdir,
+                                                                              embedding_file_name)
+            if embeddingfile is not None:
+                return embeddingfile
+        return os.path.join(embeddingdir, constants.CO_EMBEDDING_FILE)
+
+    @staticmethod
+    def _get_ids_file(embeddingfile):
+        """
+        Gets path to sidecar file with IDs for binary **embeddingfile**
+
+        :param embeddingfile:
+        :type embeddingfile: str
+        :return: path to IDs file
+        :rtype: str
+        """
+        return os.path.splitext(embeddingfile)[0] + CosineSimilarityPPIGenerator.IDS_SUFFIX
+
+    @staticmethod
+    def _read_ids_file(ids_file):
+        """
+        Reads IDs, one per line, from **ids_file**
+
+        :param ids_file:
+        :type ids_file: str
+        :raises CellmapsGenerateHierarchyError: If file does not exist
+        :return: IDs
+        :rtype: :py:class:`numpy.ndarray`
+        """
+        if not os.path.isfile(ids_file):
+            raise CellmapsGenerateHierarchyError('IDs file ' + str(ids_file) + ' not found')
+        with open(ids_file, 'r') as f:
+            return np.array([line.rstrip('\n') for line in f if len(line.rstrip('\n')) > 0],
+                            dtype=object)
+
+    @staticmethod
+    def _write_ids_file(ids_file, ids):
+        """
+        Writes **ids**, one per line, to **ids_file**
+
+        :param ids_file:
+        :type ids_file: str
+        :param ids:
+        :type ids: list
+        """
+        with open(ids_file, 'w') as f:
+            for cur_id in ids:
+                f.write(str(cur_id) + '\n')
+
+    @staticmethod
+    def _get_ids_and_values_from_dataframe(df):
         """
-        sim_mats = []
+        Gets IDs and embedding from **df**. IDs are taken from the
+        index unless it is a default range index in which case the
+        first column is used
+
+        :param df:
+        :type df: :py:class:`pandas.DataFrame`
+        :return: (IDs, embedding)
+        :rtype: tuple
+        """
+        if isinstance(df.index, pd.RangeIndex):
+            return df.iloc[:, 0].values.astype(object), df.iloc[:, 1:].values
+        return df.index.values.astype(object), df.values
+
+    def _get_embedding_cache_key(self, embeddingfile):
+        """
+        Gets key for cached binary copy of **embeddingfile**. The key is
+        derived from the absolute path, size and modification time of
+        **embeddingfile** so a changed file is converted again
+
+        :param embeddingfile:
+        :type embeddingfile: str
+        :return: key or ``None`` if no embedding cache was set
+        :rtype: str
+        """
+        if self._embedding_cache is None:
+            return None
+        stat = os.stat(embeddingfile)
+        return hashlib.sha256((os.path.abspath(embeddingfile) + '|' + str(stat.st_size) +
+                               '|' + str(stat.st_mtime_ns)).encode('utf-8')).hexdigest()
+
+    def _load_tsv_embedding(self, embeddingfile):
+        """
+        Loads ``.tsv`` embedding, converting it into a cached ``.npy``
+        copy, or memory mapping a previously cached copy, if an
+        embedding cache was set
+
+        :param embeddingfile:
+        :type embeddingfile: str
+        :return: (IDs, embedding)
+        :rtype: tuple
+        """
+        cache_key = self._get_embedding_cache_key(embeddingfile)
+        entry_dir = None if cache_key is None else self._embedding_cache.get(cache_key)
+        if entry_dir is not None:
+            cached_file = os.path.join(entry_dir, CosineSimilarityPPIGenerator.EMBEDDING_CACHE_FILE)
+            try:
+                ids = self._read_ids_file(self._get_ids_file(cached_file))
+                values = np.load(cached_file, mmap_mode='r')
+                logger.debug('Using cached binary copy of ' + str(embeddingfile) + ' found at ' + cached_file)
+                return ids, values
+            except (OSError, ValueError, CellmapsGenerateHierarchyError) as e:
+                logger.warning('Unable to read embedding cache entry ' + str(cache_key) + ' : ' + str(e))
+
+        z = pd.read_table(embeddingfile, sep='\t', index_col=0)
+        ids = z.index.values.astype(object)
+        values = z.values.astype(np.float32)
+        if cache_key is not None:
+            try:
+                # entry is written to a temporary directory so concurrent runs never see a partial copy
+                entry_dir = self._embedding_cache.get_new_entry_dir()
+                cached_file = os.path.join(entry_dir, CosineSimilarityPPIGenerator.EMBEDDING_CACHE_FILE)
+                np.save(cached_file, values)
+                self._write_ids_file(self._get_ids_file(cached_file), ids)
+                self._embedding_cache.put(cache_key, entry_dir)
+                logger.debug('Cached binary copy of ' + str(embeddingfile) + ' under key ' + cache_key)
+            except OSError as oe:
+                logger.warning('Unable to cache binary copy of ' + str(embeddingfile) + ' : ' + str(oe))
+        return ids, values
+
+    def _load_embedding(self, embeddingfile):
+        """
+        Loads embedding from **embeddingfile** which can be in ``.tsv``
+        or any of the :py:const:`BINARY_EMBEDDING_SUFFIXES` formats
+
+        :param embeddingfile:
+        :type embeddingfile: str
+        :raises CellmapsGenerateHierarchyError: If embedding could not be loaded
+        :return: (IDs as :py:class:`numpy.ndarray`,
+                  embedding as :py:class:`numpy.ndarray` one row per ID)
+        :rtype: tuple
+        """
+        suffix = os.path.splitext(embeddingfile)[1].lower()
+        if suffix == '.npy':
+            ids = self._read_ids_file(self._get_ids_file(embeddingfile))
+            values = np.load(embeddingfile, mmap_mode='r')
+        elif suffix == '.npz':
+            with np.load(embeddingfile, allow_pickle=False) as data:
+                if CosineSimilarityPPIGenerator.NPZ_EMBEDDING_KEY not in data:
+                    raise CellmapsGenerateHierarchyError(str(embeddingfile) + ' lacks ' +
+                                                         CosineSimilarityPPIGenerator.NPZ_EMBEDDING_KEY +
+                                                         ' array')
+                values = data[CosineSimilarityPPIGenerator.NPZ_EMBEDDING_KEY]
+                if CosineSimilarityPPIGenerator.NPZ_IDS_KEY in data:
+                    ids = data[CosineSimilarityPPIGenerator.NPZ_IDS_KEY].astype(str).astype(object)
+                else:
+                    ids = self._read_ids_file(self._get_ids_file(embeddingfile))
+        elif suffix in ('.parquet', '.h5'):
+            try:
+                if suffix == '.parquet':
+                    df = pd.read_parquet(embeddingfile)
+                else:
+                    df = pd.read_hdf(embeddingfile)
+            except ImportError as ie:
+                raise CellmapsGenerateHierarchyError('Unable to read ' + str(embeddingfile) +
+                                                     ', optional dependency missing: ' + str(ie))
+            ids, values = self._get_ids_and_values_from_dataframe(df)
+        else:
+            ids, values = self._load_tsv_embedding(embeddingfile)
+
+        if values.ndim != 2 or values.shape[0] != len(ids):
+            raise CellmapsGenerateHierarchyError('Embedding in ' + str(embeddingfile) + ' has shape ' +
+                                                 str(values.shape) + ' which does not match ' +
+                                                 str(len(ids)) + ' IDs')
+        return ids, values
+
+    @staticmethod
+    def _l2_normalize(embedding):
+        """
+        Scales each row of **embedding** to unit length. Rows
+        of all zeros are left as is
+
+        :param embedding:
+        :type embedding: :py:class:`numpy.ndarray`
+        :return: normalized embedding as ``float32``
+        :rtype: :py:class:`numpy.ndarray`
+        """
+        embedding = np.asarray(embedding, dtype=np.float32)
+        norms = np.linalg.norm(embedding, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return embedding / norms
+
+    def _get_embeddings(self):
+        """
+        Loads embedding for each fold, puts the rows in the same order
+        as the first fold and L2 normalizes them
+
+        :raises CellmapsGenerateHierarchyError: If the folds do not
+                                                contain the same proteins
+        :return: (protein names as :py:class:`numpy.ndarray`,
+                  list of normalized embeddings one per fold)
+        :rtype: tuple
+        """
+        embeddings = []
         index = []
 
         for fold, embeddingdir in enumerate(self._embeddingdirs):
-            embeddingfile = os.path.join(embeddingdir, constants.CO_EMBEDDING_FILE)
-            if os.path.exists(os.path.join(embeddingdir, constants.PPI_EMBEDDING_FILE)):
-                embeddingfile = os.path.join(embeddingdir, constants.PPI_EMBEDDING_FILE)
-            elif os.path.exists(os.path.join(embeddingdir, constants.IMAGE_EMBEDDING_FILE)):
-                embeddingfile = os.path.join(embeddingdir, constants.IMAGE_EMBEDDING_FILE)
-
-            z = pd.read_table(embeddingfile, sep='\t', index_col=0)
+            ids, values = self._load_embedding(self._get_embedding_file(embeddingdir))
 
             # give the same ordering
             if len(index) == 0:
-                index = z.index.values
-            else:
-                try:
-                    z = z.loc[index]
-                except KeyError:
+                index = ids
+            elif not np.array_equal(ids, index):
+                if not pd.Index(ids).is_unique:
+                    raise CellmapsGenerateHierarchyError('Duplicate protein IDs found in fold ' + str(fold + 1))
+                positions = pd.Index(ids).get_indexer(index)
+                if np.any(positions < 0):
                     index_set = set(index)
-                    fold_set = set(z.index.values)
+                    fold_set = set(ids)
                     missing_in_current_fold = index_set.difference(fold_set)
                     extra_in_current_fold = fold_set.difference(index_set)
                     error_message = (
@@ -90,45 +1325,869 @@ class CosineSimilarityPPIGenerator(PPINetworkGenerator):
                         f"Proteins present in fold {fold + 1} but absent in fold 1: {extra_in_current_fold}."
                     )
                     raise CellmapsGenerateHierarchyError(error_message)
+                values = values[positions]
+            embeddings.append(self._l2_normalize(values))
+        return index, embeddings
 
-            sim_mat = music_utils.cosine_similarity_scaled(z)
-            keep = np.triu(np.ones(sim_mat.shape)).astype(bool)
-            sim_mat = sim_mat.where(keep)
-            sim_mats.append(sim_mat)
+    def _get_pca_components(self, embedding):
+        """
+        Gets principal axes of **embedding**, without centering, from
+        the eigen decomposition of its dimension by dimension gram
+        matrix, which is accumulated block by block
 
-        # take mean across folds
-        sim_mat = pd.DataFrame(np.array(sim_mats).mean(axis=0), index=index, columns=index)
+        :param embedding: L2 normalized embedding
+        :type embedding: :py:class:`numpy.ndarray`
+        :return: (axes as columns sorted by variance in descending order,
+                  cumulative fraction of variance explained)
+        :rtype: tuple
+        """
+        gram = np.zeros((embedding.shape[1], embedding.shape[1]), dtype=np.float64)
+        for start, end in self._get_tile_bounds(embedding.shape[0]):
+            block = np.asarray(embedding[start:end], dtype=np.float64)
+            gram += block.T @ block
+        eigenvalues, eigenvectors = np.linalg.eigh(gram)
+        order = np.argsort(eigenvalues)[::-1]
+        eigenvalues = np.clip(eigenvalues[order], 0, None)
+        total = eigenvalues.sum()
+        if total == 0:
+            total = 1.0
+        return eigenvectors[:, order], np.cumsum(eigenvalues) / total
 
-        pairs = sim_mat.stack().reset_index().rename(columns={'level_0': constants.PPI_EDGELIST_GENEA_COL,
-                                                              'level_1': constants.PPI_EDGELIST_GENEB_COL,
-                                                              0: constants.WEIGHTED_PPI_EDGELIST_WEIGHT_COL})
+    def _reduce_embeddings(self, embeddings):
+        """
+        Projects each fold in **embeddings** to fewer dimensions and
+        L2 normalizes the result
 
-        pairs = pairs[pairs[constants.PPI_EDGELIST_GENEA_COL] != pairs[constants.PPI_EDGELIST_GENEB_COL]]
-        return pairs.sort_values(constants.WEIGHTED_PPI_EDGELIST_WEIGHT_COL, ascending=False)
+        :param embeddings: L2 normalized embeddings, one per fold
+        :type embeddings: list
+        :return: (reduced embeddings, list of dicts describing reduction of each fold)
+        :rtype: tuple
+        """
+        rng = np.random.default_rng(self._random_seed)
+        reduced = []
+        details = []
+        for embedding in embeddings:
+            num_dims = embedding.shape[1]
+            detail = {'original_dims': num_dims}
+            if self._reduction == CosineSimilarityPPIGenerator.PCA_REDUCTION:
+                axes, explained = self._get_pca_components(embedding)
+                if self._reduced_dims is not None:
+                    dims = min(self._reduced_dims, num_dims)
+                else:
+                    dims = min(num_dims, int(np.searchsorted(explained, self._explained_variance - 1e-9)) + 1)
+                projection = axes[:, :dims].astype(np.float32)
+                detail['explained_variance'] = float(explained[dims - 1])
+            else:
+                dims = self._reduced_dims
+                projection = (rng.standard_normal((num_dims, dims)) / math.sqrt(dims)).astype(np.float32)
+            detail['reduced_dims'] = dims
+            reduced_embedding = np.empty((embedding.shape[0], dims), dtype=np.float32)
+            for start, end in self._get_tile_bounds(embedding.shape[0]):
+                reduced_embedding[start:end] = embedding[start:end] @ projection
+            reduced.append(self._l2_normalize(reduced_embedding))
+            details.append(detail)
+            logger.info('Reduced embedding from ' + str(num_dims) + ' to ' + str(dims) +
+                        ' dimensions using ' + self._reduction)
+        return reduced, details
 
-    def get_next_network(self):
+    def _write_reduction_report(self, details, num_proteins, edges, exact_edges):
+        """
+        Writes JSON report to **reduction_report_file** comparing the
+        top **edges** found after reduction with **exact_edges**
+
+        :param details: description of reduction of each fold
+        :type details: list
+        :param num_proteins:
+        :type num_proteins: int
+        :param edges: sorted top edges found after reduction as (sources, targets, weights)
+        :type edges: tuple
+        :param exact_edges: sorted top edges found without reduction as (sources, targets, weights)
+        :type exact_edges: tuple
+        """
+        num_pairs = self._get_num_pairs(num_proteins)
+        keys = edges[0].astype(np.int64) * num_proteins + edges[1]
+        exact_keys = exact_edges[0].astype(np.int64) * num_proteins + exact_edges[1]
+        cutoffs = []
+        for cutoff in self._cutoffs:
+            num_edges = self._get_num_edges(cutoff, num_pairs)
+            shared = len(np.intersect1d(keys[:num_edges], exact_keys[:num_edges], assume_unique=True))
+            cutoffs.append({'cutoff': cutoff,
+                            'edges': num_edges,
+                            'shared_edges': shared,
+                            'overlap': shared / num_edges if num_edges > 0 else 1.0})
+        _, idx, exact_idx = np.intersect1d(keys, exact_keys, assume_unique=True, return_indices=True)
+        report = {'reduction': self._reduction,
+                  'random_seed': self._random_seed,
+                  'folds': details,
+                  'cutoffs': cutoffs,
+                  'max_weight_difference': float(np.abs(edges[2][idx] - exact_edges[2][exact_idx]).max())
+                  if len(idx) > 0 else 0.0}
+        with open(self._reduction_report_file, 'w') as f:
+            json.dump(report, f, indent=2)
+        logger.info('Wrote dimensionality reduction report to ' + str(self._reduction_report_file))
+
+    def _get_tile_bounds(self, num_rows):
+        """
+        Splits **num_rows** into ``(start, end)`` ranges of at most
+        tile size rows
+
+        :param num_rows:
+        :type num_rows: int
+        :return: list of ``(start, end)`` tuples
+        :rtype: list
+        """
+        return [(start, min(start + self._tile_size, num_rows))
+                for start in range(0, num_rows, self._tile_size)]
+
+    def _iter_upper_triangle_tiles(self, num_rows):
+        """
+        Generator of the ``(row start, row end, col start, col end)``
+        blocks covering the upper triangle, including the diagonal,
+        of a **num_rows** by **num_rows** matrix
+
+        :param num_rows:
+        :type num_rows: int
+        """
+        bounds = self._get_tile_bounds(num_rows)
+        for row_idx, (row_start, row_end) in enumerate(bounds):
+            for col_start, col_end in bounds[row_idx:]:
+                yield row_start, row_end, col_start, col_end
+
+    def _get_similarity_scaling(self, embedding):
+        """
+        Finds the minimum and maximum cosine similarity across
+        the full matrix for **embedding**, including the diagonal,
+        and returns the ``(multiplier, offset)`` that scales
+        similarities into ``[0, 1]`` matching
+        :py:func:`cellmaps_utils.music_utils.cosine_similarity_scaled`
+
+        :param embedding: L2 normalized embedding
+        :type embedding: :py:class:`numpy.ndarray`
+        :return: (multiplier, offset)
+        :rtype: tuple
+        """
+        min_sim = np.inf
+        max_sim = -np.inf
+        for row_start, row_end, col_start, col_end in self._iter_upper_triangle_tiles(embedding.shape[0]):
+            block = embedding[row_start:row_end] @ embedding[col_start:col_end].T
+            min_sim = min(min_sim, float(block.min()))
+            max_sim = max(max_sim, float(block.max()))
+        return self._get_scaling_from_range(min_sim, max_sim)
+
+    @staticmethod
+    def _get_scaling_from_range(min_sim, max_sim):
+        """
+        Gets ``(multiplier, offset)`` that scales similarities
+        in ``[min_sim, max_sim]`` into ``[0, 1]``
+
+        :param min_sim:
+        :type min_sim: float
+        :param max_sim:
+        :type max_sim: float
+        :return: (multiplier, offset)
+        :rtype: tuple
+        """
+        scale = max_sim - min_sim
+        if scale == 0:
+            scale = 1.0
+        return 1.0 / scale, -min_sim / scale
+
+    def _get_weighted_scalings(self, scalings):
+        """
+        Folds the weight of each fold into its ``(multiplier, offset)``
+
+        :param scalings: ``(multiplier, offset)`` for each fold
+        :type scalings: list
+        :return: weighted ``(multiplier, offset)`` as ``float32`` for each fold
+        :rtype: list
+        """
+        return [(np.float32(fold_weight * multiplier), np.float32(fold_weight * offset))
+                for (multiplier, offset), fold_weight in zip(scalings, self._fold_weights)]
+
+    @staticmethod
+    def _get_num_pairs(num_proteins):
+        """
+        Gets number of protein pairs excluding self pairs
+
+        :param num_proteins:
+        :type num_proteins: int
+        :return: number of pairs
+        :rtype: int
         """
-        Gets all the edges
+        return num_proteins * (num_proteins - 1) // 2
+
+    @staticmethod
+    def _get_num_proteins(num_pairs):
+        """
+        Gets number of proteins from number of pairs, the
+        inverse of :py:meth:`_get_num_pairs`
+
+        :param num_pairs:
+        :type num_pairs: int
+        :return: number of proteins
+        :rtype: int
+        """
+        return int(round((1.0 + math.sqrt(1.0 + 8.0 * num_pairs)) / 2.0))
+
+    def _get_edge_budget(self, num_pairs):
+        """
+        Gets number of edges for the network with the largest cutoff
+        when **edge_budget** or **avg_degree** is set
+
+        :param num_pairs: Number of protein pairs
+        :type num_pairs: int
+        :return: number of edges or ``None`` if neither is set
+        :rtype: int
+        """
+        if self._edge_budget is not None:
+            return self._edge_budget
+        if self._avg_degree is not None:
+            return math.ceil(self._avg_degree * self._get_num_proteins(num_pairs) / 2.0)
+        return None
+
+    def _get_num_edges(self, cutoff, num_pairs):
+        """
+        Gets number of edges in network for **cutoff**
 
         :param cutoff: Fraction of top edges to keep
-                       0.01 means 1% 0.5 means 50%
         :type cutoff: float
+        :param num_pairs: Number of protein pairs
+        :type num_pairs: int
+        :return: number of edges
+        :rtype: int
+        """
+        edge_budget = self._get_edge_budget(num_pairs)
+        if edge_budget is None:
+            return min(num_pairs, math.ceil(cutoff * num_pairs))
+        return min(num_pairs, math.ceil(edge_budget * cutoff / max(self._cutoffs)))
+
+    def _get_max_num_edges(self, num_pairs):
+        """
+        Gets number of edges needed to build the network with the
+        largest cutoff
+
+        :param num_pairs: Number of protein pairs
+        :type num_pairs: int
+        :return: number of edges
+        :rtype: int
+        """
+        return self._get_num_edges(max(self._cutoffs), num_pairs)
+
+    def _get_similarity_edges(self, embeddings, max_num_edges=None):
+        """
+        Computes the weighted mean, across folds, of the scaled cosine
+        similarity for every pair of proteins in the upper triangle,
+        excluding the diagonal, one block at a time. Folds are summed
+        into a single ``float32`` accumulator per block so memory does
+        not grow with the number of folds.
+
+        If **max_num_edges** is set, only the edges with the largest
+        weights are kept. The buffer is trimmed with a partial selection
+        whenever it grows past twice that size
+
+        :param embeddings: L2 normalized embeddings, one per fold
+        :type embeddings: list
+        :param max_num_edges: Number of top weighted edges to keep or
+                              ``None`` to keep them all
+        :type max_num_edges: int
+        :return: edges
+        :rtype: :py:class:`EdgeBuffer`
+        """
+        if self._workers > 1 and len(self._get_tile_bounds(embeddings[0].shape[0])) > 1:
+            return self._get_similarity_edges_in_parallel(embeddings, max_num_edges=max_num_edges)
+
+        scalings = self._get_weighted_scalings([self._get_similarity_scaling(embedding)
+                                                for embedding in embeddings])
+        edges = EdgeBuffer()
+        for row_start, row_end, col_start, col_end in self._iter_upper_triangle_tiles(embeddings[0].shape[0]):
+            edges.append(*_get_tile_edges(embeddings, scalings, row_start, row_end, col_start, col_end))
+            if max_num_edges is not None and len(edges) > 2 * max_num_edges:
+                edges = edges.get_top_edges(max_num_edges)
+        if max_num_edges is not None:
+            edges = edges.get_top_edges(max_num_edges)
+        return edges
+
+    def _get_similarity_edges_in_parallel(self, embeddings, max_num_edges=None):
+        """
+        Same as :py:meth:`_get_similarity_edges`, but each row stripe
+        of blocks is computed by a pool of **workers** processes. The
+        embeddings are copied once into shared memory that every
+        worker attaches to and workers hand their top edges back
+        through shared memory as well
+
+        :param embeddings: L2 normalized embeddings, one per fold
+        :type embeddings: list
+        :param max_num_edges: Number of top weighted edges to keep or
+                              ``None`` to keep them all
+        :type max_num_edges: int
+        :return: edges
+        :rtype: :py:class:`EdgeBuffer`
+        """
+        shape = (len(embeddings),) + embeddings[0].shape
+        shm = shared_memory.SharedMemory(create=True, size=max(1, int(np.prod(shape)) * 4))
+        try:
+            shared = np.ndarray(shape, dtype=np.float32, buffer=shm.buf)
+            for fold, embedding in enumerate(embeddings):
+                shared[fold] = embedding
+            del shared
+            bounds = self._get_tile_bounds(shape[1])
+            logger.debug('Computing similarities for ' + str(len(bounds)) +
+                         ' row stripes with ' + str(self._workers) + ' workers')
+            with ProcessPoolExecutor(max_workers=self._workers, initializer=_init_similarity_worker,
+                                     initargs=(shm.name, shape, self._tile_size)) as executor:
+                ranges = list(executor.map(_get_stripe_similarity_range, bounds))
+                scalings = self._get_weighted_scalings(
+                    [self._get_scaling_from_range(min([r[fold][0] for r in ranges]),
+                                                  max([r[fold][1] for r in ranges]))
+                     for fold in range(shape[0])])
+
+                edges = EdgeBuffer()
+                tasks = [(row_start, row_end, scalings, max_num_edges) for row_start, row_end in bounds]
+                for shm_name, num_edges in executor.map(_get_stripe_similarity_edges, tasks):
+                    if shm_name is None:
+                        continue
+                    edges.append(*_read_shared_edges(shm_name, num_edges))
+                    if max_num_edges is not None and len(edges) > 2 * max_num_edges:
+                        edges = edges.get_top_edges(max_num_edges)
+        finally:
+            shm.close()
+            shm.unlink()
+        if max_num_edges is not None:
+            edges = edges.get_top_edges(max_num_edges)
+        return edges
+
+    def _get_ppi_edge_table(self):
+        """
+        Gets the protein pairs with the highest mean scaled cosine
+        similarity, sorted by similarity in descending order. Only
+        the top fraction of pairs needed by the largest cutoff is
+        kept so the full set of pairs is never sorted
+
+        :return: (pairs as :py:class:`EdgeTable` with gene ids
+                  being the row of the protein in the embeddings,
+                  total number of protein pairs as :py:class:`int`)
+        :rtype: tuple
+        """
+        index, embeddings = self._get_embeddings()
+        num_pairs = self._get_num_pairs(len(index))
+        max_num_edges = self._get_max_num_edges(num_pairs)
+        if self._reduction is None:
+            sources, targets, weights = self._get_similarity_edges(embeddings,
+                                                                   max_num_edges=max_num_edges).get_sorted_edges()
+        else:
+            reduced, details = self._reduce_embeddings(embeddings)
+            sources, targets, weights = self._get_similarity_edges(reduced,
+                                                                   max_num_edges=max_num_edges).get_sorted_edges()
+            del reduced
+            if self._reduction_report_file is not None:
+                exact_edges = self._get_similarity_edges(embeddings,
+                                                         max_num_edges=max_num_edges).get_sorted_edges()
+                self._write_reduction_report(details, len(index), (sources, targets, weights), exact_edges)
+
+        return EdgeTable(GeneIndex(index), sources, targets, weights=weights), num_pairs
+
+    def _get_ppi_dataframe(self):
+        """
+        Same as :py:meth:`_get_ppi_edge_table` but with pairs as a
+        :py:class:`pandas.DataFrame` with
+        :py:const:`~cellmaps_utils.constants.PPI_EDGELIST_GENEA_COL`,
+        :py:const:`~cellmaps_utils.constants.PPI_EDGELIST_GENEB_COL` and
+        :py:const:`~cellmaps_utils.constants.WEIGHTED_PPI_EDGELIST_WEIGHT_COL`
+        columns
+
+        :return: (pairs as :py:class:`pandas.DataFrame`,
+                  total number of protein pairs as :py:class:`int`)
+        :rtype: tuple
+        """
+        edge_table, num_pairs = self._get_ppi_edge_table()
+        return edge_table.to_dataframe(), num_pairs
+
+    def _get_similarity_cache_key(self):
+        """
+        Gets key for similarity cache derived from the contents of the
+        embedding files, in fold order, the fold weights and the
+        dimensionality reduction settings
+
+        :return: key or ``None`` if no similarity cache was set or
+                 results are not reproducible
+        :rtype: str
+        """
+        if self._similarity_cache is None:
+            return None
+        if self._reduction == CosineSimilarityPPIGenerator.RANDOM_PROJECTION_REDUCTION and self._random_seed is None:
+            return None
+        if self._reduction_report_file is not None:
+            # a cache hit would skip writing the report
+            return None
+        digest = hashlib.sha256()
+        digest.update(('CosineSimilarityPPIGenerator|' +
+                       CosineSimilarityPPIGenerator.SIMILARITY_CACHE_VERSION + '|' +
+                       str(self._fold_weights)).encode('utf-8'))
+        if self._reduction is not None:
+            digest.update(('|' + '|'.join([str(x) for x in [self._reduction, self._reduced_dims,
+                                                            self._explained_variance,
+                                                            self._random_seed]])).encode('utf-8'))
+        for embeddingdir in self._embeddingdirs:
+            embeddingfile = self._get_embedding_file(embeddingdir)
+            digest.update(('|' + os.path.splitext(embeddingfile)[1] + '|').encode('utf-8'))
+            get_file_digest(embeddingfile, digest=digest)
+            if os.path.isfile(self._get_ids_file(embeddingfile)):
+                get_file_digest(self._get_ids_file(embeddingfile), digest=digest)
+        return digest.hexdigest()
+
+    def _get_ppi_edge_table_from_cache(self, cache_key):
+        """
+        Gets pairs previously stored in similarity cache under **cache_key**
+        as long as there are enough of them for the largest cutoff
+
+        :param cache_key:
+        :type cache_key: str
+        :return: (pairs as :py:class:`EdgeTable`, total number of pairs)
+                 or ``None`` if not found in cache
+        :rtype: tuple
+        """
+        if cache_key is None:
+            return None
+        entry_dir = self._similarity_cache.get(cache_key)
+        if entry_dir is None:
+            return None
+        try:
+            with np.load(os.path.join(entry_dir, CosineSimilarityPPIGenerator.SIMILARITY_CACHE_FILE),
+                         allow_pickle=False) as data:
+                num_pairs = int(data['num_pairs'])
+                if len(data['weights']) < self._get_max_num_edges(num_pairs):
+                    logger.debug('Cached similarities lack enough edges for largest cutoff')
+                    return None
+                edge_table = EdgeTable(GeneIndex(data['ids'].astype(object)), data['sources'],
+                                       data['targets'], weights=data['weights'])
+        except (OSError, KeyError, ValueError, CellmapsGenerateHierarchyError) as e:
+            logger.warning('Unable to read similarity cache entry ' + str(cache_key) + ' : ' + str(e))
+            return None
+        logger.info('Using cached similarities from ' + str(entry_dir))
+        return edge_table, num_pairs
+
+    def _add_ppi_edge_table_to_cache(self, cache_key, edge_table, num_pairs):
+        """
+        Stores **edge_table** in similarity cache under **cache_key**
+
+        :param cache_key:
+        :type cache_key: str
+        :param edge_table: Sorted pairs from :py:meth:`_get_ppi_edge_table`
+        :type edge_table: :py:class:`EdgeTable`
+        :param num_pairs: Total number of pairs
+        :type num_pairs: int
+        """
+        if cache_key is None:
+            return
+        try:
+            entry_dir = self._similarity_cache.get_new_entry_dir()
+            np.savez(os.path.join(entry_dir, CosineSimilarityPPIGenerator.SIMILARITY_CACHE_FILE),
+                     ids=np.asarray(edge_table.get_gene_index().get_names(), dtype=str),
+                     sources=edge_table.get_sources(),
+                     targets=edge_table.get_targets(),
+                     weights=edge_table.get_weights(),
+                     num_pairs=np.int64(num_pairs))
+            self._similarity_cache.put(cache_key, entry_dir)
+        except OSError as oe:
+            logger.warning('Unable to store similarities in cache: ' + str(oe))
+
+    def get_next_network(self):
+        """
+        Gets network for each cutoff
+
         :return: Network
         :rtype: :py:class:`ndex2.nice_cx_network.NiceCXNetwork`
         """
-        df = self._get_ppi_dataframe()
+        for network_edges in self.get_next_network_edges():
+            yield network_edges.get_network()
+
+    def get_next_network_edges(self):
+        """
+        Gets edges of network for each cutoff
+
+        :return: Network edges
+        :rtype: :py:class:`PPINetworkEdges`
+        """
+        cache_key = self._get_similarity_cache_key()
+        cached = self._get_ppi_edge_table_from_cache(cache_key)
+        if cached is None:
+            edge_table, num_pairs = self._get_ppi_edge_table()
+            self._add_ppi_edge_table_to_cache(cache_key, edge_table, num_pairs)
+        else:
+            edge_table, num_pairs = cached
         for cutoff in self._cutoffs:
-            df_cutoff = df.iloc[0:math.ceil(cutoff * len(df))]
-            net = ndex2.create_nice_cx_from_pandas(df_cutoff,
-                                                   source_field=constants.PPI_EDGELIST_GENEA_COL,
-                                                   target_field=constants.PPI_EDGELIST_GENEB_COL,
-                                                   edge_attr=[constants.WEIGHTED_PPI_EDGELIST_WEIGHT_COL])
-            net.set_name('parent interactome with ' + str(cutoff) + ' cutoff')
-            net.set_network_attribute(name='description',
-                                      values='Protein to Protein Interaction\n'
-                                             'network generated by cellmaps_generate_hierarchy\n'
-                                             'tool where top ' +
-                                             str(round(cutoff * 100.0)) +
-                                             '% of interactions sorted by weight\n')
-            net.set_network_attribute(name='cutoff', values=str(cutoff))
-            yield net
+            num_edges = self._get_num_edges(cutoff, num_pairs)
+            edges_cutoff = edge_table.head(num_edges)
+            if self._get_edge_budget(num_pairs) is None:
+                yield PPINetworkEdges(edges_cutoff, name='parent interactome with ' + str(cutoff) + ' cutoff',
+                                      description='Protein to Protein Interaction\n'
+                                                  'network generated by cellmaps_generate_hierarchy\n'
+                                                  'tool where top ' +
+                                                  str(round(cutoff * 100.0)) +
+                                                  '% of interactions sorted by weight\n',
+                                      attributes={'cutoff': str(cutoff)})
+                continue
+            yield PPINetworkEdges(edges_cutoff, name='parent interactome with ' + str(num_edges) + ' edges',
+                                  description='Protein to Protein Interaction\n'
+                                              'network generated by cellmaps_generate_hierarchy\n'
+                                              'tool where top ' + str(num_edges) +
+                                              ' interactions sorted by weight\n',
+                                  attributes={'cutoff': str(num_edges / num_pairs if num_pairs > 0 else 0.0),
+                                              'edge_budget': str(num_edges)})
+
+
+class KNNCosineSimilarityPPIGenerator(CosineSimilarityPPIGenerator):
+    """
+    Generates protein to protein interaction networks by connecting
+    each protein to its **k** most cosine similar proteins, where
+    similarity is the weighted mean, across folds, of the cosine
+    similarity. Unlike :py:class:`CosineSimilarityPPIGenerator`,
+    the cost grows with the number of proteins times **k** instead
+    of the number of proteins squared.
+
+    One network is generated for each value in **k_values**. Networks
+    are nested, the network for a smaller **k** is a subset of the
+    network for a larger **k**, and the ``cutoff`` network attribute
+    is set to the fraction of all protein pairs kept as edges.
+
+    Edge weights are the mean cosine similarity mapped from ``[-1, 1]``
+    to ``[0, 1]``
+
+    If **reduction** is set, each L2 normalized fold is first projected
+    to fewer dimensions as done by :py:class:`CosineSimilarityPPIGenerator`
+    """
+    K_VALUES = [5, 10, 15, 20, 30, 40, 50]
+
+    SYMMETRIC_MODE = 'symmetric'
+
+    MUTUAL_MODE = 'mutual'
+
+    MODES = [SYMMETRIC_MODE, MUTUAL_MODE]
+
+    EXACT_INDEX = 'exact'
+
+    RANDOM_PROJECTION_INDEX = 'random_projection'
+
+    INDEXES = [EXACT_INDEX, RANDOM_PROJECTION_INDEX]
+
+    NUM_TABLES = 8
+
+    def __init__(self, embeddingdirs=[],
+                 k_values=K_VALUES,
+                 mode=SYMMETRIC_MODE,
+                 index=EXACT_INDEX,
+                 tile_size=CosineSimilarityPPIGenerator.TILE_SIZE,
+                 fold_weights=None,
+                 embedding_cache=None,
+                 num_tables=NUM_TABLES,
+                 num_bits=None,
+                 random_seed=None,
+                 reduction=None,
+                 reduced_dims=None,
+                 explained_variance=None,
+                 reduction_seed=None):
+        """
+        Constructor
+
+        :param embeddingdirs: Directories containing embeddings, one per fold
+        :type embeddingdirs: list
+        :param k_values: Number of nearest neighbors of each protein to
+                         connect for each network generated
+        :type k_values: list
+        :param mode: :py:const:`SYMMETRIC_MODE` keeps an edge if either protein
+                     is among the nearest neighbors of the other, while
+                     :py:const:`MUTUAL_MODE` requires both
+        :type mode: str
+        :param index: :py:const:`EXACT_INDEX` compares every pair of proteins,
+                      block by block, while :py:const:`RANDOM_PROJECTION_INDEX`
+                      only compares proteins hashed to the same bucket, by
+                      random hyperplanes, in any of **num_tables** tables
+        :type index: str
+        :param tile_size: Number of proteins per side of each block of the
+                          similarity matrix computed at once
+        :type tile_size: int
+        :param fold_weights: Weight of each fold, in same order as **embeddingdirs**,
+                             when averaging similarities across folds. If ``None``
+                             every fold is weighted equally
+        :type fold_weights: list
+        :param embedding_cache: Cache where ``.tsv`` embeddings are stored,
+                                after conversion, as ``.npy`` files
+        :type embedding_cache: :py:class:`~cellmaps_generate_hierarchy.cache.FileCache`
+        :param num_tables: Number of hash tables for :py:const:`RANDOM_PROJECTION_INDEX`
+        :type num_tables: int
+        :param num_bits: Number of random hyperplanes per hash table. If ``None``
+                         a value giving buckets of a few hundred proteins is used
+        :type num_bits: int
+        :param random_seed: Seed for random hyperplanes
+        :type random_seed: int
+        :param reduction: Dimensionality reduction applied to each fold before
+                          finding neighbors, one of
+                          :py:const:`~CosineSimilarityPPIGenerator.REDUCTIONS`
+                          or ``None`` to use all dimensions
+        :type reduction: str
+        :param reduced_dims: Number of dimensions to reduce each fold to
+        :type reduced_dims: int
+        :param explained_variance: For :py:const:`~CosineSimilarityPPIGenerator.PCA_REDUCTION`,
+                                   fraction, in ``(0, 1]``, of variance that must be kept
+        :type explained_variance: float
+        :param reduction_seed: Seed for
+                               :py:const:`~CosineSimilarityPPIGenerator.RANDOM_PROJECTION_REDUCTION`
+        :type reduction_seed: int
+        """
+        super().__init__(embeddingdirs=embeddingdirs, cutoffs=[1.0], tile_size=tile_size,
+                         fold_weights=fold_weights, embedding_cache=embedding_cache,
+                         reduction=reduction, reduced_dims=reduced_dims,
+                         explained_variance=explained_variance, random_seed=reduction_seed)
+        if k_values is None or len(k_values) < 1 or min(k_values) < 1:
+            raise CellmapsGenerateHierarchyError('k_values must be a list of positive integers')
+        if mode not in KNNCosineSimilarityPPIGenerator.MODES:
+            raise CellmapsGenerateHierarchyError('Invalid mode: ' + str(mode) + ' must be one of ' +
+                                                 str(KNNCosineSimilarityPPIGenerator.MODES))
+        if index not in KNNCosineSimilarityPPIGenerator.INDEXES:
+            raise CellmapsGenerateHierarchyError('Invalid index: ' + str(index) + ' must be one of ' +
+                                                 str(KNNCosineSimilarityPPIGenerator.INDEXES))
+        if num_tables is None or num_tables < 1:
+            raise CellmapsGenerateHierarchyError('num_tables must be a positive integer')
+        self._k_values = [int(k) for k in k_values]
+        self._mode = mode
+        self._index = index
+        self._num_tables = int(num_tables)
+        self._num_bits = num_bits
+        self._index_seed = random_seed
+
+    def _get_combined_embedding(self, embeddings):
+        """
+        Concatenates L2 normalized **embeddings**, each scaled by the
+        square root of its fold weight, so the dot product of two rows
+        is the weighted mean cosine similarity across folds
+
+        :param embeddings: L2 normalized embeddings, one per fold
+        :type embeddings: list
+        :return: combined embedding
+        :rtype: :py:class:`numpy.ndarray`
+        """
+        if len(embeddings) == 1:
+            return embeddings[0]
+        return np.hstack([np.float32(math.sqrt(fold_weight)) * embedding
+                          for embedding, fold_weight in zip(embeddings, self._fold_weights)])
+
+    @staticmethod
+    def _get_block_top_neighbors(block, cols, k):
+        """
+        Gets the **k** columns with largest similarity in each row of **block**
+
+        :param block: similarities
+        :type block: :py:class:`numpy.ndarray`
+        :param cols: protein index of each column of **block**
+        :type cols: :py:class:`numpy.ndarray`
+        :param k:
+        :type k: int
+        :return: (neighbors, similarities) each with **k** or fewer columns
+        :rtype: tuple
+        """
+        if block.shape[1] > k:
+            idx = np.argpartition(-block, k - 1, axis=1)[:, :k]
+            return cols[idx], np.take_along_axis(block, idx, axis=1)
+        return np.broadcast_to(cols, block.shape), block
+
+    @staticmethod
+    def _merge_neighbors(neighbors, sims, rows, new_neighbors, new_sims):
+        """
+        Updates, in place, **neighbors** and **sims** for **rows** with
+        candidate **new_neighbors** keeping, for each row, those with
+        largest similarity. Neighbors found more than once are only
+        kept once
+
+        :param neighbors: neighbors of every protein, ``-1`` if unset
+        :type neighbors: :py:class:`numpy.ndarray`
+        :param sims: similarity of every neighbor, ``-inf`` if unset
+        :type sims: :py:class:`numpy.ndarray`
+        :param rows: rows being updated
+        :type rows: :py:class:`numpy.ndarray`
+        :param new_neighbors: candidate neighbors, one row per entry in **rows**
+        :type new_neighbors: :py:class:`numpy.ndarray`
+        :param new_sims: similarity of candidate neighbors
+        :type new_sims: :py:class:`numpy.ndarray`
+        """
+        all_neighbors = np.concatenate([neighbors[rows], new_neighbors], axis=1)
+        all_sims = np.concatenate([sims[rows], new_sims], axis=1)
+        order = np.argsort(all_neighbors, axis=1, kind='stable')
+        all_neighbors = np.take_along_axis(all_neighbors, order, axis=1)
+        all_sims = np.take_along_axis(all_sims, order, axis=1)
+        duplicate = np.zeros(all_neighbors.shape, dtype=bool)
+        duplicate[:, 1:] = all_neighbors[:, 1:] == all_neighbors[:, :-1]
+        all_sims[duplicate] = -np.inf
+        all_neighbors[duplicate] = -1
+
+        order = np.argsort(-all_sims, axis=1, kind='stable')[:, :neighbors.shape[1]]
+        neighbors[rows] = np.take_along_axis(all_neighbors, order, axis=1)
+        sims[rows] = np.take_along_axis(all_sims, order, axis=1)
+
+    def _update_neighbors(self, embedding, neighbors, sims, rows, cols):
+        """
+        Compares proteins in **rows** with proteins in **cols**, in blocks
+        of at most tile size rows, updating **neighbors** and **sims**
+
+        :param embedding: combined embedding
+        :type embedding: :py:class:`numpy.ndarray`
+        :param neighbors:
+        :type neighbors: :py:class:`numpy.ndarray`
+        :param sims:
+        :type sims: :py:class:`numpy.ndarray`
+        :param rows: protein indices
+        :type rows: :py:class:`numpy.ndarray`
+        :param cols: protein indices
+        :type cols: :py:class:`numpy.ndarray`
+        """
+        col_embedding = embedding[cols]
+        for start in range(0, len(rows), self._tile_size):
+            cur_rows = rows[start:start + self._tile_size]
+            block = embedding[cur_rows] @ col_embedding.T
+            # a protein is not its own neighbor
+            block[cur_rows[:, np.newaxis] == cols[np.newaxis, :]] = -np.inf
+            new_neighbors, new_sims = self._get_block_top_neighbors(block, cols, neighbors.shape[1])
+            self._merge_neighbors(neighbors, sims, cur_rows, new_neighbors, new_sims)
+
+    def _get_exact_neighbors(self, embedding, k):
+        """
+        Finds the **k** nearest neighbors of every protein comparing
+        all pairs of proteins block by block
+
+        :param embedding: combined embedding
+        :type embedding: :py:class:`numpy.ndarray`
+        :param k:
+        :type k: int
+        :return: (neighbors, similarities) sorted by similarity in descending order
+        :rtype: tuple
+        """
+        num_rows = embedding.shape[0]
+        neighbors = np.full((num_rows, k), -1, dtype=np.int64)
+        sims = np.full((num_rows, k), -np.inf, dtype=np.float32)
+        all_rows = np.arange(num_rows)
+        for row_start, row_end in self._get_tile_bounds(num_rows):
+            for col_start, col_end in self._get_tile_bounds(num_rows):
+                self._update_neighbors(embedding, neighbors, sims, all_rows[row_start:row_end],
+                                       all_rows[col_start:col_end])
+        return neighbors, sims
+
+    def _get_num_bits(self, num_rows, k):
+        """
+        Gets number of random hyperplanes per hash table
+
+        :param num_rows: number of proteins
+        :type num_rows: int
+        :param k:
+        :type k: int
+        :return:
+        :rtype: int
+        """
+        if self._num_bits is not None:
+            return int(self._num_bits)
+        target_bucket_size = max(256, 8 * k)
+        return int(min(62, max(1, round(math.log2(max(1.0, num_rows / target_bucket_size))))))
+
+    def _get_random_projection_neighbors(self, embedding, k):
+        """
+        Finds approximate **k** nearest neighbors of every protein by
+        hashing proteins with random hyperplanes and only comparing
+        proteins that share a bucket in at least one hash table
+
+        :param embedding: combined embedding
+        :type embedding: :py:class:`numpy.ndarray`
+        :param k:
+        :type k: int
+        :return: (neighbors, similarities) sorted by similarity in descending order
+        :rtype: tuple
+        """
+        num_rows = embedding.shape[0]
+        neighbors = np.full((num_rows, k), -1, dtype=np.int64)
+        sims = np.full((num_rows, k), -np.inf, dtype=np.float32)
+        num_bits = self._get_num_bits(num_rows, k)
+        rng = np.random.default_rng(self._index_seed)
+        bit_values = np.left_shift(np.int64(1), np.arange(num_bits, dtype=np.int64))
+        for table in range(self._num_tables):
+            planes = rng.standard_normal((embedding.shape[1], num_bits)).astype(np.float32)
+            codes = np.zeros(num_rows, dtype=np.int64)
+            for start in range(0, num_rows, self._tile_size):
+                end = min(start + self._tile_size, num_rows)
+                codes[start:end] = ((embedding[start:end] @ planes) > 0) @ bit_values
+            order = np.argsort(codes, kind='stable')
+            boundaries = np.flatnonzero(np.diff(codes[order])) + 1
+            for members in np.split(order, boundaries):
+                if len(members) > 1:
+                    self._update_neighbors(embedding, neighbors, sims, members, members)
+            logger.debug('Finished random projection table ' + str(table + 1) + ' of ' +
+                         str(self._num_tables) + ' with ' + str(len(boundaries) + 1) + ' buckets')
+        return neighbors, sims
+
+    def _get_neighbors(self, embedding):
+        """
+        Finds nearest neighbors of every protein for the largest **k**
+        using the configured index
+
+        :param embedding: combined embedding
+        :type embedding: :py:class:`numpy.ndarray`
+        :return: (neighbors, similarities) sorted by similarity in descending order
+        :rtype: tuple
+        """
+        k = min(max(self._k_values), max(1, embedding.shape[0] - 1))
+        if self._index == KNNCosineSimilarityPPIGenerator.RANDOM_PROJECTION_INDEX:
+            return self._get_random_projection_neighbors(embedding, k)
+        return self._get_exact_neighbors(embedding, k)
+
+    def _get_knn_edges(self, neighbors, sims, k):
+        """
+        Gets edges of nearest neighbor graph using the first **k**
+        neighbors of each protein
+
+        :param neighbors: neighbors sorted by similarity in descending order
+        :type neighbors: :py:class:`numpy.ndarray`
+        :param sims:
+        :type sims: :py:class:`numpy.ndarray`
+        :param k:
+        :type k: int
+        :return: edges
+        :rtype: :py:class:`EdgeBuffer`
+        """
+        num_rows = neighbors.shape[0]
+        cur_neighbors = neighbors[:, :k]
+        cur_sims = sims[:, :k]
+        valid = np.isfinite(cur_sims)
+        rows = np.broadcast_to(np.arange(num_rows)[:, np.newaxis], cur_neighbors.shape)[valid]
+        cols = cur_neighbors[valid]
+        weights = cur_sims[valid]
+        keys = np.minimum(rows, cols) * num_rows + np.maximum(rows, cols)
+        unique_keys, first, counts = np.unique(keys, return_index=True, return_counts=True)
+        if self._mode == KNNCosineSimilarityPPIGenerator.MUTUAL_MODE:
+            unique_keys = unique_keys[counts > 1]
+            first = first[counts > 1]
+        edges = EdgeBuffer()
+        edges.append(unique_keys // num_rows, unique_keys % num_rows,
+                     (np.float32(1.0) + weights[first]) / np.float32(2.0))
+        return edges
+
+    def get_next_network_edges(self):
+        """
+        Gets edges of nearest neighbor network for each value of **k**
+        in increasing order
+
+        :return: Network edges
+        :rtype: :py:class:`PPINetworkEdges`
+        """
+        index, embeddings = self._get_embeddings()
+        num_pairs = self._get_num_pairs(len(index))
+        if self._reduction is not None:
+            embeddings = self._reduce_embeddings(embeddings)[0]
+        neighbors, sims = self._get_neighbors(self._get_combined_embedding(embeddings))
+        del embeddings
+        gene_index = GeneIndex(index)
+        for k in sorted(self._k_values):
+            sources, targets, weights = self._get_knn_edges(neighbors, sims, k).get_sorted_edges()
+            edge_table = EdgeTable(gene_index, sources, targets, weights=weights)
+            cutoff = len(edge_table) / num_pairs if num_pairs > 0 else 0.0
+            yield PPINetworkEdges(edge_table, name='parent interactome with ' + str(k) + ' nearest neighbors',
+                                  description='Protein to Protein Interaction\n'
+                                              'network generated by cellmaps_generate_hierarchy\n'
+                                              'tool where each protein is connected to its ' + str(k) +
+                                              ' most similar proteins (' + self._mode + ')\n',
+                                  attributes={'cutoff': str(cutoff), 'k': str(k)})
@@ -9,6 +9,7 @@ import warnings
 from datetime import date
 
 import ndex2
+import numpy as np
 import pandas as pd
 from tqdm import tqdm
 from cellmaps_utils import constants
@@ -20,6 +21,7 @@ from cellmaps_utils.hidefconverter import HierarchyToHiDeFConverter
 from cellmaps_utils.ndexupload import NDExHierarchyUploader
 
 from cellmaps_generate_hierarchy.hcx import HCXFromCDAPSCXHierarchy
+from cellmaps_generate_hierarchy.ppi import EdgeStore
 
 logger = logging.getLogger(__name__)
 
@@ -32,6 +34,7 @@ class CellmapsGenerateHierarchy(object):
     K_DEFAULT = 10
     ALGORITHM = 'leiden'
     MAXRES = 80
+    PPI_EDGE_STORE_PREFIX = 'ppi_edges'
 
     def __init__(self, outdir=None,
                  inputdirs=[],
@@ -53,7 +56,8 @@ class CellmapsGenerateHierarchy(object):
                  ndexpassword=None,
                  visibility=None,
                  keep_intermediate_files=False,
-                 provenance=None
+                 provenance=None,
+                 ppi_edge_store=False
                  ):
         """
         Constructor
@@ -110,6 +114,10 @@ class CellmapsGenerateHierarchy(object):
                                     'project-name': 'Example'
                                 }
         :type provenance: dict or None
+        :param ppi_edge_store: If ``True``, edges of all PPI networks are written once to a
+                               compact :py:class:`~cellmaps_generate_hierarchy.ppi.EdgeStore`
+                               which is registered and used, memory mapped, for hierarchy generation
+        :type ppi_edge_store: bool
         """
         logger.debug('In constructor')
         if outdir is None:
@@ -141,6 +149,7 @@ class CellmapsGenerateHierarchy(object):
         self._visibility = visibility
         self.keep_intermediate_files = keep_intermediate_files
         self._provenance = provenance
+        self._ppi_edge_store = ppi_edge_store
 
         if self._input_data_dict is None:
             self._input_data_dict = {'outdir': self._outdir,
@@ -293,8 +302,9 @@ class CellmapsGenerateHierarchy(object):
         """
         Gets the path where the PPI network should be written to
 
-        :param ppi_network: PPI Network
-        :type ppi_network: :py:class:`ndex2.nice_cx_network.NiceCXNetwork`
+        :param ppi_network: PPI Network or its edges
+        :type ppi_network: :py:class:`ndex2.nice_cx_network.NiceCXNetwork` or
+                           :py:class:`~cellmaps_generate_hierarchy.ppi.PPINetworkEdges`
         :return: Path on filesystem to write the PPI network
         :rtype: str
         """
@@ -302,6 +312,17 @@ class CellmapsGenerateHierarchy(object):
         return os.path.join(self._outdir, constants.PPI_NETWORK_PREFIX +
                             '_cutoff_' + str(cutoff))
 
+    def get_ppi_edge_store_dest_file(self):
+        """
+        Creates file path prefix for PPI edge store
+
+        Example path: ``/tmp/foo/ppi_edges``
+
+        :return: Prefix path on filesystem to write PPI edge store
+        :rtype: str
+        """
+        return os.path.join(self._outdir, CellmapsGenerateHierarchy.PPI_EDGE_STORE_PREFIX)
+
     def get_hierarchy_dest_file(self):
         """
         Creates file path prefix for hierarchy
@@ -366,6 +387,51 @@ class CellmapsGenerateHierarchy(object):
                                                        source_file=dest_path,
                                                        data_dict=data_dict)
 
+    def _add_resource_usage_to_task_finish_json(self):
+        """
+        Adds resources used by external commands run by the
+        hierarchy generator, such as HiDeF, under ``resource_usage``
+        key of task finish json file written for this run
+        """
+        get_resource_usage = getattr(self._hiergen, 'get_resource_usage', None)
+        if get_resource_usage is None or len(get_resource_usage()) == 0:
+            return
+        task_file = os.path.join(self._outdir, constants.TASK_FILE_PREFIX + str(self._start_time) +
+                                 constants.TASK_FINISH_FILE_SUFFIX)
+        if not os.path.isfile(task_file):
+            return
+        with open(task_file, 'r') as f:
+            task = json.load(f)
+        task['resource_usage'] = get_resource_usage()
+        with open(task_file, 'w') as f:
+            json.dump(task, f, indent=2)
+
+    def _register_ppi_edge_store(self, edge_store):
+        """
+        Registers files of PPI edge store with FAIRSCAPE
+
+        :param edge_store:
+        :type edge_store: :py:class:`~cellmaps_generate_hierarchy.ppi.EdgeStore`
+        :return: dataset ids
+        :rtype: list
+        """
+        keywords = self._get_keywords_extended_with_new_values(new_values=['file'])
+        dataset_ids = []
+        edges_file, index_file = edge_store.get_files()
+        for dest_path, file_desc, data_format in [(edges_file, 'PPI edge store edges file', 'npy'),
+                                                  (index_file, 'PPI edge store index file', 'json')]:
+            data_dict = {'name': os.path.basename(dest_path) + ' ' + file_desc,
+                         'description': self._description + ' ' + file_desc,
+                         'keywords': keywords,
+                         'data-format': data_format,
+                         'author': cellmaps_generate_hierarchy.__name__,
+                         'version': cellmaps_generate_hierarchy.__version__,
+                         'date-published': date.today().strftime(self._provenance_utils.get_default_date_format_str())}
+            dataset_ids.append(self._provenance_utils.register_dataset(self._outdir,
+                                                                       source_file=dest_path,
+                                                                       data_dict=data_dict))
+        return dataset_ids
+
     def _write_hierarchy_network(self, hierarchy=None):
         """
         Writes **hierarchy** to file
@@ -470,18 +536,40 @@ class CellmapsGenerateHierarchy(object):
                                                        source_file=hidef_output_path,
                                                        data_dict=data_dict)
 
-    def _add_gene_node_attributes(self, parent_ppi):
+    @staticmethod
+    def _get_shared_gene_index(network_edges):
+        """
+        Gets gene index shared by all of **network_edges**
+
+        :param network_edges:
+        :type network_edges: list
+        :return: gene index or ``None`` if there are no networks
+                 or they do not share the same gene index
+        :rtype: :py:class:`~cellmaps_generate_hierarchy.ppi.GeneIndex`
+        """
+        if len(network_edges) == 0:
+            return None
+        gene_index = network_edges[0].get_edge_table().get_gene_index()
+        if any(e.get_edge_table().get_gene_index() is not gene_index for e in network_edges):
+            return None
+        return gene_index
+
+    def _add_gene_node_attributes(self, parent_ppi, gene_index=None):
         """
         Adds gene node attributes to the parent PPI network from provided TSV files or found in ro-crates.
 
         :param parent_ppi: The PPI network to which the attributes will be added.
         :type parent_ppi: :py:class:`ndex2.cx2.CX2Network`
+        :param gene_index: Gene index whose ids are the node ids of **parent_ppi**. If ``None``
+                           genes are looked up by node name
+        :type gene_index: :py:class:`~cellmaps_generate_hierarchy.ppi.GeneIndex`
         :return: The parent PPI network object with the new attributes added.
         :rtype: :py:class:`ndex2.cx2.CX2Network`
         """
-        node_name_dict = {}
-        for node_id, node_obj in parent_ppi.get_nodes().items():
-            node_name_dict[node_obj['v']['name']] = node_id
+        node_ids = np.fromiter(parent_ppi.get_nodes().keys(), dtype=np.int64)
+        node_names = None
+        if gene_index is None:
+            node_names = pd.Index([node_obj['v']['name'] for node_obj in parent_ppi.get_nodes().values()])
 
         for entry_path in self._gene_node_attributes:
             attr_files = list()
@@ -504,12 +592,16 @@ class CellmapsGenerateHierarchy(object):
 
             for attribute_file in attr_files:
                 df = pd.read_csv(attribute_file, sep='\t', header=0)
+                if gene_index is None:
+                    positions = node_names.get_indexer(df.iloc[:, 0].values)
+                    row_node_ids = np.where(positions >= 0, node_ids[positions], -1)
+                else:
+                    row_node_ids = gene_index.get_ids(df.iloc[:, 0].values).astype(np.int64)
+                    row_node_ids[~np.isin(row_node_ids, node_ids)] = -1
 
-                for _, row in df.iterrows():
-                    gene_name = row.iloc[0]
-                    node_id = node_name_dict.get(gene_name, None)
-                    if node_id is None:
-                        continue
+                for row_idx in np.flatnonzero(row_node_ids >= 0):
+                    row = df.iloc[row_idx]
+                    node_id = int(row_node_ids[row_idx])
 
                     for column_name in df.columns[1:]:
                         if not pd.isna(row[column_name]):
@@ -611,24 +703,35 @@ class CellmapsGenerateHierarchy(object):
 
             generated_dataset_ids = []
             ppi_network_prefix_paths = []
-            # generate PPI networks
-            for ppi_network in tqdm(self._ppigen.get_next_network(), desc='Generating hierarchy'):
-                dest_prefix = self.get_ppi_network_dest_file(ppi_network)
+            ppi_network_edges = []
+            # generate PPI networks, keeping just their edges in memory. CX files
+            # are only written if intermediate files are to be kept
+            for ppi_edges in tqdm(self._ppigen.get_next_network_edges(), desc='Generating hierarchy'):
+                dest_prefix = self.get_ppi_network_dest_file(ppi_edges)
                 ppi_network_prefix_paths.append(dest_prefix)
-                cx_path = dest_prefix + constants.CX_SUFFIX
-                self._write_ppi_network_as_cx(ppi_network, dest_path=cx_path)
+                ppi_network_edges.append(ppi_edges)
                 if self.keep_intermediate_files:
+                    ppi_network = ppi_edges.get_network()
+                    cx_path = dest_prefix + constants.CX_SUFFIX
+                    self._write_ppi_network_as_cx(ppi_network, dest_path=cx_path)
                     generated_dataset_ids.append(self._register_ppi_network(ppi_network, dest_path=cx_path))
 
+            # gene index shared by all networks, whose ids become node ids of the parent network
+            gene_index = self._get_shared_gene_index(ppi_network_edges)
+            if self._ppi_edge_store and len(ppi_network_edges) > 0:
+                # write edges once and read them back memory mapped
+                edge_store = EdgeStore.create(self.get_ppi_edge_store_dest_file(), ppi_network_edges)
+                generated_dataset_ids.extend(self._register_ppi_edge_store(edge_store))
+                ppi_network_edges = edge_store.get_all_network_edges()
+                gene_index = edge_store.get_gene_index()
+
             # generate hierarchy and get parent ppi
             hierarchy, parent_ppi = self._hiergen.get_hierarchy(ppi_network_prefix_paths, self._algorithm, self._maxres,
-                                                                self._k)
-
-            if not self.keep_intermediate_files:
-                self._remove_ppi_networks(ppi_network_prefix_paths)
+                                                                self._k, network_edges=ppi_network_edges)
+            del ppi_network_edges
 
             if self._gene_node_attributes is not None:
-                parent_ppi = self._add_gene_node_attributes(parent_ppi)
+                parent_ppi = self._add_gene_node_attributes(parent_ppi, gene_index=gene_index)
                 if "bait" in parent_ppi.get_attribute_declarations()['nodes']:
                     parent_ppi = HCXFromCDAPSCXHierarchy.apply_style_to_network(parent_ppi,
                                                                                 'interactome_style_with_bait.cx2')
@@ -685,5 +788,6 @@ class CellmapsGenerateHierarchy(object):
             logutils.write_task_finish_json(outdir=self._outdir,
                                             start_time=self._start_time,
                                             status=exitcode)
+            self._add_resource_usage_to_task_finish_json()
 
         return exitcode
@@ -0,0 +1,271 @@
+import os
+import csv
+import shutil
+import logging
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+from cellmaps_utils import constants
+from cellmaps_utils import logutils
+
+from cellmaps_generate_hierarchy.exceptions import CellmapsGenerateHierarchyError
+from cellmaps_generate_hierarchy.hierarchy import CDAPSHiDeFHierarchyGenerator
+from cellmaps_generate_hierarchy.maturehierarchy import HiDeFHierarchyRefiner
+from cellmaps_generate_hierarchy.runner import CellmapsGenerateHierarchy
+
+logger = logging.getLogger(__name__)
+
+
+class HierarchyParameterSweep(object):
+    """
+    Generates hierarchies for every combination of a grid of HiDeF
+    and refiner parameters. PPI networks and their edge lists are
+    created once and shared by all HiDeF runs, which are fanned out
+    across a pool of workers. Each refiner variant is then run on the
+    HiDeF output it needs, so HiDeF is run once per combination of
+    HiDeF parameters regardless of the number of refiner variants
+    """
+
+    EDGELIST_DIR = 'edgelists'
+
+    HIDEF_DIR_PREFIX = 'hidef_'
+
+    SWEEP_DIR_PREFIX = 'sweep_'
+
+    SUMMARY_FILE = 'sweep_summary.tsv'
+
+    def __init__(self, outdir=None,
+                 ppigen=None,
+                 hiergen=None,
+                 algorithms=None,
+                 maxres_values=None,
+                 k_values=None,
+                 containment_thresholds=None,
+                 jaccard_thresholds=None,
+                 min_term_size=HiDeFHierarchyRefiner.MIN_SYSTEM_SIZE,
+                 min_diff=HiDeFHierarchyRefiner.MIN_DIFF,
+                 workers=1,
+                 skip_logging=True):
+        """
+        Constructor
+
+        :param outdir: Directory to create and write results to
+        :type outdir: str
+        :param ppigen: PPI network generator
+        :type ppigen: :py:class:`~cellmaps_generate_hierarchy.ppi.CosineSimilarityPPIGenerator`
+        :param hiergen: Hierarchy generator used to write edge lists and run HiDeF
+        :type hiergen: :py:class:`~cellmaps_generate_hierarchy.hierarchy.CDAPSHiDeFHierarchyGenerator`
+        :param algorithms: HiDeF clustering algorithms, if ``None`` only
+                           :py:const:`~cellmaps_generate_hierarchy.runner.CellmapsGenerateHierarchy.ALGORITHM`
+                           is used
+        :type algorithms: list
+        :param maxres_values: HiDeF max resolutions, if ``None`` only
+                              :py:const:`~cellmaps_generate_hierarchy.runner.CellmapsGenerateHierarchy.MAXRES`
+                              is used
+        :type maxres_values: list
+        :param k_values: HiDeF stability parameters, if ``None`` only
+                         :py:const:`~cellmaps_generate_hierarchy.runner.CellmapsGenerateHierarchy.K_DEFAULT`
+                         is used
+        :type k_values: list
+        :param containment_thresholds: Refiner containment index thresholds
+        :type containment_thresholds: list
+        :param jaccard_thresholds: Refiner Jaccard index thresholds
+        :type jaccard_thresholds: list
+        :param min_term_size: Minimum number of proteins a term must have
+        :type min_term_size: int
+        :param min_diff: Minimum difference in number of proteins for every parent-child pair
+        :type min_diff: int
+        :param workers: Number of HiDeF runs, and refiner variants, to run at once
+        :type workers: int
+        :param skip_logging: If ``False`` output.log and error.log files are written to **outdir**
+        :type skip_logging: bool
+        """
+        if outdir is None:
+            raise CellmapsGenerateHierarchyError('outdir is None')
+        self._outdir = os.path.abspath(outdir)
+        self._ppigen = ppigen
+        self._hiergen = hiergen
+        self._algorithms = algorithms or [CellmapsGenerateHierarchy.ALGORITHM]
+        self._maxres_values = maxres_values or [CellmapsGenerateHierarchy.MAXRES]
+        self._k_values = k_values or [CellmapsGenerateHierarchy.K_DEFAULT]
+        self._containment_thresholds = containment_thresholds or [HiDeFHierarchyRefiner.CONTAINMENT_THRESHOLD]
+        self._jaccard_thresholds = jaccard_thresholds or [HiDeFHierarchyRefiner.JACCARD_THRESHOLD]
+        self._min_term_size = min_term_size
+        self._min_diff = min_diff
+        self._workers = max(1, workers)
+        self._skip_logging = skip_logging
+
+    def get_hidef_parameters(self):
+        """
+        Gets every combination of HiDeF parameters
+
+        :return: (algorithm, maxres, k) tuples
+        :rtype: list
+        """
+        return list(itertools.product(self._algorithms, self._maxres_values, self._k_values))
+
+    def get_refiner_parameters(self):
+        """
+        Gets every combination of refiner parameters
+
+        :return: (containment threshold, jaccard threshold) tuples
+        :rtype: list
+        """
+        return list(itertools.product(self._containment_thresholds, self._jaccard_thresholds))
+
+    def _create_edgelist_files(self):
+        """
+        Generates PPI networks and writes their edge lists
+        to :py:const:`EDGELIST_DIR` directory
+
+        :return: (edge list paths as :py:class:`list`,
+                  node id => gene name :py:class:`dict`)
+        :rtype: tuple
+        """
+        edgelist_dir = os.path.join(self._outdir, HierarchyParameterSweep.EDGELIST_DIR)
+        os.makedirs(edgelist_dir, exist_ok=True)
+        networks = []
+        network_edges = []
+        for ppi_edges in self._ppigen.get_next_network_edges():
+            cutoff = ppi_edges.get_network_attribute('cutoff')['v']
+            networks.append(os.path.join(edgelist_dir, constants.PPI_NETWORK_PREFIX + '_cutoff_' + str(cutoff)))
+            network_edges.append(ppi_edges)
+        if len(networks) == 0:
+            raise CellmapsGenerateHierarchyError('No PPI networks generated')
+        _, _, largest_net, edgelist_files = self._hiergen._create_edgelist_files_for_networks(
+            networks, network_edges=network_edges, edgelist_dir=edgelist_dir)
+        return edgelist_files, self._hiergen._get_id_to_name_dict(largest_net)
+
+    def _run_hidef(self, edgelist_files, hidef_dir, algorithm, maxres, k):
+        """
+        Runs HiDeF on **edgelist_files** writing output to **hidef_dir**
+
+        :return: HiDeF output prefix
+        :rtype: str
+        """
+        os.makedirs(hidef_dir, exist_ok=True)
+        outputprefix = os.path.join(hidef_dir, CDAPSHiDeFHierarchyGenerator.HIDEF_OUT_PREFIX)
+        logger.info('Running HiDeF with algorithm ' + str(algorithm) + ', maxres ' +
+                    str(maxres) + ' and k ' + str(k))
+        self._hiergen._run_hidef(edgelist_files, outputprefix, algorithm, maxres, k, cwd=hidef_dir)
+        return outputprefix
+
+    def _refine(self, hidef_prefix, sweep_dir, containment_threshold, jaccard_threshold):
+        """
+        Copies HiDeF output with **hidef_prefix** prefix to **sweep_dir**
+        and refines it there
+
+        :return: refined HiDeF output prefix
+        :rtype: str
+        """
+        os.makedirs(sweep_dir, exist_ok=True)
+        outputprefix = os.path.join(sweep_dir, CDAPSHiDeFHierarchyGenerator.HIDEF_OUT_PREFIX)
+        for suffix in [HiDeFHierarchyRefiner.NODES_SUFFIX, HiDeFHierarchyRefiner.EDGES_SUFFIX]:
+            shutil.copyfile(hidef_prefix + suffix, outputprefix + suffix)
+        refiner = HiDeFHierarchyRefiner(ci_thre=containment_threshold,
+                                        ji_thre=jaccard_threshold,
+                                        min_term_size=self._min_term_size,
+                                        min_diff=self._min_diff)
+        refiner.refine_hierarchy(outprefix=outputprefix)
+        return outputprefix
+
+    @staticmethod
+    def _get_term_sizes(nodes_file):
+        """
+        Gets number of genes in each term of HiDeF nodes file
+
+        :param nodes_file:
+        :type nodes_file: str
+        :return:
+        :rtype: list
+        """
+        with open(nodes_file, 'r') as csvfile:
+            return [int(row[1]) for row in csv.reader(csvfile, delimiter='\t') if len(row) > 1]
+
+    @staticmethod
+    def _write_gene_names_nodes_file(nodes_file, dest_path, id_to_name):
+        """
+        Writes copy of HiDeF **nodes_file** to **dest_path** with
+        node ids of members replaced by gene names
+
+        :param id_to_name: node id => gene name
+        :type id_to_name: dict
+        """
+        with open(nodes_file, 'r') as csvfile, open(dest_path, 'w', newline='') as out_stream:
+            writer = csv.writer(out_stream, delimiter='\t', lineterminator='\n')
+            for row in csv.reader(csvfile, delimiter='\t'):
+                row[2] = ' '.join([str(id_to_name.get(int(node), node)) for node in row[2].split()])
+                writer.writerow(row)
+
+    def run(self):
+        """
+        Generates PPI networks and edge lists, runs HiDeF for each combination
+        of HiDeF parameters into a ``hidef_<N>`` directory and refines each
+        HiDeF output for each combination of refiner parameters into a
+        ``sweep_<N>`` directory, which gets the refined HiDeF ``.pruned.nodes``
+        and ``.pruned.edges`` files along with a copy of the ``.pruned.nodes``
+        file with gene names. A row per ``sweep_<N>`` directory, with its
+        parameters and number of terms, is written to :py:const:`SUMMARY_FILE`
+
+        :raises CellmapsGenerateHierarchyError: If **outdir** already exists
+        :return: ``0`` upon success
+        :rtype: int
+        """
+        if os.path.isdir(self._outdir):
+            raise CellmapsGenerateHierarchyError(self._outdir + ' already exists')
+        os.makedirs(self._outdir, mode=0o755)
+        if self._skip_logging is False:
+            logutils.setup_filelogger(outdir=self._outdir,
+                                      handlerprefix='cellmaps_generate_hierarchy')
+
+        edgelist_files, id_to_name = self._create_edgelist_files()
+
+        hidef_params = self.get_hidef_parameters()
+        refiner_params = self.get_refiner_parameters()
+        logger.info('Running ' + str(len(hidef_params)) + ' HiDeF parameter combinations each with ' +
+                    str(len(refiner_params)) + ' refiner parameter combinations')
+
+        # HiDeF run in process shares this process so runs are done one at a time
+        max_workers = 1 if self._hiergen._hidef_in_process else self._workers
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            hidef_futures = []
+            for idx, (algorithm, maxres, k) in enumerate(hidef_params):
+                hidef_dir = os.path.join(self._outdir, HierarchyParameterSweep.HIDEF_DIR_PREFIX + str(idx))
+                hidef_futures.append(executor.submit(self._run_hidef, edgelist_files, hidef_dir,
+                                                     algorithm, maxres, k))
+            refine_futures = []
+            for hidef_idx, hidef_future in enumerate(hidef_futures):
+                hidef_prefix = hidef_future.result()
+                for containment_threshold, jaccard_threshold in refiner_params:
+                    sweep_dir = os.path.join(self._outdir, HierarchyParameterSweep.SWEEP_DIR_PREFIX +
+                                             str(len(refine_futures)))
+                    refine_futures.append((hidef_idx, sweep_dir, containment_threshold, jaccard_threshold,
+                                           executor.submit(self._refine, hidef_prefix, sweep_dir,
+                                                           containment_threshold, jaccard_threshold)))
+
+            rows = []
+            for hidef_idx, sweep_dir, containment_threshold, jaccard_threshold, future in refine_futures:
+                outputprefix = future.result()
+                names_prefix = os.path.join(sweep_dir, CDAPSHiDeFHierarchyGenerator.TRANSLATED_HIDEF_OUT_PREFIX)
+                self._write_gene_names_nodes_file(outputprefix + '.pruned.nodes', names_prefix + '.pruned.nodes',
+                                                  id_to_name)
+                algorithm, maxres, k = hidef_params[hidef_idx]
+                hidef_sizes = self._get_term_sizes(hidef_futures[hidef_idx].result() +
+                                                   HiDeFHierarchyRefiner.NODES_SUFFIX)
+                sizes = self._get_term_sizes(outputprefix + '.pruned.nodes')
+                rows.append({'sweep_dir': os.path.basename(sweep_dir),
+                             'hidef_dir': HierarchyParameterSweep.HIDEF_DIR_PREFIX + str(hidef_idx),
+                             'algorithm': algorithm,
+                             'maxres': maxres,
+                             'k': k,
+                             'containment_threshold': containment_threshold,
+                             'jaccard_threshold': jaccard_threshold,
+                             'hidef_terms': len(hidef_sizes),
+                             'terms': len(sizes),
+                             'mean_term_size': sum(sizes) / len(sizes) if len(sizes) > 0 else 0.0,
+                             'max_term_size': max(sizes, default=0)})
+
+        pd.DataFrame(rows).to_csv(os.path.join(self._outdir, HierarchyParameterSweep.SUMMARY_FILE),
+                                  sep='\t', index=False)
+        return 0
@@ -0,0 +1,297 @@
+import csv
+import logging
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from cellmaps_generate_hierarchy.exceptions import CellmapsGenerateHierarchyError
+
+logger = logging.getLogger(__name__)
+
+
+class TermIncidence(object):
+    """
+    Terms of a hierarchy as a sparse term by gene incidence matrix,
+    with ``1`` where a gene is a member of a term
+    """
+
+    def __init__(self, term_names, matrix, gene_names):
+        """
+        Constructor
+
+        :param term_names: Name of each term, one per row of **matrix**
+        :type term_names: list
+        :param matrix: Term by gene incidence matrix
+        :type matrix: :py:class:`scipy.sparse.csr_matrix`
+        :param gene_names: Name of each gene, one per column of **matrix**
+        :type gene_names: list
+        """
+        if matrix.shape != (len(term_names), len(gene_names)):
+            raise CellmapsGenerateHierarchyError('Shape of matrix ' + str(matrix.shape) +
+                                                 ' does not match ' + str(len(term_names)) + ' terms and ' +
+                                                 str(len(gene_names)) + ' genes')
+        self._term_names = list(term_names)
+        self._matrix = matrix.tocsr()
+        self._gene_names = list(gene_names)
+        self._term_sizes = None
+
+    def get_term_names(self):
+        """
+        Gets names of terms
+
+        :return:
+        :rtype: list
+        """
+        return self._term_names
+
+    def get_gene_names(self):
+        """
+        Gets names of genes
+
+        :return:
+        :rtype: list
+        """
+        return self._gene_names
+
+    def get_matrix(self):
+        """
+        Gets term by gene incidence matrix
+
+        :return:
+        :rtype: :py:class:`scipy.sparse.csr_matrix`
+        """
+        return self._matrix
+
+    def get_num_terms(self):
+        """
+        Gets number of terms
+
+        :return:
+        :rtype: int
+        """
+        return len(self._term_names)
+
+    def get_term_sizes(self):
+        """
+        Gets number of genes in each term
+
+        :return:
+        :rtype: :py:class:`numpy.ndarray`
+        """
+        if self._term_sizes is None:
+            self._term_sizes = np.diff(self._matrix.indptr).astype(np.int64)
+        return self._term_sizes
+
+    @staticmethod
+    def read_nodes_file(nodes_file):
+        """
+        Reads terms from HiDeF nodes file in this tab delimited format:
+
+        <CLUSTER NAME> <# NODES> <SPACE DELIMITED NODE IDS> <SCORE>
+
+        :param nodes_file:
+        :type nodes_file: str
+        :return: (term names as :py:class:`list`,
+                  members of each term as :py:class:`list` of :py:class:`list`)
+        :rtype: tuple
+        """
+        names = []
+        members = []
+        with open(nodes_file, 'r') as csvfile:
+            linereader = csv.reader(csvfile, delimiter='\t')
+            for row in linereader:
+                if len(row) < 3:
+                    continue
+                names.append(row[0])
+                members.append(row[2].split())
+        return names, members
+
+    @staticmethod
+    def from_nodes_files(nodes_files):
+        """
+        Creates a :py:class:`TermIncidence` for each HiDeF nodes file in
+        **nodes_files**, all with the same gene columns, so
+        they can be compared with :py:class:`TermOverlap`
+
+        :param nodes_files: Paths to HiDeF nodes files
+        :type nodes_files: list
+        :return: :py:class:`TermIncidence` for each file in **nodes_files**
+        :rtype: list
+        """
+        terms = [TermIncidence.read_nodes_file(f) for f in nodes_files]
+        all_members = [m for _, members in terms for term_members in members for m in term_members]
+        codes, gene_names = pd.factorize(np.array(all_members, dtype=object))
+        gene_names = gene_names.tolist()
+        incidences = []
+        offset = 0
+        for names, members in terms:
+            indptr = np.zeros(len(members) + 1, dtype=np.int64)
+            indptr[1:] = np.cumsum([len(m) for m in members])
+            indices = codes[offset:offset + indptr[-1]]
+            offset += indptr[-1]
+            matrix = sparse.csr_matrix((np.ones(len(indices), dtype=np.int32), indices, indptr),
+                                       shape=(len(names), len(gene_names)))
+            # a gene listed twice in a term counts once
+            matrix.sum_duplicates()
+            matrix.data[:] = 1
+            incidences.append(TermIncidence(names, matrix, gene_names))
+        return incidences
+
+
+class TermOverlap(object):
+    """
+    Compares terms of hierarchies by Jaccard similarity. Overlaps of all
+    pairs of terms of two hierarchies are found at once as a product of
+    their sparse :py:class:`TermIncidence` matrices, so only pairs of
+    terms sharing genes are ever looked at
+    """
+
+    JACCARD_THRESHOLD = 0.75
+
+    def __init__(self, jaccard_threshold=JACCARD_THRESHOLD):
+        """
+        Constructor
+
+        :param jaccard_threshold: Minimum Jaccard similarity for two
+                                  terms to be considered the same
+        :type jaccard_threshold: float
+        """
+        self._jaccard_threshold = jaccard_threshold
+
+    @staticmethod
+    def _check_same_genes(a, b):
+        """
+        Raises error if **a** and **b** do not have the same gene columns
+
+        :param a:
+        :type a: :py:class:`TermIncidence`
+        :param b:
+        :type b: :py:class:`TermIncidence`
+        """
+        if a.get_gene_names() is not b.get_gene_names() and a.get_gene_names() != b.get_gene_names():
+            raise CellmapsGenerateHierarchyError('Hierarchies must have the same gene columns, '
+                                                 'use TermIncidence.from_nodes_files()')
+
+    def get_overlap_matrix(self, a, b):
+        """
+        Gets number of genes shared by each term of **a**
+        and each term of **b**
+
+        :param a:
+        :type a: :py:class:`TermIncidence`
+        :param b:
+        :type b: :py:class:`TermIncidence`
+        :return: terms of **a** by terms of **b** matrix, with entries
+                 only for pairs of terms sharing genes
+        :rtype: :py:class:`scipy.sparse.csr_matrix`
+        """
+        self._check_same_genes(a, b)
+        return (a.get_matrix() @ b.get_matrix().T).tocsr()
+
+    def get_jaccard_matrix(self, a, b):
+        """
+        Gets Jaccard similarity of each term of **a** and each term of **b**
+
+        :param a:
+        :type a: :py:class:`TermIncidence`
+        :param b:
+        :type b: :py:class:`TermIncidence`
+        :return: terms of **a** by terms of **b** matrix, with entries
+                 only for pairs of terms sharing genes
+        :rtype: :py:class:`scipy.sparse.csr_matrix`
+        """
+        overlap = self.get_overlap_matrix(a, b).tocoo()
+        union = a.get_term_sizes()[overlap.row] + b.get_term_sizes()[overlap.col] - overlap.data
+        return sparse.csr_matrix((overlap.data / union, (overlap.row, overlap.col)),
+                                 shape=overlap.shape)
+
+    def get_best_matches(self, a, b):
+        """
+        Gets term of **b** most similar to each term of **a**
+
+        :param a:
+        :type a: :py:class:`TermIncidence`
+        :param b:
+        :type b: :py:class:`TermIncidence`
+        :return: (index of best matching term in **b** or ``-1`` if
+                  no term shares genes, Jaccard similarity of best match)
+                 with one entry per term of **a**
+        :rtype: tuple
+        """
+        jaccard = self.get_jaccard_matrix(a, b)
+        best_idx = np.full(a.get_num_terms(), -1, dtype=np.int64)
+        best_jaccard = np.zeros(a.get_num_terms(), dtype=np.float64)
+        if jaccard.nnz == 0:
+            return best_idx, best_jaccard
+        best_jaccard = jaccard.max(axis=1).toarray().ravel()
+        has_match = best_jaccard > 0
+        best_idx[has_match] = np.asarray(jaccard.argmax(axis=1)).ravel()[has_match]
+        return best_idx, best_jaccard
+
+    def get_best_match_table(self, a, b):
+        """
+        Gets term of **b** most similar to each term of **a** as a table
+
+        :param a:
+        :type a: :py:class:`TermIncidence`
+        :param b:
+        :type b: :py:class:`TermIncidence`
+        :return: table with ``term``, ``size``, ``best_match``,
+                 ``best_match_size`` and ``jaccard`` columns
+        :rtype: :py:class:`pandas.DataFrame`
+        """
+        best_idx, best_jaccard = self.get_best_matches(a, b)
+        b_names = np.array(b.get_term_names() + [None], dtype=object)
+        b_sizes = np.append(b.get_term_sizes(), 0)
+        return pd.DataFrame({'term': a.get_term_names(),
+                             'size': a.get_term_sizes(),
+                             'best_match': b_names[best_idx],
+                             'best_match_size': b_sizes[best_idx],
+                             'jaccard': best_jaccard})
+
+    def get_stability(self, reference, others):
+        """
+        Gets how stable each term of **reference** is across **others**,
+        such as bootstrap replicates or hierarchies built with other
+        parameters
+
+        :param reference:
+        :type reference: :py:class:`TermIncidence`
+        :param others:
+        :type others: list
+        :return: table with ``term``, ``size``, ``support``, the fraction of
+                 **others** with a term whose Jaccard similarity to it is at
+                 least **jaccard_threshold**, and ``mean_best_jaccard``,
+                 the mean Jaccard similarity of its best match in **others**
+        :rtype: :py:class:`pandas.DataFrame`
+        """
+        num_found = np.zeros(reference.get_num_terms(), dtype=np.int64)
+        jaccard_sum = np.zeros(reference.get_num_terms(), dtype=np.float64)
+        for other in others:
+            _, best_jaccard = self.get_best_matches(reference, other)
+            num_found += best_jaccard >= self._jaccard_threshold
+            jaccard_sum += best_jaccard
+        num_others = max(len(others), 1)
+        return pd.DataFrame({'term': reference.get_term_names(),
+                             'size': reference.get_term_sizes(),
+                             'support': num_found / num_others,
+                             'mean_best_jaccard': jaccard_sum / num_others})
+
+    def compare_nodes_files(self, reference_nodes_file, nodes_files):
+        """
+        Gets stability of each term in HiDeF nodes file
+        **reference_nodes_file** across HiDeF nodes files
+        **nodes_files** as described in :py:meth:`get_stability`
+
+        :param reference_nodes_file:
+        :type reference_nodes_file: str
+        :param nodes_files:
+        :type nodes_files: list
+        :return:
+        :rtype: :py:class:`pandas.DataFrame`
+        """
+        incidences = TermIncidence.from_nodes_files([reference_nodes_file] + list(nodes_files))
+        logger.debug('Comparing ' + str(incidences[0].get_num_terms()) + ' terms across ' +
+                     str(len(nodes_files)) + ' hierarchies')
+        return self.get_stability(incidences[0], incidences[1:])
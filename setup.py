@@ -35,7 +35,8 @@ requirements = ['cellmaps_utils>=0.4.0,<1.0.0',
                 'ndex2>=3.5.1,<4.0.0',
                 'cdapsutil>=0.2.2,<1.0.0',
                 'leidenalg==0.9.1',
-                'hidef>=1.1.5,<2.0.0']
+                'hidef>=1.1.5,<2.0.0',
+                'scipy>=1.10.0,<2.0.0']
 
 setup_requirements = []
 
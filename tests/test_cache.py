@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `cache` module."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from cellmaps_generate_hierarchy.exceptions import CellmapsGenerateHierarchyError
+from cellmaps_generate_hierarchy.cache import FileCache
+from cellmaps_generate_hierarchy.cache import get_file_digest
+
+
+class TestFileCache(unittest.TestCase):
+    """Tests for `FileCache`."""
+
+    def setUp(self):
+        """Set up test fixtures, if any."""
+        self._temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """Tear down test fixtures, if any."""
+        shutil.rmtree(self._temp_dir)
+
+    def _add_entry(self, cache, key, size, last_used):
+        entry_dir = cache.get_new_entry_dir()
+        with open(os.path.join(entry_dir, 'data'), 'wb') as f:
+            f.write(b'x' * size)
+        entry_path = cache.put(key, entry_dir)
+        os.utime(entry_path, (last_used, last_used))
+        return entry_path
+
+    def test_constructor_none_cache_dir(self):
+        try:
+            FileCache(None)
+            self.fail('Expected exception')
+        except CellmapsGenerateHierarchyError as e:
+            self.assertEqual('cache_dir is None', str(e))
+
+    def test_invalid_key(self):
+        cache = FileCache(self._temp_dir)
+        for key in [None, '', '.tmpfoo', 'a' + os.sep + 'b']:
+            try:
+                cache.get(key)
+                self.fail('Expected exception')
+            except CellmapsGenerateHierarchyError as e:
+                self.assertTrue('Invalid cache key' in str(e))
+
+    def test_put_get_and_remove(self):
+        cache_dir = os.path.join(self._temp_dir, 'cache')
+        cache = FileCache(cache_dir)
+        self.assertIsNone(cache.get_max_size())
+        self.assertIsNone(cache.get('foo'))
+        self.assertEqual([], cache.get_entries())
+
+        entry_path = self._add_entry(cache, 'foo', 10, 1)
+        self.assertEqual(os.path.join(cache_dir, 'foo'), entry_path)
+        self.assertEqual(entry_path, cache.get('foo'))
+        self.assertEqual(10, cache.get_size())
+        self.assertEqual(['foo'], os.listdir(cache_dir))
+
+        # replace existing entry
+        self._add_entry(cache, 'foo', 20, 1)
+        self.assertEqual(20, cache.get_size())
+
+        cache.remove('foo')
+        self.assertIsNone(cache.get('foo'))
+        self.assertEqual(0, cache.get_size())
+
+    def test_lru_eviction(self):
+        cache = FileCache(self._temp_dir)
+        self._add_entry(cache, 'a', 10, 100)
+        self._add_entry(cache, 'b', 10, 200)
+        self._add_entry(cache, 'c', 10, 300)
+        self.assertEqual(['a', 'b', 'c'], [e['key'] for e in cache.get_entries()])
+
+        # get marks entry as most recently used
+        cache.get('a')
+        self.assertEqual(['b', 'c', 'a'], [e['key'] for e in cache.get_entries()])
+
+        cache = FileCache(self._temp_dir, max_size=25)
+        self._add_entry(cache, 'd', 10, 400)
+        self.assertEqual(['a', 'd'], sorted([e['key'] for e in cache.get_entries()]))
+
+        self.assertEqual(['d', 'a'], cache.prune(max_size=0, keep=None))
+        self.assertEqual([], cache.get_entries())
+
+    def test_prune_keep(self):
+        cache = FileCache(self._temp_dir)
+        self._add_entry(cache, 'a', 10, 100)
+        self._add_entry(cache, 'b', 10, 200)
+        self.assertEqual(['b'], cache.prune(max_size=0, keep=['a']))
+        self.assertEqual(['a'], [e['key'] for e in cache.get_entries()])
+
+    def test_prune_removes_stale_tmp_dirs(self):
+        cache = FileCache(self._temp_dir)
+        stale = cache.get_new_entry_dir()
+        os.utime(stale, (0, 0))
+        fresh = cache.get_new_entry_dir()
+        cache.prune()
+        self.assertFalse(os.path.isdir(stale))
+        self.assertTrue(os.path.isdir(fresh))
+
+    def test_get_file_digest(self):
+        path = os.path.join(self._temp_dir, 'foo.txt')
+        with open(path, 'w') as f:
+            f.write('hello')
+        self.assertEqual('2cf24dba5fb0a30e26e83b2ac5b9e29e1b161e5c1fa7425e73043362938b9824',
+                         get_file_digest(path, blocksize=2).hexdigest())
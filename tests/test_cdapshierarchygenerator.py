@@ -4,10 +4,13 @@
 """Tests for `CDAPSHierarchyGenerator`."""
 
 import os
+import sys
+import time
 from datetime import date
 import shutil
 import tempfile
 import unittest
+import numpy as np
 from unittest.mock import MagicMock
 import json
 import ndex2
@@ -16,9 +19,14 @@ from io import StringIO
 from cellmaps_utils import constants
 import cellmaps_generate_hierarchy
 from cellmaps_generate_hierarchy.hcx import HCXFromCDAPSCXHierarchy
+from cellmaps_generate_hierarchy.cache import FileCache
 from cellmaps_generate_hierarchy.hierarchy import CDAPSHiDeFHierarchyGenerator
 from cellmaps_generate_hierarchy.exceptions import CellmapsGenerateHierarchyError
 from cellmaps_generate_hierarchy.hierarchy import HierarchyGenerator
+from cellmaps_generate_hierarchy.maturehierarchy import HiDeFHierarchyRefiner
+from cellmaps_generate_hierarchy.ppi import PPINetworkEdges
+from cellmaps_generate_hierarchy.ppi import EdgeTable
+from cellmaps_generate_hierarchy.ppi import GeneIndex
 
 
 class TestCDAPSHierarchyGenerator(unittest.TestCase):
@@ -208,6 +216,270 @@ class TestCDAPSHierarchyGenerator(unittest.TestCase):
         finally:
             shutil.rmtree(temp_dir)
 
+    def _write_nested_networks(self, temp_dir, num_nodes=30):
+        names = ['n' + str(i) for i in range(num_nodes)]
+        pairs = [(names[i], names[j]) for i in range(num_nodes) for j in range(i + 1, num_nodes)]
+        cx_networks = []
+        for num_edges in [40, 200]:
+            net = ndex2.nice_cx_network.NiceCXNetwork()
+            net.set_name(str(num_edges))
+            net.set_network_attribute(name='cutoff', values=str(num_edges))
+            node_ids = {}
+            for src, tgt in pairs[:num_edges]:
+                for name in (src, tgt):
+                    if name not in node_ids:
+                        node_ids[name] = net.create_node(name)
+                net.create_edge(edge_source=node_ids[src], edge_target=node_ids[tgt])
+            prefix = os.path.join(temp_dir, 'net' + str(num_edges))
+            with open(prefix + constants.CX_SUFFIX, 'w') as f:
+                json.dump(net.to_cx(), f)
+            cx_networks.append(prefix)
+        return cx_networks
+
+    def _read_edges(self, path):
+        with open(path, 'r') as f:
+            return [tuple(line.rstrip('\n').split('\t')) for line in f]
+
+    def test_create_edgelist_files_for_networks_with_bootstrap(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            cx_networks = self._write_nested_networks(temp_dir)
+            results = []
+            for seed in [5, 5, 6]:
+                mockprov = MagicMock()
+                mockprov.get_default_date_format_str = MagicMock(return_value='%Y-%m-%d')
+                gen = CDAPSHiDeFHierarchyGenerator(provenance_utils=mockprov,
+                                                   hcxconverter=HCXFromCDAPSCXHierarchy(),
+                                                   bootstrap_edges=10,
+                                                   bootstrap_seed=seed)
+                gen._create_edgelist_files_for_networks(cx_networks)
+                res = {}
+                for prefix in cx_networks:
+                    res[prefix] = (self._read_edges(prefix + CDAPSHiDeFHierarchyGenerator.EDGELIST_TSV),
+                                   self._read_edges(prefix + '_removed_edges.tsv'))
+                results.append(res)
+
+            small, large = cx_networks
+            small_kept, small_removed = results[0][small]
+            large_kept, large_removed = results[0][large]
+            self.assertEqual(36, len(small_kept))
+            self.assertEqual(4, len(small_removed))
+            self.assertEqual(180, len(large_kept))
+            self.assertEqual(20, len(large_removed))
+            self.assertEqual(0, len(set(large_kept).intersection(large_removed)))
+
+            # edges removed from smaller network were also removed from larger one
+            self.assertTrue(set(small_removed).issubset(set(large_removed)))
+            self.assertEqual(set(small_kept + small_removed), set(large_kept + large_removed).intersection(
+                set(small_kept + small_removed)))
+
+            # same seed gives same result
+            self.assertEqual(results[0], results[1])
+            self.assertNotEqual(results[0][large][1], results[2][large][1])
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_bootstrap_replicates_requires_bootstrap_edges(self):
+        with self.assertRaises(CellmapsGenerateHierarchyError) as ce:
+            CDAPSHiDeFHierarchyGenerator(bootstrap_replicates=2)
+        self.assertEqual('bootstrap_edges must be greater than 0 to use bootstrap_replicates', str(ce.exception))
+
+    def test_run_hidef_with_bootstrap_replicates(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            cx_networks = self._write_nested_networks(temp_dir)
+            results = []
+            for seed in [5, 5]:
+                mockprov = MagicMock()
+                mockprov.get_default_date_format_str = MagicMock(return_value='%Y-%m-%d')
+                gen = CDAPSHiDeFHierarchyGenerator(provenance_utils=mockprov,
+                                                   bootstrap_edges=10,
+                                                   bootstrap_seed=seed,
+                                                   bootstrap_replicates=3,
+                                                   workers=2)
+                edgelist_files = gen._create_edgelist_files_for_networks(cx_networks, bootstrap=False)[3]
+                self.assertFalse(os.path.isfile(cx_networks[1] + '_removed_edges.tsv'))
+                runs = {}
+
+                def fake_hidef(edgelists, outputprefix, algorithm, maxres, k, cwd=None):
+                    removed_file = os.path.join(os.path.dirname(outputprefix),
+                                                os.path.basename(cx_networks[1]) + '_removed_edges.tsv')
+                    runs[outputprefix] = (edgelists, cwd, self._read_edges(removed_file)
+                                          if os.path.isfile(removed_file) else None)
+                    with open(outputprefix + '.nodes', 'w') as f:
+                        f.write('Cluster0-0\t2\t0 1\t10\n')
+
+                gen._run_hidef = MagicMock(side_effect=fake_hidef)
+                replicates_dir = os.path.join(temp_dir, 'replicates' + str(len(results)))
+                res = gen._run_hidef_with_bootstrap_replicates(cx_networks, None, edgelist_files, temp_dir,
+                                                               replicates_dir, 'leiden', 10, 3)
+                self.assertEqual(4, len(runs))
+                ref_prefix = os.path.join(temp_dir, CDAPSHiDeFHierarchyGenerator.HIDEF_OUT_PREFIX)
+                self.assertEqual((edgelist_files, None, None), runs[ref_prefix])
+                replicate_removed = []
+                for idx in range(3):
+                    replicate_dir = os.path.join(replicates_dir, 'replicate_' + str(idx))
+                    prefix = os.path.join(replicate_dir, CDAPSHiDeFHierarchyGenerator.HIDEF_OUT_PREFIX)
+                    self.assertEqual(prefix + '.nodes', res[idx])
+                    edgelists, cwd, removed = runs[prefix]
+                    self.assertEqual(replicate_dir, cwd)
+                    self.assertEqual(2, len(edgelists))
+                    self.assertEqual(20, len(removed))
+                    # edge lists are removed once HiDeF finishes
+                    for edgelist in edgelists:
+                        self.assertEqual(replicate_dir, os.path.dirname(edgelist))
+                        self.assertFalse(os.path.isfile(edgelist))
+                    replicate_removed.append(removed)
+                self.assertNotEqual(replicate_removed[0], replicate_removed[1])
+                results.append(replicate_removed)
+            # same seed gives same replicates
+            self.assertEqual(results[0], results[1])
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_run_hidef_with_bootstrap_replicates_does_not_register_replicates(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            cx_networks = self._write_nested_networks(temp_dir)
+            mockprov = MagicMock()
+            mockprov.get_default_date_format_str = MagicMock(return_value='%Y-%m-%d')
+            mockprov.register_dataset = MagicMock(return_value='1')
+            gen = CDAPSHiDeFHierarchyGenerator(refiner=HiDeFHierarchyRefiner(provenance_utils=mockprov),
+                                               provenance_utils=mockprov,
+                                               bootstrap_edges=10,
+                                               bootstrap_seed=1,
+                                               bootstrap_replicates=2,
+                                               workers=2)
+            edgelist_files = gen._create_edgelist_files_for_networks(cx_networks, bootstrap=False)[3]
+            mockprov.register_dataset.reset_mock()
+
+            def fake_hidef(edgelists, outputprefix, algorithm, maxres, k, cwd=None):
+                for suffix in ['.nodes', '.edges']:
+                    shutil.copy(os.path.join(os.path.dirname(__file__), 'data', 'hidef_output' + suffix),
+                                outputprefix + suffix)
+
+            gen._run_hidef = MagicMock(side_effect=fake_hidef)
+            replicates_dir = os.path.join(temp_dir, 'replicates')
+            res = gen._run_hidef_with_bootstrap_replicates(cx_networks, None, edgelist_files, temp_dir,
+                                                           replicates_dir, 'leiden', 10, 3)
+            self.assertEqual(2, len(res))
+            for idx, nodes_file in enumerate(res):
+                self.assertEqual(os.path.join(replicates_dir, 'replicate_' + str(idx),
+                                              CDAPSHiDeFHierarchyGenerator.HIDEF_OUT_PREFIX + '.pruned.nodes'),
+                                 nodes_file)
+                self.assertTrue(os.path.isfile(nodes_file))
+            mockprov.register_dataset.assert_not_called()
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_get_bootstrap_support(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            nodes_file = os.path.join(temp_dir, 'hidef_output.pruned.nodes')
+            with open(nodes_file, 'w') as f:
+                f.write('Cluster0-0\t8\t0 1 2 3 4 5 6 7\t10\n')
+                f.write('Cluster1-0\t4\t0 1 2 3\t8\n')
+                f.write('Cluster1-1\t4\t4 5 6 7\t5\n')
+            replicate_files = []
+            for idx, lines in enumerate([['A\t8\t0 1 2 3 4 5 6 7\t10', 'B\t4\t0 1 2 3\t5'],
+                                         ['A\t7\t0 1 2 3 4 5 6\t10', 'B\t3\t0 1 2\t5', 'C\t2\t6 7\t5'],
+                                         ['A\t9\t0 1 2 3 4 5 6 7 8\t10', 'B\t5\t1 2 3 4 5\t5'],
+                                         []]):
+                replicate_file = os.path.join(temp_dir, str(idx) + '.nodes')
+                with open(replicate_file, 'w') as f:
+                    f.write('\n'.join(lines))
+                replicate_files.append(replicate_file)
+            gen = CDAPSHiDeFHierarchyGenerator()
+            res = gen._get_bootstrap_support(nodes_file, replicate_files)
+            # jaccard of 3/4 counts, 2/4 does not
+            self.assertEqual(['Cluster0-0', 'Cluster1-0', 'Cluster1-1'], res['term'].tolist())
+            self.assertEqual([8, 4, 4], res['size'].tolist())
+            self.assertEqual([0.75, 0.5, 0.0], res['support'].tolist())
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_convert_hidef_output_to_cdaps_with_support(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            shutil.copy(os.path.join(os.path.dirname(__file__), 'data', 'hidef_output.nodes'),
+                        os.path.join(temp_dir, 'hidef_output.pruned.nodes'))
+            shutil.copy(os.path.join(os.path.dirname(__file__), 'data', 'hidef_output.edges'),
+                        os.path.join(temp_dir, 'hidef_output.pruned.edges'))
+            out_stream = StringIO('')
+            gen = CDAPSHiDeFHierarchyGenerator()
+            gen.convert_hidef_output_to_cdaps(out_stream, temp_dir,
+                                              support_map={'Cluster2-6': 1.0, 'Cluster3-3': 0.25})
+            res = json.loads(out_stream.getvalue())
+            self.assertEqual([{'nodes': {'HiDeF_persistence': {'d': 'integer', 'a': 'p1', 'v': 0},
+                                         'HiDeF_bootstrap_support': {'d': 'double', 'a': 'p2', 'v': 0.0}}}],
+                             res['nodeAttributesAsCX2']['attributeDeclarations'])
+            self.assertEqual([{'id': 77, 'v': {'p1': 36, 'p2': 1.0}},
+                              {'id': 78, 'v': {'p1': 33, 'p2': 0.25}}],
+                             res['nodeAttributesAsCX2']['nodes'])
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_create_edgelist_files_for_network_edges_matches_cx(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            cx_networks = self._write_nested_networks(temp_dir)
+            network_edges = [PPINetworkEdges.from_network(ndex2.create_nice_cx_from_file(n + constants.CX_SUFFIX))
+                             for n in cx_networks]
+            results = []
+            for edges in [None, network_edges]:
+                mockprov = MagicMock()
+                mockprov.get_default_date_format_str = MagicMock(return_value='%Y-%m-%d')
+                gen = CDAPSHiDeFHierarchyGenerator(provenance_utils=mockprov,
+                                                   hcxconverter=HCXFromCDAPSCXHierarchy(),
+                                                   bootstrap_edges=10,
+                                                   bootstrap_seed=1,
+                                                   hierarchy_parent_cutoff=40)
+                (parent_net_path, parent_net,
+                 largest_net, net_paths) = gen._create_edgelist_files_for_networks(cx_networks,
+                                                                                   network_edges=edges)
+                self.assertEqual(cx_networks[0] + constants.CX_SUFFIX, parent_net_path)
+                self.assertEqual('40', parent_net.get_name())
+                self.assertEqual('200', largest_net.get_name())
+                self.assertEqual(40, len(parent_net.get_edges()))
+                res = [self._read_edges(p) for p in net_paths]
+                res.extend([self._read_edges(n + '_removed_edges.tsv') for n in cx_networks])
+                results.append(res)
+                if edges is None:
+                    # in memory path does not need CX files
+                    for n in cx_networks:
+                        os.remove(n + constants.CX_SUFFIX)
+            self.assertEqual(results[0], results[1])
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_create_edgelist_files_for_network_edges_with_shared_gene_index(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            gene_index = GeneIndex(['A', 'B', 'C', 'D', 'E', 'F'])
+            edge_table = EdgeTable(gene_index, [5, 5, 1, 3], [1, 3, 3, 0], weights=[0.9, 0.8, 0.7, 0.6])
+            networks = [os.path.join(temp_dir, 'small'), os.path.join(temp_dir, 'big')]
+            network_edges = [PPINetworkEdges(edge_table.head(2), name='small', attributes={'cutoff': '0.5'}),
+                             PPINetworkEdges(edge_table, name='big', attributes={'cutoff': '1.0'})]
+            mockprov = MagicMock()
+            mockprov.get_default_date_format_str = MagicMock(return_value='%Y-%m-%d')
+            gen = CDAPSHiDeFHierarchyGenerator(provenance_utils=mockprov,
+                                               hcxconverter=HCXFromCDAPSCXHierarchy(),
+                                               hierarchy_parent_cutoff=0.5)
+            (parent_net_path, parent_net,
+             largest_net, net_paths) = gen._create_edgelist_files_for_networks(networks,
+                                                                               network_edges=network_edges)
+            self.assertEqual(networks[0] + constants.CX_SUFFIX, parent_net_path)
+            self.assertEqual('small', parent_net.get_name())
+            self.assertEqual('big', largest_net.get_name())
+            # gene ids are written as is and match node ids of largest network
+            self.assertEqual([('5', '1'), ('5', '3')], self._read_edges(net_paths[0]))
+            self.assertEqual([('5', '1'), ('5', '3'), ('1', '3'), ('3', '0')], self._read_edges(net_paths[1]))
+            self.assertEqual({0: 'A', 1: 'B', 3: 'D', 5: 'F'},
+                             {node_id: node_obj['n'] for node_id, node_obj in largest_net.get_nodes()})
+            self.assertFalse(os.path.isfile(networks[0] + constants.CX_SUFFIX))
+        finally:
+            shutil.rmtree(temp_dir)
+
     def test_register_hidef_output_files(self):
         temp_dir = tempfile.mkdtemp()
         try:
@@ -236,6 +508,31 @@ class TestCDAPSHierarchyGenerator(unittest.TestCase):
         finally:
             shutil.rmtree(temp_dir)
 
+    def test_register_bootstrap_support_file(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            mockprov = MagicMock()
+            mockprov.register_dataset = MagicMock(return_value='X')
+            mockprov.get_default_date_format_str = MagicMock(return_value='%Y-%m-%d')
+            gen = CDAPSHiDeFHierarchyGenerator(provenance_utils=mockprov, bootstrap_edges=10,
+                                               bootstrap_replicates=4)
+            gen._register_bootstrap_support_file(temp_dir)
+            self.assertEqual(['X'], gen.get_generated_dataset_ids())
+            data_dict = {'name': CDAPSHiDeFHierarchyGenerator.BOOTSTRAP_SUPPORT_TSV +
+                         ' HiDeF bootstrap support file',
+                         'description': 'Fraction of 4 bootstrap replicates, each with 10% of edges randomly '
+                                        'removed, that found each term and mean Jaccard similarity of its '
+                                        'best match in each replicate',
+                         'data-format': 'tsv',
+                         'author': 'cellmaps_generate_hierarchy',
+                         'version': cellmaps_generate_hierarchy.__version__,
+                         'date-published': date.today().strftime('%Y-%m-%d')}
+            mockprov.register_dataset.assert_called_once_with(
+                temp_dir, source_file=os.path.join(temp_dir, CDAPSHiDeFHierarchyGenerator.BOOTSTRAP_SUPPORT_TSV),
+                data_dict=data_dict)
+        finally:
+            shutil.rmtree(temp_dir)
+
     def test_get_hierarchy_hidef_fails(self):
         temp_dir = tempfile.mkdtemp()
         try:
@@ -280,8 +577,304 @@ class TestCDAPSHierarchyGenerator(unittest.TestCase):
         finally:
             shutil.rmtree(temp_dir)
 
+    def test_get_hierarchy_with_scratch_dir_removes_edgelists(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            scratch_dir = os.path.join(temp_dir, 'scratch')
+            gene_index = GeneIndex(['n1', 'n2', 'n5'])
+            edge_table = EdgeTable(gene_index, [0, 1], [1, 2])
+            networks = [os.path.join(temp_dir, 'one_edge'), os.path.join(temp_dir, 'two_edge')]
+            network_edges = [PPINetworkEdges(edge_table.head(1), name='one', attributes={'cutoff': '0.7'}),
+                             PPINetworkEdges(edge_table, name='two', attributes={'cutoff': '1.0'})]
+            mockprov = MagicMock()
+            mockprov.get_default_date_format_str = MagicMock(return_value='%Y-%m-%d')
+            gen = CDAPSHiDeFHierarchyGenerator(provenance_utils=mockprov,
+                                               hcxconverter=MagicMock(),
+                                               scratch_dir=scratch_dir)
+            edgelists = []
+
+            def fake_get_hierarchy_from_edgelists(outdir, edgelist_files, parent_net,
+                                                  algorithm, maxres, k):
+                for edgelist_file in edgelist_files:
+                    self.assertEqual(scratch_dir, os.path.dirname(os.path.dirname(edgelist_file)))
+                    edgelists.append(self._read_edges(edgelist_file))
+                raise CellmapsGenerateHierarchyError('hidef failed')
+
+            gen.get_hierarchy_from_edgelists = MagicMock(side_effect=fake_get_hierarchy_from_edgelists)
+            with self.assertRaises(CellmapsGenerateHierarchyError):
+                gen.get_hierarchy(networks, network_edges=network_edges)
+            self.assertEqual([[('0', '1')], [('0', '1'), ('1', '2')]], edgelists)
+            self.assertEqual([], os.listdir(scratch_dir))
+            self.assertEqual(0, mockprov.register_dataset.call_count)
+            self.assertEqual([], [f for f in os.listdir(temp_dir)
+                                  if f.endswith(CDAPSHiDeFHierarchyGenerator.EDGELIST_TSV)])
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def _get_reference_hidef_graphs(self, edgelist_files):
+        # builds graphs the way hidef_finder.py does from files
+        import igraph
+        if len(edgelist_files) == 1:
+            graph = igraph.Graph.Read_Ncol(edgelist_files[0], directed=False)
+            return [graph], graph.vs['name']
+        nodenames = []
+        for edgelist_file in edgelist_files:
+            with open(edgelist_file) as f:
+                for line in f:
+                    nodenames.extend(line.strip().split()[:2])
+        nodenames = sorted(set(nodenames))
+        nodedict = {x: i for i, x in enumerate(nodenames)}
+        graphs = []
+        for edgelist_file in edgelist_files:
+            tmp_file = edgelist_file + '.tmp'
+            with open(edgelist_file) as f, open(tmp_file, 'w') as out:
+                for line in f:
+                    ll = line.strip().split()
+                    out.write(str(nodedict[ll[0]]) + '\t' + str(nodedict[ll[1]]) + '\n')
+                out.write(str(len(nodenames) - 1) + '\t' + str(len(nodenames) - 1) + '\n')
+            graphs.append(igraph.Graph.Read_Edgelist(tmp_file, directed=False))
+        return graphs, nodenames
+
+    def _assert_same_graphs(self, expected, res):
+        self.assertEqual(len(expected[0]), len(res[0]))
+        self.assertEqual(list(expected[1]), list(res[1]))
+        for exp_graph, graph in zip(expected[0], res[0]):
+            self.assertEqual(exp_graph.vcount(), graph.vcount())
+            self.assertEqual(exp_graph.get_edgelist(), graph.get_edgelist())
+            self.assertEqual(exp_graph.vs.attributes(), graph.vs.attributes())
+            self.assertEqual(exp_graph.es.attributes(), graph.es.attributes())
+            for attr in exp_graph.es.attributes():
+                self.assertEqual(exp_graph.es[attr], graph.es[attr])
+
+    def test_get_hidef_graphs_matches_hidef_finder(self):
+        try:
+            import igraph
+        except ImportError:
+            self.skipTest('igraph not installed')
+        temp_dir = tempfile.mkdtemp()
+        try:
+            gene_index = GeneIndex(['g' + str(i) for i in range(12)])
+            rng = np.random.default_rng(1)
+            sources = rng.integers(0, 12, size=30)
+            targets = (sources + rng.integers(1, 12, size=30)) % 12
+            weights = rng.random(30)
+            weights[3] = np.nan
+            edge_table = EdgeTable(gene_index, sources, targets, weights=weights)
+            networks = [os.path.join(temp_dir, 'net' + str(n)) for n in [10, 30]]
+            for weighted_mode in [False, True]:
+                for num_networks in [1, 2]:
+                    network_edges = [PPINetworkEdges(edge_table.head(n), name=str(n),
+                                                     attributes={'cutoff': str(n)})
+                                     for n in [10, 30][2 - num_networks:]]
+                    mockprov = MagicMock()
+                    mockprov.get_default_date_format_str = MagicMock(return_value='%Y-%m-%d')
+                    gen = CDAPSHiDeFHierarchyGenerator(provenance_utils=mockprov,
+                                                       weighted_mode=weighted_mode,
+                                                       hidef_in_process=True)
+                    res = gen._create_edgelist_files_for_networks(networks[2 - num_networks:],
+                                                                  network_edges=network_edges)
+                    edgelist_files = res[3]
+                    expected = self._get_reference_hidef_graphs(edgelist_files)
+                    # from edges kept in memory
+                    self._assert_same_graphs(expected, gen._get_hidef_graphs(edgelist_files))
+                    self.assertEqual({}, gen._edgelist_arrays)
+                    # from files
+                    self._assert_same_graphs(expected, gen._get_hidef_graphs(edgelist_files))
+        finally:
+            shutil.rmtree(temp_dir)
 
+    def test_run_hidef_in_process(self):
+        try:
+            import hidef.hidef_finder
+        except ImportError:
+            self.skipTest('hidef not installed')
+        temp_dir = tempfile.mkdtemp()
+        try:
+            # two cliques of 8 joined by a single edge
+            sources = []
+            targets = []
+            for offset in [0, 8]:
+                for i in range(8):
+                    for j in range(i + 1, 8):
+                        sources.append(i + offset)
+                        targets.append(j + offset)
+            sources.append(0)
+            targets.append(8)
+            edge_table = EdgeTable(GeneIndex(['g' + str(i) for i in range(16)]), sources, targets)
+            network_edges = [PPINetworkEdges(edge_table, name='net', attributes={'cutoff': '1.0'})]
+            mockprov = MagicMock()
+            mockprov.get_default_date_format_str = MagicMock(return_value='%Y-%m-%d')
+            gen = CDAPSHiDeFHierarchyGenerator(provenance_utils=mockprov,
+                                               hidef_cmd=os.path.join(temp_dir, 'doesnotexist.py'),
+                                               hidef_in_process=True)
+            res = gen._create_edgelist_files_for_networks([os.path.join(temp_dir, 'net')],
+                                                          network_edges=network_edges)
+            outprefix = os.path.join(temp_dir, CDAPSHiDeFHierarchyGenerator.HIDEF_OUT_PREFIX)
+            gen._run_hidef(res[3], outprefix, 'leiden', 10, 3)
+            with open(outprefix + '.nodes') as f:
+                nodes = [line.rstrip('\n').split('\t') for line in f]
+            self.assertTrue(len(nodes) >= 1)
+            self.assertEqual('16', nodes[0][1])
+            self.assertEqual(set([str(i) for i in range(16)]), set(nodes[0][2].split(' ')))
+            self.assertTrue(os.path.isfile(outprefix + '.edges'))
+            self.assertFalse(os.path.isfile(outprefix + '.gml'))
+        finally:
+            shutil.rmtree(temp_dir)
 
+    def test_run_hidef_in_process_falls_back_to_cmd(self):
+        mockprov = MagicMock()
+        gen = CDAPSHiDeFHierarchyGenerator(provenance_utils=mockprov,
+                                           hidef_cmd='/foo/hidef_finder.py',
+                                           hidef_in_process=True)
+        gen._edgelist_arrays['/foo/a.tsv'] = None
+        gen._run_hidef_in_process = MagicMock(side_effect=ImportError('no hidef'))
+        gen._run_cmd = MagicMock(return_value=(0, '', ''))
+        gen._run_hidef(['/foo/a.tsv'], '/foo/out', 'leiden', 10, 3)
+        cmd = gen._run_cmd.call_args[0][0]
+        self.assertEqual('/foo/hidef_finder.py', cmd[1])
+        self.assertEqual(['--g', '/foo/a.tsv', '--o', '/foo/out'], cmd[2:6])
+        self.assertEqual({}, gen._edgelist_arrays)
+
+        gen._run_hidef_in_process = MagicMock(side_effect=ValueError('bad'))
+        with self.assertRaises(CellmapsGenerateHierarchyError):
+            gen._run_hidef(['/foo/a.tsv'], '/foo/out', 'leiden', 10, 3)
+
+    def test_run_hidef_with_cache(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            edgelist_file = os.path.join(temp_dir, 'a.tsv')
+            with open(edgelist_file, 'w') as f:
+                f.write('0\t1\n1\t2\n')
+            hidef_cache = FileCache(os.path.join(temp_dir, 'cache'))
+            gen = CDAPSHiDeFHierarchyGenerator(provenance_utils=MagicMock(),
+                                               hidef_cache=hidef_cache)
+
+            def fake_cmd(cmd, cwd=None):
+                outputprefix = cmd[cmd.index('--o') + 1]
+                for suffix in CDAPSHiDeFHierarchyGenerator.HIDEF_OUTPUT_SUFFIXES:
+                    with open(outputprefix + suffix, 'w') as f:
+                        f.write(suffix + ' ' + cmd[cmd.index('--k') + 1])
+                return 0, '', ''
+
+            gen._run_cmd = MagicMock(side_effect=fake_cmd)
+            first_prefix = os.path.join(temp_dir, 'first')
+            gen._run_hidef([edgelist_file], first_prefix, 'leiden', 10, 3)
+            self.assertEqual(1, gen._run_cmd.call_count)
+            self.assertEqual(1, len(hidef_cache.get_entries()))
+
+            # same edge lists and parameters reuse cached output
+            second_prefix = os.path.join(temp_dir, 'second')
+            gen._run_hidef([edgelist_file], second_prefix, 'leiden', 10, 3)
+            self.assertEqual(1, gen._run_cmd.call_count)
+            for suffix in CDAPSHiDeFHierarchyGenerator.HIDEF_OUTPUT_SUFFIXES:
+                with open(second_prefix + suffix, 'r') as f:
+                    self.assertEqual(suffix + ' 3', f.read())
+
+            # other parameters or edge lists rerun HiDeF
+            gen._run_hidef([edgelist_file], second_prefix, 'leiden', 10, 4)
+            self.assertEqual(2, gen._run_cmd.call_count)
+            with open(edgelist_file, 'a') as f:
+                f.write('2\t3\n')
+            gen._run_hidef([edgelist_file], second_prefix, 'leiden', 10, 3)
+            self.assertEqual(3, gen._run_cmd.call_count)
+            self.assertEqual(3, len(hidef_cache.get_entries()))
+
+            # failed runs are not cached
+            gen._run_cmd = MagicMock(return_value=(1, '', ''))
+            with self.assertRaises(CellmapsGenerateHierarchyError):
+                gen._run_hidef([edgelist_file], second_prefix, 'leiden', 20, 3)
+            self.assertEqual(3, len(hidef_cache.get_entries()))
+        finally:
+            shutil.rmtree(temp_dir)
 
+    def test_get_hidef_cache_key(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            edgelist_file = os.path.join(temp_dir, 'a.tsv')
+            with open(edgelist_file, 'w') as f:
+                f.write('0\t1\n')
+            gen = CDAPSHiDeFHierarchyGenerator(provenance_utils=MagicMock())
+            self.assertIsNone(gen._get_hidef_cache_key([edgelist_file], 'leiden', 80, 10))
+
+            hidef_cache = FileCache(os.path.join(temp_dir, 'cache'))
+            gen = CDAPSHiDeFHierarchyGenerator(provenance_utils=MagicMock(), hidef_cache=hidef_cache)
+            key = gen._get_hidef_cache_key([edgelist_file], 'leiden', 80, 10)
+            self.assertEqual(key, gen._get_hidef_cache_key([edgelist_file], 'leiden', 80.0, 10))
+            self.assertNotEqual(key, gen._get_hidef_cache_key([edgelist_file], 'louvain', 80, 10))
+            self.assertNotEqual(key, gen._get_hidef_cache_key([edgelist_file, edgelist_file], 'leiden', 80, 10))
+
+            gen._get_hidef_version = MagicMock(return_value='99.0')
+            self.assertNotEqual(key, gen._get_hidef_cache_key([edgelist_file], 'leiden', 80, 10))
+
+            # edges removed at random every run are never cached
+            gen = CDAPSHiDeFHierarchyGenerator(provenance_utils=MagicMock(), hidef_cache=hidef_cache,
+                                               bootstrap_edges=10)
+            self.assertIsNone(gen._get_hidef_cache_key([edgelist_file], 'leiden', 80, 10))
+            gen = CDAPSHiDeFHierarchyGenerator(provenance_utils=MagicMock(), hidef_cache=hidef_cache,
+                                               bootstrap_edges=10, bootstrap_seed=1)
+            self.assertIsNotNone(gen._get_hidef_cache_key([edgelist_file], 'leiden', 80, 10))
+        finally:
+            shutil.rmtree(temp_dir)
 
+    def test_run_cmd_streams_output_and_records_usage(self):
+        gen = CDAPSHiDeFHierarchyGenerator(provenance_utils=MagicMock())
+        script = ('import sys\n'
+                  'for i in range(150):\n'
+                  '    print("line " + str(i))\n'
+                  'sys.stderr.write("uhoh\\n")\n'
+                  'sys.exit(3)\n')
+        with self.assertLogs('cellmaps_generate_hierarchy.hierarchy', level='DEBUG') as logs:
+            exit_code, out, err = gen._run_cmd([sys.executable, '-c', script])
+        self.assertEqual(3, exit_code)
+        out_lines = out.split('\n')
+        self.assertEqual(CDAPSHiDeFHierarchyGenerator.CMD_OUTPUT_TAIL_LINES, len(out_lines))
+        self.assertEqual('line 149', out_lines[-1])
+        self.assertEqual('uhoh', err)
+        self.assertTrue(any(x.endswith(': line 0') for x in logs.output))
+        usage = gen.get_resource_usage()
+        self.assertEqual(1, len(usage))
+        self.assertEqual('-c', usage[0]['cmd'])
+        self.assertEqual(3, usage[0]['exit_code'])
+        self.assertTrue(usage[0]['wall_time'] >= 0)
+        if hasattr(os, 'wait4'):
+            self.assertTrue(usage[0]['peak_rss'] > 0)
+            self.assertTrue(usage[0]['user_cpu_time'] >= 0)
+            self.assertTrue(usage[0]['system_cpu_time'] >= 0)
+
+    def test_run_cmd_heartbeat(self):
+        gen = CDAPSHiDeFHierarchyGenerator(provenance_utils=MagicMock(), heartbeat_interval=0.1)
+        with self.assertLogs('cellmaps_generate_hierarchy.hierarchy', level='INFO') as logs:
+            exit_code, out, err = gen._run_cmd([sys.executable, '-c', 'import time; time.sleep(0.5)'])
+        self.assertEqual(0, exit_code)
+        self.assertTrue(any('-c still running after' in x for x in logs.output))
+
+    @unittest.skipUnless(hasattr(os, 'killpg'), 'requires process groups')
+    def test_run_cmd_timeout_kills_process_group(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            pid_file = os.path.join(temp_dir, 'pid')
+            script = ('import subprocess, sys, time\n'
+                      'p = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(60)"])\n'
+                      'open(sys.argv[1], "w").write(str(p.pid))\n'
+                      'time.sleep(60)\n')
+            gen = CDAPSHiDeFHierarchyGenerator(provenance_utils=MagicMock(), hidef_timeout=1)
+            start_time = time.time()
+            with self.assertRaises(CellmapsGenerateHierarchyError) as ce:
+                gen._run_cmd([sys.executable, '-c', script, pid_file])
+            self.assertTrue(time.time() - start_time < 30)
+            self.assertTrue('Process timed out. exit code: -15' in str(ce.exception))
+            self.assertEqual(-15, gen.get_resource_usage()[0]['exit_code'])
+            with open(pid_file) as f:
+                child_pid = int(f.read())
+            # grandchild is reparented and reaped by init once killed
+            for i in range(50):
+                try:
+                    os.kill(child_pid, 0)
+                except ProcessLookupError:
+                    break
+                time.sleep(0.1)
+            else:
+                self.fail('child process ' + str(child_pid) + ' still running')
+        finally:
+            shutil.rmtree(temp_dir)
 
@@ -9,6 +9,8 @@ import shutil
 
 import unittest
 from cellmaps_generate_hierarchy import cellmaps_generate_hierarchycmd
+from cellmaps_generate_hierarchy.cache import FileCache
+from cellmaps_generate_hierarchy.exceptions import CellmapsGenerateHierarchyError
 
 
 class TestCellmaps_generate_hierarchy(unittest.TestCase):
@@ -41,6 +43,62 @@ class TestCellmaps_generate_hierarchy(unittest.TestCase):
 
         self.assertEqual(3, res.verbose)
         self.assertEqual('hi', res.logconf)
+        self.assertIsNone(res.fold_weights)
+        self.assertEqual(cellmaps_generate_hierarchycmd.DEFAULT_CACHE_DIR, res.cache_dir)
+        self.assertEqual(cellmaps_generate_hierarchycmd.CACHE_MAX_SIZE_DEFAULT, res.cache_max_size)
+        self.assertEqual(cellmaps_generate_hierarchycmd.EMBEDDING_CACHE_MAX_SIZE_DEFAULT,
+                         res.embedding_cache_max_size)
+        self.assertFalse(res.no_cache)
+        self.assertIsNone(res.ppi_knn)
+        self.assertEqual(1, res.workers)
+        self.assertIsNone(res.ppi_edge_budget)
+        self.assertIsNone(res.ppi_avg_degree)
+        self.assertIsNone(res.ppi_reduction)
+        self.assertIsNone(res.ppi_reduced_dims)
+        self.assertIsNone(res.ppi_explained_variance)
+        self.assertEqual(0, res.ppi_reduction_seed)
+        self.assertFalse(res.ppi_reduction_report)
+        self.assertIsNone(res.bootstrap_seed)
+        self.assertFalse(res.ppi_edge_store)
+        self.assertIsNone(res.scratch_dir)
+        self.assertFalse(res.hidef_in_process)
+        self.assertEqual(86400, res.hidef_timeout)
+        self.assertEqual(0, res.bootstrap_replicates)
+        self.assertIsNone(res.sweep_algorithms)
+        self.assertIsNone(res.sweep_maxres)
+        self.assertIsNone(res.sweep_k)
+        self.assertIsNone(res.sweep_containment_thresholds)
+        self.assertIsNone(res.sweep_jaccard_thresholds)
+        self.assertEqual(1.0, res.hidef_cache_max_size)
+        self.assertFalse(res.prune_cache)
+        self.assertEqual('symmetric', res.ppi_knn_mode)
+        self.assertEqual(0, res.ppi_knn_seed)
+        self.assertEqual('exact', res.ppi_knn_index)
+
+    def test_parse_arguments_fold_weights(self):
+        res = cellmaps_generate_hierarchycmd._parse_arguments('hi',
+                                                              ['outdir',
+                                                               '--coembedding_dirs', 'foo', 'bar',
+                                                               '--fold_weights', '1', '2.5'])
+        self.assertEqual([1.0, 2.5], res.fold_weights)
+
+    def test_parse_arguments_ppi_edge_budget(self):
+        res = cellmaps_generate_hierarchycmd._parse_arguments('hi',
+                                                              ['outdir',
+                                                               '--coembedding_dirs', 'foo',
+                                                               '--ppi_edge_budget', '2e6'])
+        self.assertEqual(2000000, res.ppi_edge_budget)
+
+    def test_parse_arguments_ppi_knn(self):
+        res = cellmaps_generate_hierarchycmd._parse_arguments('hi',
+                                                              ['outdir',
+                                                               '--coembedding_dirs', 'foo',
+                                                               '--ppi_knn', '5', '10',
+                                                               '--ppi_knn_mode', 'mutual',
+                                                               '--ppi_knn_index', 'random_projection'])
+        self.assertEqual([5, 10], res.ppi_knn)
+        self.assertEqual('mutual', res.ppi_knn_mode)
+        self.assertEqual('random_projection', res.ppi_knn_index)
 
     def test_main(self):
         """Tests main function"""
@@ -56,3 +114,78 @@ class TestCellmaps_generate_hierarchy(unittest.TestCase):
             self.assertEqual(res, 2)
         finally:
             shutil.rmtree(temp_dir)
+
+    def test_check_knn_arguments(self):
+        res = cellmaps_generate_hierarchycmd._parse_arguments('hi', ['outdir', '--ppi_knn', '5',
+                                                                     '--ppi_reduction', 'pca',
+                                                                     '--ppi_reduced_dims', '4'])
+        self.assertIsNone(cellmaps_generate_hierarchycmd._check_knn_arguments(res))
+        for extra_args, flag in [(['--ppi_edge_budget', '100'], '--ppi_edge_budget'),
+                                 (['--ppi_avg_degree', '10'], '--ppi_avg_degree'),
+                                 (['--ppi_reduction_report'], '--ppi_reduction_report')]:
+            res = cellmaps_generate_hierarchycmd._parse_arguments('hi', ['outdir'] + extra_args)
+            self.assertIsNone(cellmaps_generate_hierarchycmd._check_knn_arguments(res))
+            res = cellmaps_generate_hierarchycmd._parse_arguments('hi', ['outdir', '--ppi_knn', '5'] + extra_args)
+            with self.assertRaises(CellmapsGenerateHierarchyError) as ce:
+                cellmaps_generate_hierarchycmd._check_knn_arguments(res)
+            self.assertEqual(flag + ' cannot be used with --ppi_knn', str(ce.exception))
+
+    def test_main_cache_mode(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            cache_dir = os.path.join(temp_dir, 'cache')
+            hidef_cache = FileCache(os.path.join(cache_dir, cellmaps_generate_hierarchycmd.HIDEF_CACHE_SUBDIR))
+            embedding_cache = FileCache(os.path.join(cache_dir, cellmaps_generate_hierarchycmd.EMBEDDING_CACHE_SUBDIR))
+            for cache in [hidef_cache, embedding_cache]:
+                for key in ['a', 'b']:
+                    entry_dir = cache.get_new_entry_dir()
+                    with open(os.path.join(entry_dir, 'data'), 'w') as f:
+                        f.write('x' * 10)
+                    cache.put(key, entry_dir)
+            res = cellmaps_generate_hierarchycmd.main(['myprog.py', temp_dir, '--mode', 'cache',
+                                                       '--cache_dir', cache_dir, '--skip_logging'])
+            self.assertEqual(0, res)
+            self.assertEqual(2, len(hidef_cache.get_entries()))
+            self.assertEqual(2, len(embedding_cache.get_entries()))
+
+            res = cellmaps_generate_hierarchycmd.main(['myprog.py', temp_dir, '--mode', 'cache',
+                                                       '--cache_dir', cache_dir, '--prune_cache',
+                                                       '--hidef_cache_max_size', '0', '--skip_logging'])
+            self.assertEqual(0, res)
+            self.assertEqual([], hidef_cache.get_entries())
+            self.assertEqual(2, len(embedding_cache.get_entries()))
+
+            res = cellmaps_generate_hierarchycmd.main(['myprog.py', temp_dir, '--mode', 'cache',
+                                                       '--cache_dir', cache_dir, '--prune_cache',
+                                                       '--embedding_cache_max_size', '0', '--skip_logging'])
+            self.assertEqual(0, res)
+            self.assertEqual([], embedding_cache.get_entries())
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_main_compare_mode(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            ref_file = os.path.join(temp_dir, 'ref.nodes')
+            with open(ref_file, 'w') as f:
+                f.write('Cluster0-0\t4\tA B C D\t10\n')
+                f.write('Cluster1-0\t2\tA B\t5\n')
+            other_file = os.path.join(temp_dir, 'other.nodes')
+            with open(other_file, 'w') as f:
+                f.write('Cluster0-0\t3\tA B C\t10\n')
+            outdir = os.path.join(temp_dir, 'out')
+            res = cellmaps_generate_hierarchycmd.main(['myprog.py', outdir, '--mode', 'compare',
+                                                       '--compare_nodes_files', ref_file, other_file,
+                                                       '--skip_logging'])
+            self.assertEqual(0, res)
+            with open(os.path.join(outdir, cellmaps_generate_hierarchycmd.TERM_STABILITY_FILE)) as f:
+                self.assertEqual(['term\tsize\tsupport\tmean_best_jaccard',
+                                  'Cluster0-0\t4\t1.0\t0.75',
+                                  'Cluster1-0\t2\t0.0\t0.6666666666666666'], f.read().splitlines())
+
+            # only one file
+            res = cellmaps_generate_hierarchycmd.main(['myprog.py', outdir, '--mode', 'compare',
+                                                       '--compare_nodes_files', ref_file])
+            self.assertEqual(2, res)
+        finally:
+            shutil.rmtree(temp_dir)
@@ -8,7 +8,7 @@ import shutil
 import tempfile
 import json
 import unittest
-from unittest.mock import MagicMock, ANY
+from unittest.mock import MagicMock, ANY, patch
 
 from cellmaps_utils.exceptions import CellMapsProvenanceError
 from ndex2.cx2 import CX2Network
@@ -19,6 +19,9 @@ from cellmaps_utils import constants
 from cellmaps_generate_hierarchy.exceptions import CellmapsGenerateHierarchyError
 from cellmaps_generate_hierarchy.ndexupload import NDExHierarchyUploader
 from cellmaps_generate_hierarchy.runner import CellmapsGenerateHierarchy
+from cellmaps_generate_hierarchy.ppi import GeneIndex
+from cellmaps_generate_hierarchy.ppi import EdgeTable
+from cellmaps_generate_hierarchy.ppi import PPINetworkEdges
 
 
 class TestCellmapsgeneratehierarchyrunner(unittest.TestCase):
@@ -336,6 +339,154 @@ class TestCellmapsgeneratehierarchyrunner(unittest.TestCase):
         finally:
             shutil.rmtree(temp_dir)
 
+    def test_register_ppi_edge_store(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            prov = MagicMock()
+            prov.get_default_date_format_str = MagicMock(return_value='Y')
+            prov.register_dataset = MagicMock(side_effect=['1', '2'])
+            gen = CellmapsGenerateHierarchy(outdir=temp_dir, provenance_utils=prov)
+            gen._description = 'description'
+            gen._keywords = None
+            self.assertEqual(os.path.join(temp_dir, 'ppi_edges'), gen.get_ppi_edge_store_dest_file())
+            edge_store = MagicMock()
+            edge_store.get_files = MagicMock(return_value=('/foo/ppi_edges.npy', '/foo/ppi_edges.json'))
+            self.assertEqual(['1', '2'], gen._register_ppi_edge_store(edge_store))
+            self.assertEqual('/foo/ppi_edges.npy', prov.register_dataset.call_args_list[0][1]['source_file'])
+            d_dict = prov.register_dataset.call_args_list[1][1]['data_dict']
+            self.assertEqual('ppi_edges.json PPI edge store index file', d_dict['name'])
+            self.assertEqual('json', d_dict['data-format'])
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_add_resource_usage_to_task_finish_json(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            hiergen = MagicMock()
+            hiergen.get_resource_usage = MagicMock(return_value=[])
+            gen = CellmapsGenerateHierarchy(outdir=temp_dir, hiergen=hiergen)
+            task_file = os.path.join(temp_dir, constants.TASK_FILE_PREFIX + str(gen._start_time) +
+                                     constants.TASK_FINISH_FILE_SUFFIX)
+            # no task file
+            gen._add_resource_usage_to_task_finish_json()
+            self.assertFalse(os.path.isfile(task_file))
+
+            with open(task_file, 'w') as f:
+                json.dump({'status': '0'}, f)
+            gen._add_resource_usage_to_task_finish_json()
+            with open(task_file, 'r') as f:
+                self.assertEqual({'status': '0'}, json.load(f))
+
+            usage = [{'cmd': 'hidef_finder.py', 'exit_code': 0, 'wall_time': 1.5,
+                      'user_cpu_time': 1.2, 'system_cpu_time': 0.1, 'peak_rss': 1024}]
+            hiergen.get_resource_usage = MagicMock(return_value=usage)
+            gen._add_resource_usage_to_task_finish_json()
+            with open(task_file, 'r') as f:
+                self.assertEqual({'status': '0', 'resource_usage': usage}, json.load(f))
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_add_gene_node_attributes(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            attr_file = os.path.join(temp_dir, 'attrs.tsv')
+            with open(attr_file, 'w') as f:
+                f.write('name\tbait\trepresents\n')
+                f.write('B\ttrue\tensembl:ENSG1\n')
+                f.write('Z\ttrue\tensembl:ENSG2\n')
+                f.write('A\t\tfoo\n')
+                f.write('D\ttrue\tbar\n')
+            for gene_index in [None, GeneIndex(['A', 'B', 'C', 'D'])]:
+                parent_ppi = CX2Network()
+                parent_ppi.add_node(0, attributes={'name': 'A'})
+                parent_ppi.add_node(1, attributes={'name': 'B'})
+                parent_ppi.add_node(2, attributes={'name': 'C'})
+                gen = CellmapsGenerateHierarchy(outdir=temp_dir, gene_node_attributes=[attr_file])
+                res = gen._add_gene_node_attributes(parent_ppi, gene_index=gene_index)
+                nodes = res.get_nodes()
+                self.assertEqual(3, len(nodes))
+                self.assertEqual('foo', nodes[0]['v']['represents'])
+                self.assertFalse('bait' in nodes[0]['v'])
+                self.assertEqual('ensembl:ENSG1', nodes[1]['v']['represents'])
+                self.assertEqual('https://www.proteinatlas.org/ENSG1/subcellular',
+                                 nodes[1]['v']['representsurl'])
+                self.assertFalse('represents' in nodes[2]['v'])
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_get_shared_gene_index(self):
+        gene_index = GeneIndex(['A', 'B', 'C'])
+        edge_table = EdgeTable(gene_index, [0, 1], [1, 2])
+        first = PPINetworkEdges(edge_table.head(1), name='first')
+        second = PPINetworkEdges(edge_table, name='second')
+        self.assertIsNone(CellmapsGenerateHierarchy._get_shared_gene_index([]))
+        self.assertIs(gene_index, CellmapsGenerateHierarchy._get_shared_gene_index([first, second]))
+        other = PPINetworkEdges(EdgeTable(GeneIndex(['A', 'B', 'C']), [0], [2]), name='other')
+        self.assertIsNone(CellmapsGenerateHierarchy._get_shared_gene_index([first, other]))
+
+    def test_run_with_ppi_edge_store_and_gene_node_attributes(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            attr_file = os.path.join(temp_dir, 'attrs.tsv')
+            with open(attr_file, 'w') as f:
+                f.write('name\trepresents\n')
+                f.write('A\tensembl:ENSG1\n')
+                f.write('C\tfoo\n')
+                f.write('Z\tbar\n')
+
+            # gene ids are not in name order so lookup by the wrong index would mislabel nodes
+            edge_table = EdgeTable(GeneIndex(['D', 'C', 'B', 'A']), [0, 1, 3], [1, 3, 2], weights=[0.9, 0.8, 0.7])
+            ppigen = MagicMock()
+            ppigen.get_next_network_edges = MagicMock(return_value=[PPINetworkEdges(edge_table.head(n),
+                                                                                    name='net' + str(n),
+                                                                                    attributes={'cutoff': str(n)})
+                                                                    for n in [2, 3]])
+
+            hier_network_edges = []
+
+            def get_hierarchy(prefix_paths, algorithm, maxres, k, network_edges=None):
+                hier_network_edges.extend(network_edges)
+                parent_ppi = CX2Network()
+                for node_id, node_obj in network_edges[-1].get_network().get_nodes():
+                    parent_ppi.add_node(node_id, attributes={'name': node_obj['n']})
+                return MagicMock(), parent_ppi
+
+            hiergen = MagicMock()
+            hiergen.get_hierarchy = MagicMock(side_effect=get_hierarchy)
+            hiergen.get_generated_dataset_ids = MagicMock(return_value=[])
+
+            run_dir = os.path.join(temp_dir, 'run')
+            gen = CellmapsGenerateHierarchy(outdir=run_dir, ppigen=ppigen, hiergen=hiergen,
+                                            gene_node_attributes=[attr_file], ppi_edge_store=True)
+            for method in ['generate_readme', '_update_provenance_fields', '_create_rocrate', '_register_software',
+                           '_update_ppi_with_hierarchy_attributes', '_write_hierarchy_network',
+                           '_register_hierarchy_network', '_register_hidef_output_with_gene_names',
+                           '_register_computation']:
+                setattr(gen, method, MagicMock())
+            gen._register_ppi_edge_store = MagicMock(return_value=[])
+            gen._write_and_register_hierarchy_parent_network = MagicMock(return_value='parent')
+            gen._add_gene_node_attributes = MagicMock(wraps=gen._add_gene_node_attributes)
+            with patch('cellmaps_generate_hierarchy.runner.HierarchyToHiDeFConverter') as converter:
+                converter.return_value.generate_hidef_files = MagicMock(return_value=('nodes', 'edges'))
+                self.assertEqual(0, gen.run())
+
+            # hierarchy generator got the memory mapped networks of the edge store
+            self.assertEqual(2, len(hier_network_edges))
+            store_gene_index = hier_network_edges[0].get_edge_table().get_gene_index()
+            self.assertEqual(['D', 'C', 'B', 'A'], store_gene_index.get_names().tolist())
+            self.assertIs(store_gene_index, gen._add_gene_node_attributes.call_args[1]['gene_index'])
+
+            nodes = gen._update_ppi_with_hierarchy_attributes.call_args[1]['parent_ppi'].get_nodes()
+            self.assertEqual({0: 'D', 1: 'C', 2: 'B', 3: 'A'}, {node_id: node_obj['v']['name']
+                                                                for node_id, node_obj in nodes.items()})
+            self.assertEqual('ensembl:ENSG1', nodes[3]['v']['represents'])
+            self.assertEqual('https://www.proteinatlas.org/ENSG1/subcellular', nodes[3]['v']['representsurl'])
+            self.assertEqual('foo', nodes[1]['v']['represents'])
+            self.assertFalse('represents' in nodes[0]['v'])
+            self.assertFalse('represents' in nodes[2]['v'])
+        finally:
+            shutil.rmtree(temp_dir)
+
     # def test_register_hierarchy_network(self):
 
 
@@ -4,13 +4,21 @@
 """Tests for `CosineSimilarityPPIGenerator`."""
 
 import os
+import json
 
 import shutil
 import tempfile
 import unittest
+import numpy as np
+import pandas as pd
+from unittest.mock import patch
 from cellmaps_utils import constants
+from cellmaps_utils import music_utils
+from cellmaps_generate_hierarchy.exceptions import CellmapsGenerateHierarchyError
 from cellmaps_generate_hierarchy.runner import CellmapsGenerateHierarchy
 from cellmaps_generate_hierarchy.ppi import CosineSimilarityPPIGenerator
+from cellmaps_generate_hierarchy.ppi import EdgeBuffer
+from cellmaps_generate_hierarchy.cache import FileCache
 
 
 class TestCosineSimilarityPPIGenerator(unittest.TestCase):
@@ -42,3 +50,423 @@ class TestCosineSimilarityPPIGenerator(unittest.TestCase):
             self.assertIsNone(next(itr, None))
         finally:
             shutil.rmtree(temp_dir)
+
+    def write_random_embedding(self, embeddingdir, num_rows=25, num_cols=8, seed=1, shuffle=False):
+        rng = np.random.default_rng(seed)
+        z = pd.DataFrame(rng.normal(size=(num_rows, num_cols)),
+                         index=['G' + str(i) for i in range(num_rows)])
+        if shuffle:
+            z = z.sample(frac=1, random_state=seed)
+        z.to_csv(os.path.join(embeddingdir, constants.CO_EMBEDDING_FILE), sep='\t')
+        return z
+
+    def test_constructor_invalid_tile_size(self):
+        try:
+            CosineSimilarityPPIGenerator(embeddingdirs=['foo'], tile_size=0)
+            self.fail('Expected exception')
+        except CellmapsGenerateHierarchyError as e:
+            self.assertTrue('tile_size' in str(e))
+
+    def test_constructor_invalid_workers(self):
+        try:
+            CosineSimilarityPPIGenerator(embeddingdirs=['foo'], workers=0)
+            self.fail('Expected exception')
+        except CellmapsGenerateHierarchyError as e:
+            self.assertTrue('workers' in str(e))
+
+    def test_constructor_invalid_edge_budget(self):
+        for kwargs, expected in [({'edge_budget': 10, 'avg_degree': 2}, 'Only one of'),
+                                 ({'edge_budget': 0}, 'edge_budget'),
+                                 ({'avg_degree': 0}, 'avg_degree')]:
+            try:
+                CosineSimilarityPPIGenerator(embeddingdirs=['foo'], **kwargs)
+                self.fail('Expected exception')
+            except CellmapsGenerateHierarchyError as e:
+                self.assertTrue(expected in str(e))
+
+    def test_get_num_edges(self):
+        gen = CosineSimilarityPPIGenerator(embeddingdirs=['foo'], cutoffs=[0.05, 0.1])
+        self.assertEqual(5, gen._get_num_edges(0.05, 100))
+        self.assertEqual(10, gen._get_max_num_edges(100))
+        self.assertEqual(100, gen._get_num_proteins(gen._get_num_pairs(100)))
+
+        gen = CosineSimilarityPPIGenerator(embeddingdirs=['foo'], cutoffs=[0.05, 0.1], edge_budget=1000)
+        self.assertEqual(500, gen._get_num_edges(0.05, 1000000))
+        self.assertEqual(1000, gen._get_max_num_edges(1000000))
+        self.assertEqual(100, gen._get_max_num_edges(100))
+
+        gen = CosineSimilarityPPIGenerator(embeddingdirs=['foo'], cutoffs=[0.05, 0.1], avg_degree=4)
+        self.assertEqual(200, gen._get_max_num_edges(gen._get_num_pairs(100)))
+        self.assertEqual(100, gen._get_num_edges(0.05, gen._get_num_pairs(100)))
+
+    def test_edge_budget_networks(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            self.write_random_embedding(temp_dir, num_rows=25)
+            gen = CosineSimilarityPPIGenerator(embeddingdirs=[temp_dir], cutoffs=[0.05, 0.1],
+                                               edge_budget=40)
+            nets = [n for n in gen.get_next_network()]
+            self.assertEqual([20, 40], [len(n.get_edges()) for n in nets])
+            self.assertEqual(['20', '40'], [n.get_network_attribute('edge_budget')['v'] for n in nets])
+            self.assertAlmostEqual(40 / 300.0, float(nets[1].get_network_attribute('cutoff')['v']))
+            self.assertEqual('parent interactome with 40 edges', nets[1].get_name())
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_edge_buffer(self):
+        buf = EdgeBuffer()
+        self.assertEqual(0, len(buf))
+        sources, targets, weights = buf.get_edges()
+        self.assertEqual(0, len(sources))
+        buf.append([0, 1], [2, 3], [0.5, 0.25])
+        buf.append([4], [5], [1.0])
+        self.assertEqual(3, len(buf))
+        sources, targets, weights = buf.get_edges()
+        self.assertEqual([0, 1, 4], sources.tolist())
+        self.assertEqual([2, 3, 5], targets.tolist())
+        self.assertEqual(np.int32, sources.dtype)
+        self.assertEqual(np.float32, weights.dtype)
+
+        sources, targets, weights = buf.get_sorted_edges()
+        self.assertEqual([4, 0, 1], sources.tolist())
+        self.assertEqual([1.0, 0.5, 0.25], weights.tolist())
+
+        top = buf.get_top_edges(2)
+        self.assertEqual(2, len(top))
+        sources, targets, weights = top.get_sorted_edges()
+        self.assertEqual([4, 0], sources.tolist())
+        self.assertEqual(0, len(buf.get_top_edges(0)))
+
+    def test_tiled_similarity_matches_full_matrix(self):
+        temp_dirs = [tempfile.mkdtemp(), tempfile.mkdtemp()]
+        try:
+            folds = []
+            for fold, temp_dir in enumerate(temp_dirs):
+                folds.append(self.write_random_embedding(temp_dir, seed=fold + 1,
+                                                         shuffle=fold > 0))
+            index = folds[0].index.values
+            sim_mats = [music_utils.cosine_similarity_scaled(z.loc[index]).values for z in folds]
+            expected = np.array(sim_mats).mean(axis=0)
+
+            for tile_size in [1, 4, 7, 100]:
+                gen = CosineSimilarityPPIGenerator(embeddingdirs=temp_dirs, cutoffs=[1.0],
+                                                   tile_size=tile_size)
+                df, num_pairs = gen._get_ppi_dataframe()
+                self.assertEqual(25 * 24 / 2, num_pairs)
+                self.assertEqual(num_pairs, len(df))
+                weights = df[constants.WEIGHTED_PPI_EDGELIST_WEIGHT_COL].values
+                self.assertTrue(np.all(np.diff(weights) <= 0))
+                pos = {name: i for i, name in enumerate(index)}
+                for _, row in df.iterrows():
+                    i = pos[row[constants.PPI_EDGELIST_GENEA_COL]]
+                    j = pos[row[constants.PPI_EDGELIST_GENEB_COL]]
+                    self.assertLess(i, j)
+                    self.assertAlmostEqual(expected[i, j],
+                                           row[constants.WEIGHTED_PPI_EDGELIST_WEIGHT_COL],
+                                           places=5)
+        finally:
+            for temp_dir in temp_dirs:
+                shutil.rmtree(temp_dir)
+
+    def test_fold_weights(self):
+        temp_dirs = [tempfile.mkdtemp(), tempfile.mkdtemp()]
+        try:
+            folds = []
+            for fold, temp_dir in enumerate(temp_dirs):
+                folds.append(self.write_random_embedding(temp_dir, num_rows=10, seed=fold + 1))
+            index = folds[0].index.values
+            sim_mats = [music_utils.cosine_similarity_scaled(z).values for z in folds]
+            expected = 0.25 * sim_mats[0] + 0.75 * sim_mats[1]
+
+            gen = CosineSimilarityPPIGenerator(embeddingdirs=temp_dirs, cutoffs=[1.0],
+                                               tile_size=3, fold_weights=[1, 3])
+            df, num_pairs = gen._get_ppi_dataframe()
+            pos = {name: i for i, name in enumerate(index)}
+            for _, row in df.iterrows():
+                self.assertAlmostEqual(expected[pos[row[constants.PPI_EDGELIST_GENEA_COL]],
+                                                pos[row[constants.PPI_EDGELIST_GENEB_COL]]],
+                                       row[constants.WEIGHTED_PPI_EDGELIST_WEIGHT_COL],
+                                       places=5)
+        finally:
+            for temp_dir in temp_dirs:
+                shutil.rmtree(temp_dir)
+
+    def test_invalid_fold_weights(self):
+        for fold_weights in [[1.0], [1.0, -1.0], [0, 0]]:
+            try:
+                CosineSimilarityPPIGenerator(embeddingdirs=['a', 'b'], fold_weights=fold_weights)
+                self.fail('Expected exception')
+            except CellmapsGenerateHierarchyError as e:
+                self.assertTrue('weights' in str(e))
+
+    def test_top_fraction_matches_full_sort(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            self.write_random_embedding(temp_dir, num_rows=40)
+            gen = CosineSimilarityPPIGenerator(embeddingdirs=[temp_dir], cutoffs=[1.0])
+            full_df, num_pairs = gen._get_ppi_dataframe()
+            for tile_size in [3, 16]:
+                gen = CosineSimilarityPPIGenerator(embeddingdirs=[temp_dir], cutoffs=[0.01, 0.1],
+                                                   tile_size=tile_size)
+                df, top_num_pairs = gen._get_ppi_dataframe()
+                self.assertEqual(num_pairs, top_num_pairs)
+                self.assertEqual(78, len(df))
+                self.assertTrue(np.allclose(full_df[constants.WEIGHTED_PPI_EDGELIST_WEIGHT_COL].values[:78],
+                                            df[constants.WEIGHTED_PPI_EDGELIST_WEIGHT_COL].values,
+                                            atol=1e-6))
+
+            nets = list(gen.get_next_network())
+            self.assertEqual(2, len(nets))
+            self.assertEqual(8, len(nets[0].get_edges()))
+            self.assertEqual(78, len(nets[1].get_edges()))
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_binary_embedding_formats(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            tsv_dir = os.path.join(temp_dir, 'tsv')
+            os.makedirs(tsv_dir)
+            z = self.write_random_embedding(tsv_dir, num_rows=12)
+            expected_df, _ = CosineSimilarityPPIGenerator(embeddingdirs=[tsv_dir],
+                                                          cutoffs=[1.0])._get_ppi_dataframe()
+
+            npy_dir = os.path.join(temp_dir, 'npy')
+            os.makedirs(npy_dir)
+            np.save(os.path.join(npy_dir, 'coembedding_emd.npy'), z.values.astype(np.float32))
+            with open(os.path.join(npy_dir, 'coembedding_emd' +
+                                   CosineSimilarityPPIGenerator.IDS_SUFFIX), 'w') as f:
+                f.write('\n'.join(z.index.values) + '\n')
+
+            npz_dir = os.path.join(temp_dir, 'npz')
+            os.makedirs(npz_dir)
+            # rows in different order, must be reordered to match first fold
+            np.savez(os.path.join(npz_dir, 'coembedding_emd.npz'),
+                     embedding=z.values[::-1], ids=z.index.values[::-1].astype(str))
+
+            gen = CosineSimilarityPPIGenerator(embeddingdirs=[npy_dir])
+            self.assertEqual(os.path.join(npy_dir, 'coembedding_emd.npy'),
+                             gen._get_embedding_file(npy_dir))
+            ids, values = gen._load_embedding(gen._get_embedding_file(npy_dir))
+            self.assertTrue(isinstance(values, np.memmap))
+            self.assertEqual(z.index.values.tolist(), ids.tolist())
+
+            for embeddingdirs in [[npy_dir], [npy_dir, npz_dir]]:
+                gen = CosineSimilarityPPIGenerator(embeddingdirs=embeddingdirs, cutoffs=[1.0])
+                df, _ = gen._get_ppi_dataframe()
+                self.assertEqual(expected_df[constants.PPI_EDGELIST_GENEA_COL].values.tolist(),
+                                 df[constants.PPI_EDGELIST_GENEA_COL].values.tolist())
+                self.assertTrue(np.allclose(expected_df[constants.WEIGHTED_PPI_EDGELIST_WEIGHT_COL].values,
+                                            df[constants.WEIGHTED_PPI_EDGELIST_WEIGHT_COL].values,
+                                            atol=1e-6))
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_missing_ids_file(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            np.save(os.path.join(temp_dir, 'coembedding_emd.npy'), np.ones((2, 2)))
+            gen = CosineSimilarityPPIGenerator(embeddingdirs=[temp_dir])
+            gen._get_ppi_dataframe()
+            self.fail('Expected exception')
+        except CellmapsGenerateHierarchyError as e:
+            self.assertTrue('IDs file' in str(e))
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_tsv_embedding_cached_conversion(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            cache = FileCache(os.path.join(temp_dir, 'cache'))
+            z = self.write_random_embedding(temp_dir, num_rows=6)
+            gen = CosineSimilarityPPIGenerator(embeddingdirs=[temp_dir],
+                                               embedding_cache=cache)
+            embeddingfile = gen._get_embedding_file(temp_dir)
+            ids, values = gen._load_embedding(embeddingfile)
+            self.assertFalse(isinstance(values, np.memmap))
+            entries = cache.get_entries()
+            self.assertEqual(1, len(entries))
+            self.assertEqual(sorted([CosineSimilarityPPIGenerator.EMBEDDING_CACHE_FILE,
+                                     'embedding' + CosineSimilarityPPIGenerator.IDS_SUFFIX]),
+                             sorted(os.listdir(cache.get(entries[0]['key']))))
+
+            ids, values = gen._load_embedding(embeddingfile)
+            self.assertTrue(isinstance(values, np.memmap))
+            self.assertEqual(z.index.values.tolist(), ids.tolist())
+            self.assertTrue(np.allclose(z.values, values))
+
+            # changing the file invalidates cached copy
+            z.iloc[:3].to_csv(embeddingfile, sep='\t')
+            os.utime(embeddingfile, ns=(0, 0))
+            ids, values = gen._load_embedding(embeddingfile)
+            self.assertEqual(3, len(ids))
+            self.assertEqual(2, len(cache.get_entries()))
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_tsv_embedding_cache_evicts_least_recently_used(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            embeddingdirs = [os.path.join(temp_dir, 'a'), os.path.join(temp_dir, 'b')]
+            for embeddingdir in embeddingdirs:
+                os.makedirs(embeddingdir)
+                self.write_random_embedding(embeddingdir, num_rows=6)
+            # room for only one converted embedding
+            cache = FileCache(os.path.join(temp_dir, 'cache'), max_size=500)
+            gen = CosineSimilarityPPIGenerator(embeddingdirs=embeddingdirs, embedding_cache=cache)
+            keys = []
+            for embeddingdir in embeddingdirs:
+                embeddingfile = gen._get_embedding_file(embeddingdir)
+                gen._load_embedding(embeddingfile)
+                keys.append(gen._get_embedding_cache_key(embeddingfile))
+            self.assertEqual([keys[1]], [e['key'] for e in cache.get_entries()])
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_folds_with_different_proteins(self):
+        temp_dirs = [tempfile.mkdtemp(), tempfile.mkdtemp()]
+        try:
+            self.write_random_embedding(temp_dirs[0], num_rows=6)
+            self.write_random_embedding(temp_dirs[1], num_rows=5)
+            gen = CosineSimilarityPPIGenerator(embeddingdirs=temp_dirs)
+            gen._get_ppi_dataframe()
+            self.fail('Expected exception')
+        except CellmapsGenerateHierarchyError as e:
+            self.assertTrue('Discrepancy in protein sets' in str(e))
+        finally:
+            for temp_dir in temp_dirs:
+                shutil.rmtree(temp_dir)
+
+    def test_similarity_cache(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            embeddingdirs = [os.path.join(temp_dir, 'fold1'), os.path.join(temp_dir, 'fold2')]
+            for fold, embeddingdir in enumerate(embeddingdirs):
+                os.makedirs(embeddingdir)
+                self.write_random_embedding(embeddingdir, seed=fold + 1)
+            cache = FileCache(os.path.join(temp_dir, 'cache'))
+
+            gen = CosineSimilarityPPIGenerator(embeddingdirs=embeddingdirs, cutoffs=[0.1, 0.2],
+                                               similarity_cache=cache)
+            expected = [x for x in gen.get_next_network()]
+            self.assertEqual(1, len(cache.get_entries()))
+
+            # cache hit skips similarity computation and allows different cutoffs
+            gen = CosineSimilarityPPIGenerator(embeddingdirs=embeddingdirs, cutoffs=[0.2, 0.1],
+                                               similarity_cache=cache)
+            with patch.object(CosineSimilarityPPIGenerator, '_get_ppi_edge_table',
+                              side_effect=AssertionError('should not be called')):
+                res = [x for x in gen.get_next_network()]
+            self.assertEqual(len(expected[1].get_edges()), len(res[0].get_edges()))
+            self.assertEqual(len(expected[0].get_edges()), len(res[1].get_edges()))
+            for exp_id, exp_edge in expected[0].get_edges():
+                edge = res[1].get_edge(exp_id)
+                self.assertEqual(exp_edge['s'], edge['s'])
+                self.assertEqual(exp_edge['t'], edge['t'])
+
+            # larger cutoff than what is cached is a miss
+            gen = CosineSimilarityPPIGenerator(embeddingdirs=embeddingdirs, cutoffs=[0.5],
+                                               similarity_cache=cache)
+            with patch.object(CosineSimilarityPPIGenerator, '_get_ppi_edge_table',
+                              wraps=gen._get_ppi_edge_table) as mock_df:
+                [x for x in gen.get_next_network()]
+                mock_df.assert_called_once()
+            self.assertEqual(1, len(cache.get_entries()))
+
+            # fold order is part of the key
+            gen = CosineSimilarityPPIGenerator(embeddingdirs=list(reversed(embeddingdirs)),
+                                               cutoffs=[0.1], similarity_cache=cache)
+            [x for x in gen.get_next_network()]
+            self.assertEqual(2, len(cache.get_entries()))
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_parallel_matches_serial(self):
+        temp_dirs = [tempfile.mkdtemp(), tempfile.mkdtemp()]
+        try:
+            for fold, temp_dir in enumerate(temp_dirs):
+                self.write_random_embedding(temp_dir, num_rows=30, seed=fold + 1, shuffle=fold > 0)
+            for cutoffs in [[1.0], [0.1]]:
+                serial = CosineSimilarityPPIGenerator(embeddingdirs=temp_dirs, cutoffs=cutoffs,
+                                                      tile_size=7, fold_weights=[1, 2])
+                parallel = CosineSimilarityPPIGenerator(embeddingdirs=temp_dirs, cutoffs=cutoffs,
+                                                        tile_size=7, fold_weights=[1, 2], workers=2)
+                expected, expected_num_pairs = serial._get_ppi_dataframe()
+                df, num_pairs = parallel._get_ppi_dataframe()
+                self.assertEqual(expected_num_pairs, num_pairs)
+                pd.testing.assert_frame_equal(expected, df)
+        finally:
+            for temp_dir in temp_dirs:
+                shutil.rmtree(temp_dir)
+
+    def test_constructor_invalid_reduction(self):
+        for kwargs, expected in [({'reduction': 'foo'}, 'Invalid reduction'),
+                                 ({'reduction': 'pca'}, 'reduced_dims must be set'),
+                                 ({'reduction': 'random_projection', 'explained_variance': 0.9},
+                                  'reduced_dims must be set'),
+                                 ({'reduction': 'pca', 'reduced_dims': 0}, 'reduced_dims'),
+                                 ({'reduction': 'pca', 'explained_variance': 1.5}, 'explained_variance')]:
+            try:
+                CosineSimilarityPPIGenerator(embeddingdirs=['foo'], **kwargs)
+                self.fail('Expected exception')
+            except CellmapsGenerateHierarchyError as e:
+                self.assertTrue(expected in str(e))
+
+    def test_pca_reduction_of_low_rank_embedding(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            rng = np.random.default_rng(3)
+            z = pd.DataFrame(rng.normal(size=(30, 3)) @ rng.normal(size=(3, 10)),
+                             index=['G' + str(i) for i in range(30)])
+            z.to_csv(os.path.join(temp_dir, constants.CO_EMBEDDING_FILE), sep='\t')
+            expected, _ = CosineSimilarityPPIGenerator(embeddingdirs=[temp_dir],
+                                                       cutoffs=[0.2])._get_ppi_dataframe()
+
+            report_file = os.path.join(temp_dir, 'report.json')
+            gen = CosineSimilarityPPIGenerator(embeddingdirs=[temp_dir], cutoffs=[0.1, 0.2],
+                                               reduction=CosineSimilarityPPIGenerator.PCA_REDUCTION,
+                                               explained_variance=0.999,
+                                               reduction_report_file=report_file)
+            df, num_pairs = gen._get_ppi_dataframe()
+            self.assertEqual(expected[constants.PPI_EDGELIST_GENEA_COL].tolist(),
+                             df[constants.PPI_EDGELIST_GENEA_COL].tolist())
+            self.assertEqual(expected[constants.PPI_EDGELIST_GENEB_COL].tolist(),
+                             df[constants.PPI_EDGELIST_GENEB_COL].tolist())
+            self.assertTrue(np.allclose(expected[constants.WEIGHTED_PPI_EDGELIST_WEIGHT_COL].values,
+                                        df[constants.WEIGHTED_PPI_EDGELIST_WEIGHT_COL].values, atol=1e-5))
+            with open(report_file, 'r') as f:
+                report = json.load(f)
+            self.assertEqual('pca', report['reduction'])
+            self.assertEqual(10, report['folds'][0]['original_dims'])
+            self.assertEqual(3, report['folds'][0]['reduced_dims'])
+            self.assertGreaterEqual(report['folds'][0]['explained_variance'], 0.999)
+            self.assertEqual([0.1, 0.2], [c['cutoff'] for c in report['cutoffs']])
+            self.assertEqual([44, 87], [c['edges'] for c in report['cutoffs']])
+            self.assertEqual([1.0, 1.0], [c['overlap'] for c in report['cutoffs']])
+            self.assertLess(report['max_weight_difference'], 1e-5)
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_random_projection_reduction(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            self.write_random_embedding(temp_dir, num_rows=30, num_cols=64)
+            report_file = os.path.join(temp_dir, 'report.json')
+            results = []
+            for seed in [1, 1, 2]:
+                gen = CosineSimilarityPPIGenerator(embeddingdirs=[temp_dir], cutoffs=[0.2],
+                                                   reduction=CosineSimilarityPPIGenerator.RANDOM_PROJECTION_REDUCTION,
+                                                   reduced_dims=16, random_seed=seed,
+                                                   reduction_report_file=report_file)
+                df, _ = gen._get_ppi_dataframe()
+                results.append(df)
+            pd.testing.assert_frame_equal(results[0], results[1])
+            self.assertFalse(results[0].equals(results[2]))
+            with open(report_file, 'r') as f:
+                report = json.load(f)
+            self.assertEqual(2, report['random_seed'])
+            self.assertEqual(16, report['folds'][0]['reduced_dims'])
+            self.assertEqual(87, report['cutoffs'][0]['edges'])
+            self.assertGreater(report['cutoffs'][0]['overlap'], 0.3)
+        finally:
+            shutil.rmtree(temp_dir)
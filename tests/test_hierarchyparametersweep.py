@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `HierarchyParameterSweep`."""
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import MagicMock
+
+import pandas as pd
+
+from cellmaps_generate_hierarchy.exceptions import CellmapsGenerateHierarchyError
+from cellmaps_generate_hierarchy.hierarchy import CDAPSHiDeFHierarchyGenerator
+from cellmaps_generate_hierarchy.ppi import EdgeTable
+from cellmaps_generate_hierarchy.ppi import GeneIndex
+from cellmaps_generate_hierarchy.ppi import PPINetworkEdges
+from cellmaps_generate_hierarchy.sweep import HierarchyParameterSweep
+
+
+class TestHierarchyParameterSweep(unittest.TestCase):
+    """Tests for `HierarchyParameterSweep`."""
+
+    def setUp(self):
+        """Set up test fixtures, if any."""
+        self._temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """Tear down test fixtures, if any."""
+        shutil.rmtree(self._temp_dir)
+
+    def _get_ppigen(self):
+        gene_index = GeneIndex(['G' + str(i) for i in range(80)])
+        edge_table = EdgeTable(gene_index, list(range(79)), list(range(1, 80)))
+        ppigen = MagicMock()
+        ppigen.get_next_network_edges = MagicMock(return_value=iter(
+            [PPINetworkEdges(edge_table.head(40), name='small', attributes={'cutoff': 0.05}),
+             PPINetworkEdges(edge_table, name='large', attributes={'cutoff': 0.1})]))
+        return ppigen
+
+    def test_constructor(self):
+        with self.assertRaises(CellmapsGenerateHierarchyError):
+            HierarchyParameterSweep()
+        sweep = HierarchyParameterSweep(outdir=self._temp_dir)
+        self.assertEqual([('leiden', 80, 10)], sweep.get_hidef_parameters())
+        self.assertEqual([(0.75, 0.9)], sweep.get_refiner_parameters())
+
+    def test_run_outdir_exists(self):
+        sweep = HierarchyParameterSweep(outdir=self._temp_dir)
+        with self.assertRaises(CellmapsGenerateHierarchyError):
+            sweep.run()
+
+    def test_run(self):
+        data_dir = os.path.join(os.path.dirname(__file__), 'data')
+        mockprov = MagicMock()
+        hiergen = CDAPSHiDeFHierarchyGenerator(provenance_utils=mockprov)
+        hidef_calls = []
+
+        def fake_hidef(edgelist_files, outputprefix, algorithm, maxres, k, cwd=None):
+            hidef_calls.append((edgelist_files, outputprefix, algorithm, maxres, k, cwd))
+            for suffix in ['.nodes', '.edges']:
+                shutil.copyfile(os.path.join(data_dir, 'hidef_output' + suffix), outputprefix + suffix)
+
+        hiergen._run_hidef = MagicMock(side_effect=fake_hidef)
+        outdir = os.path.join(self._temp_dir, 'out')
+        sweep = HierarchyParameterSweep(outdir=outdir, ppigen=self._get_ppigen(), hiergen=hiergen,
+                                        maxres_values=[10, 20], k_values=[5],
+                                        containment_thresholds=[0.75, 0.8],
+                                        jaccard_thresholds=[0.9],
+                                        workers=2)
+        self.assertEqual(0, sweep.run())
+
+        # edge lists written once, not registered
+        edgelist_dir = os.path.join(outdir, HierarchyParameterSweep.EDGELIST_DIR)
+        self.assertEqual(2, len([f for f in os.listdir(edgelist_dir)
+                                 if f.endswith(CDAPSHiDeFHierarchyGenerator.EDGELIST_TSV)]))
+        mockprov.register_dataset.assert_not_called()
+
+        # HiDeF run once per HiDeF parameter combination
+        self.assertEqual(2, len(hidef_calls))
+        for edgelist_files, outputprefix, algorithm, maxres, k, cwd in hidef_calls:
+            self.assertEqual(2, len(edgelist_files))
+            self.assertEqual(os.path.dirname(outputprefix), cwd)
+            self.assertEqual('leiden', algorithm)
+            self.assertEqual(5, k)
+        self.assertEqual([10, 20], sorted([c[3] for c in hidef_calls]))
+
+        summary = pd.read_csv(os.path.join(outdir, HierarchyParameterSweep.SUMMARY_FILE), sep='\t')
+        self.assertEqual(['sweep_0', 'sweep_1', 'sweep_2', 'sweep_3'], summary['sweep_dir'].tolist())
+        self.assertEqual(['hidef_0', 'hidef_0', 'hidef_1', 'hidef_1'], summary['hidef_dir'].tolist())
+        self.assertEqual([10, 10, 20, 20], summary['maxres'].tolist())
+        self.assertEqual([0.75, 0.8, 0.75, 0.8], summary['containment_threshold'].tolist())
+        self.assertEqual([2, 2, 2, 2], summary['hidef_terms'].tolist())
+        for idx, row in summary.iterrows():
+            sweep_dir = os.path.join(outdir, row['sweep_dir'])
+            self.assertTrue(os.path.isfile(os.path.join(sweep_dir, 'hidef_output.pruned.edges')))
+            with open(os.path.join(sweep_dir, 'hidef_output.pruned.nodes')) as f:
+                lines = f.read().splitlines()
+            self.assertEqual(row['terms'], len(lines))
+            with open(os.path.join(sweep_dir, CDAPSHiDeFHierarchyGenerator.TRANSLATED_HIDEF_OUT_PREFIX +
+                                   '.pruned.nodes')) as f:
+                name_lines = f.read().splitlines()
+            for line, name_line in zip(lines, name_lines):
+                ids = line.split('\t')[2].split(' ')
+                names = name_line.split('\t')[2].split(' ')
+                self.assertEqual(['G' + i for i in ids], names)
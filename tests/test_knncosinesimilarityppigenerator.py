@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `KNNCosineSimilarityPPIGenerator`."""
+
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+from cellmaps_utils import constants
+from cellmaps_generate_hierarchy.exceptions import CellmapsGenerateHierarchyError
+from cellmaps_generate_hierarchy.ppi import KNNCosineSimilarityPPIGenerator
+
+
+class TestKNNCosineSimilarityPPIGenerator(unittest.TestCase):
+    """Tests for `KNNCosineSimilarityPPIGenerator`."""
+
+    def setUp(self):
+        """Set up test fixtures, if any."""
+        self._temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """Tear down test fixtures, if any."""
+        shutil.rmtree(self._temp_dir)
+
+    def write_random_embedding(self, num_rows=40, num_cols=8, seed=1):
+        embeddingdir = os.path.join(self._temp_dir, 'fold' + str(seed))
+        os.makedirs(embeddingdir)
+        rng = np.random.default_rng(seed)
+        z = pd.DataFrame(rng.normal(size=(num_rows, num_cols)),
+                         index=['G' + str(i) for i in range(num_rows)])
+        z.to_csv(os.path.join(embeddingdir, constants.CO_EMBEDDING_FILE), sep='\t')
+        return embeddingdir, z
+
+    def get_expected_neighbors(self, folds, k):
+        sims = np.zeros((len(folds[0]), len(folds[0])))
+        for z in folds:
+            x = z.values / np.linalg.norm(z.values, axis=1, keepdims=True)
+            sims += x @ x.T / len(folds)
+        np.fill_diagonal(sims, -np.inf)
+        return sims, np.argsort(-sims, axis=1)[:, :k]
+
+    def test_constructor_invalid_args(self):
+        for kwargs, expected in [({'k_values': []}, 'k_values'),
+                                 ({'k_values': [0, 5]}, 'k_values'),
+                                 ({'mode': 'foo'}, 'Invalid mode'),
+                                 ({'index': 'foo'}, 'Invalid index'),
+                                 ({'num_tables': 0}, 'num_tables')]:
+            try:
+                KNNCosineSimilarityPPIGenerator(embeddingdirs=['foo'], **kwargs)
+                self.fail('Expected exception')
+            except CellmapsGenerateHierarchyError as e:
+                self.assertTrue(expected in str(e))
+
+    def test_exact_neighbors(self):
+        folds = []
+        embeddingdirs = []
+        for seed in [1, 2]:
+            embeddingdir, z = self.write_random_embedding(seed=seed)
+            embeddingdirs.append(embeddingdir)
+            folds.append(z)
+        sims, expected = self.get_expected_neighbors(folds, 4)
+
+        for tile_size in [3, 7, 100]:
+            gen = KNNCosineSimilarityPPIGenerator(embeddingdirs=embeddingdirs, k_values=[4],
+                                                  tile_size=tile_size)
+            index, embeddings = gen._get_embeddings()
+            neighbors, neighbor_sims = gen._get_neighbors(gen._get_combined_embedding(embeddings))
+            self.assertEqual((40, 4), neighbors.shape)
+            self.assertEqual(expected.tolist(), neighbors.tolist())
+            self.assertTrue(np.allclose(np.take_along_axis(sims, expected, axis=1),
+                                        neighbor_sims, atol=1e-5))
+
+    def test_get_next_network_nested(self):
+        embeddingdir, z = self.write_random_embedding()
+        sims, expected = self.get_expected_neighbors([z], 6)
+        results = {}
+        for mode in KNNCosineSimilarityPPIGenerator.MODES:
+            gen = KNNCosineSimilarityPPIGenerator(embeddingdirs=[embeddingdir], k_values=[6, 2],
+                                                  mode=mode)
+            nets = [n for n in gen.get_next_network()]
+            self.assertEqual(['2', '6'], [n.get_network_attribute('k')['v'] for n in nets])
+            edge_sets = []
+            for k, net in zip([2, 6], nets):
+                edges = set()
+                for edge_id, edge in net.get_edges():
+                    src = net.get_node(edge['s'])['n']
+                    tgt = net.get_node(edge['t'])['n']
+                    edges.add(frozenset([src, tgt]))
+                    weight = float(net.get_edge_attribute_value(edge_id,
+                                                                constants.WEIGHTED_PPI_EDGELIST_WEIGHT_COL))
+                    i, j = int(src[1:]), int(tgt[1:])
+                    self.assertAlmostEqual((1 + sims[i, j]) / 2, weight, places=5)
+                self.assertAlmostEqual(len(edges) / (40 * 39 / 2),
+                                       float(net.get_network_attribute('cutoff')['v']))
+
+                expected_edges = {}
+                for i in range(40):
+                    for j in expected[i, :k]:
+                        key = frozenset(['G' + str(i), 'G' + str(j)])
+                        expected_edges[key] = expected_edges.get(key, 0) + 1
+                if mode == KNNCosineSimilarityPPIGenerator.MUTUAL_MODE:
+                    self.assertEqual({key for key, count in expected_edges.items() if count == 2}, edges)
+                else:
+                    self.assertEqual(set(expected_edges.keys()), edges)
+                edge_sets.append(edges)
+            self.assertTrue(edge_sets[0].issubset(edge_sets[1]))
+            results[mode] = edge_sets
+        self.assertTrue(results[KNNCosineSimilarityPPIGenerator.MUTUAL_MODE][1].issubset(
+            results[KNNCosineSimilarityPPIGenerator.SYMMETRIC_MODE][1]))
+
+    def test_random_projection_neighbors(self):
+        embeddingdir, z = self.write_random_embedding(num_rows=200)
+        sims, expected = self.get_expected_neighbors([z], 5)
+        gen = KNNCosineSimilarityPPIGenerator(embeddingdirs=[embeddingdir], k_values=[5],
+                                              index=KNNCosineSimilarityPPIGenerator.RANDOM_PROJECTION_INDEX,
+                                              num_bits=2, random_seed=1)
+        index, embeddings = gen._get_embeddings()
+        neighbors, neighbor_sims = gen._get_neighbors(gen._get_combined_embedding(embeddings))
+        found = np.isfinite(neighbor_sims)
+        self.assertTrue(np.all(found))
+        rows = np.broadcast_to(np.arange(200)[:, np.newaxis], neighbors.shape)
+        self.assertTrue(np.all(neighbors != rows))
+        self.assertTrue(np.allclose(sims[rows, neighbors], neighbor_sims, atol=1e-5))
+        self.assertTrue(np.all(np.diff(neighbor_sims, axis=1) <= 0))
+        recall = np.mean([len(set(a).intersection(b)) / 5.0 for a, b in zip(expected, neighbors)])
+        self.assertGreater(recall, 0.8)
+
+        # same seed gives same result
+        again, _ = gen._get_neighbors(gen._get_combined_embedding(embeddings))
+        self.assertEqual(neighbors.tolist(), again.tolist())
+
+    def test_reduction(self):
+        embeddingdir, z = self.write_random_embedding(num_rows=40, num_cols=16)
+        # pca keeping every dimension only rotates embedding so neighbors are unchanged
+        results = []
+        for kwargs in [{}, {'reduction': KNNCosineSimilarityPPIGenerator.PCA_REDUCTION, 'reduced_dims': 16}]:
+            gen = KNNCosineSimilarityPPIGenerator(embeddingdirs=[embeddingdir], k_values=[3], **kwargs)
+            edge_table = next(gen.get_next_network_edges()).get_edge_table()
+            results.append(set(zip(edge_table.get_sources().tolist(), edge_table.get_targets().tolist())))
+        self.assertEqual(results[0], results[1])
+
+        results = []
+        for _ in range(2):
+            gen = KNNCosineSimilarityPPIGenerator(embeddingdirs=[embeddingdir], k_values=[3],
+                                                  reduction=KNNCosineSimilarityPPIGenerator.RANDOM_PROJECTION_REDUCTION,
+                                                  reduced_dims=4, reduction_seed=3)
+            edge_table = next(gen.get_next_network_edges()).get_edge_table()
+            results.append((edge_table.get_sources().tolist(), edge_table.get_targets().tolist()))
+        # same seed gives same result
+        self.assertEqual(results[0], results[1])
+
+    def test_k_larger_than_number_of_proteins(self):
+        embeddingdir, z = self.write_random_embedding(num_rows=4)
+        gen = KNNCosineSimilarityPPIGenerator(embeddingdirs=[embeddingdir], k_values=[10])
+        nets = [n for n in gen.get_next_network()]
+        self.assertEqual(1, len(nets))
+        self.assertEqual(6, len(nets[0].get_edges()))
+        self.assertEqual('1.0', nets[0].get_network_attribute('cutoff')['v'])
@@ -6,9 +6,12 @@
 import os
 import shutil
 import tempfile
+import time
 import unittest
 import pandas as pd
+import networkx as nx
 from cellmaps_generate_hierarchy.maturehierarchy import HiDeFHierarchyRefiner
+from cellmaps_generate_hierarchy.maturehierarchy import TermMembership
 
 
 class TestMatureHierarchy(unittest.TestCase):
@@ -116,3 +119,202 @@ class TestMatureHierarchy(unittest.TestCase):
         self.assertTrue(['two', 'gened', HiDeFHierarchyRefiner.GENE_TYPE] in res)
         self.assertTrue(['two', 'genee', HiDeFHierarchyRefiner.GENE_TYPE] in res)
         self.assertTrue(['two', 'genef', HiDeFHierarchyRefiner.GENE_TYPE] in res)
+
+    def _get_test_graph(self):
+        nx_graph = nx.DiGraph()
+        nx_graph.add_edge('root', 'a', type='default')
+        nx_graph.add_edge('root', 'b', type='default')
+        nx_graph.add_edge('a', 'c', type='default')
+        for term, genes in [('root', ['g7']), ('a', ['g1']), ('b', ['g4', 'g5', 'g6']), ('c', ['g2', 'g3'])]:
+            for gene in genes:
+                nx_graph.add_edge(term, gene, type=HiDeFHierarchyRefiner.GENE_TYPE)
+        return nx_graph, {'g' + str(i) for i in range(1, 8)}
+
+    def test_term_membership(self):
+        nx_graph, hiergeneset = self._get_test_graph()
+        membership = TermMembership(nx_graph, hiergeneset)
+        self.assertEqual(['root', 'a', 'b', 'c'], membership.get_terms())
+        self.assertEqual(7, membership.get_size('root'))
+        self.assertEqual(['g1', 'g2', 'g3'], membership.get_genes('a'))
+        self.assertEqual(['a', 'b', 'c'], membership.get_descendants('root'))
+        self.assertTrue(membership.is_descendant('root', 'c'))
+        self.assertFalse(membership.is_descendant('b', 'c'))
+        self.assertEqual(2 / 3, membership.get_jaccard('a', 'c'))
+
+        # matches stats found by walking the graph
+        ts_df = HiDeFHierarchyRefiner._get_term_stats(nx_graph, hiergeneset)
+        for term in membership.get_terms():
+            self.assertEqual(set(nx.descendants(nx_graph, term)) & hiergeneset,
+                             set(ts_df.loc[term]['genes']))
+            self.assertEqual(set(nx.descendants(nx_graph, term)) - hiergeneset,
+                             set(ts_df.loc[term]['descendent']))
+
+        # adding edge updates parent and its ancestors
+        membership.add_edge('c', 'b')
+        self.assertEqual(5, membership.get_size('c'))
+        self.assertEqual(6, membership.get_size('a'))
+        self.assertTrue(membership.is_descendant('a', 'b'))
+        self.assertEqual(7, membership.get_size('root'))
+
+        membership.remove_term('c')
+        self.assertFalse(membership.has_term('c'))
+        self.assertEqual(['root', 'a', 'b'], membership.get_terms())
+        self.assertEqual(['b'], membership.get_descendants('a'))
+        with self.assertRaises(KeyError):
+            membership.get_size('c')
+
+    def test_clean_shortcut(self):
+        nx_graph, hiergeneset = self._get_test_graph()
+        # shortcuts to a term, to a gene of a descendant and a second path
+        nx_graph.add_edge('root', 'c', type='default')
+        nx_graph.add_edge('root', 'g2', type=HiDeFHierarchyRefiner.GENE_TYPE)
+        nx_graph.add_edge('b', 'd', type='default')
+        nx_graph.add_edge('d', 'g8', type=HiDeFHierarchyRefiner.GENE_TYPE)
+        nx_graph.add_edge('c', 'd', type='default')
+        nx_graph.add_edge('a', 'd', type='default')
+        hiergeneset.add('g8')
+        expected = set(nx.transitive_reduction(nx_graph).edges())
+        refiner = HiDeFHierarchyRefiner()
+        refiner._clean_shortcut(nx_graph, TermMembership(nx_graph, hiergeneset))
+        self.assertEqual(expected, set(nx_graph.edges()))
+        for edge in [('root', 'c'), ('root', 'g2'), ('a', 'd')]:
+            self.assertFalse(nx_graph.has_edge(*edge))
+        for edge in [('b', 'd'), ('c', 'd'), ('root', 'g7')]:
+            self.assertTrue(nx_graph.has_edge(*edge))
+        self.assertEqual(HiDeFHierarchyRefiner.GENE_TYPE, nx_graph['root']['g7']['type'])
+
+    def test_reorganize(self):
+        nx_graph, hiergeneset = self._get_test_graph()
+        # d shares 2 of the 3 genes of b
+        nx_graph.add_edge('root', 'd', type='default')
+        for gene in ['g4', 'g5', 'g8', 'g9']:
+            nx_graph.add_edge('d', gene, type=HiDeFHierarchyRefiner.GENE_TYPE)
+        hiergeneset.update(['g8', 'g9'])
+        membership = TermMembership(nx_graph, hiergeneset)
+        self.assertEqual([('d', 'b')], membership.get_contained_pairs(0.6))
+        self.assertEqual([], membership.get_contained_pairs(0.75))
+
+        refiner = HiDeFHierarchyRefiner()
+        self.assertFalse(refiner._reorganize(nx_graph, membership, 0.75))
+        self.assertTrue(refiner._reorganize(nx_graph, membership, 0.6))
+        self.assertTrue(nx_graph.has_edge('d', 'b'))
+        self.assertFalse(nx_graph.has_edge('root', 'b'))
+        self.assertEqual(['g4', 'g5', 'g6', 'g8', 'g9'], membership.get_genes('d'))
+        self.assertEqual(set(nx.transitive_reduction(nx_graph).edges()), set(nx_graph.edges()))
+
+    def test_merge_parent_child(self):
+        # a -> b -> c where a and b and b and c are similar, but a and c are not
+        nx_graph = nx.DiGraph()
+        nx_graph.add_edge('root', 'a', type='default')
+        nx_graph.add_edge('root', 'd', type='default')
+        nx_graph.add_edge('a', 'b', type='default')
+        nx_graph.add_edge('b', 'c', type='default')
+        gene_sets = {'root': range(20, 25), 'a': [12], 'b': [11], 'c': range(1, 11), 'd': range(13, 20)}
+        hiergeneset = set()
+        for term, genes in gene_sets.items():
+            for gene in genes:
+                nx_graph.add_edge(term, 'g' + str(gene), type=HiDeFHierarchyRefiner.GENE_TYPE)
+                hiergeneset.add('g' + str(gene))
+        membership = TermMembership(nx_graph, hiergeneset)
+        self.assertEqual(11 / 12, membership.get_jaccard('a', 'b'))
+        self.assertEqual(10 / 11, membership.get_jaccard('b', 'c'))
+        self.assertEqual(10 / 12, membership.get_jaccard('a', 'c'))
+        self.assertEqual([11 / 12, 10 / 11], membership.get_jaccards([('a', 'b'), ('b', 'c')]).tolist())
+
+        refiner = HiDeFHierarchyRefiner()
+        self.assertFalse(refiner._merge_parent_child(nx_graph, membership, 0.95))
+
+        # pairs are merged one at a time in edge order, once b is
+        # merged into a, a and c are no longer similar enough
+        self.assertTrue(refiner._merge_parent_child(nx_graph, membership, 0.9))
+        self.assertEqual(['root', 'a', 'd', 'c'], membership.get_terms())
+        self.assertEqual({('root', 'a'), ('root', 'd'), ('a', 'c')},
+                         {(u, v) for u, v, t in nx_graph.edges(data='type') if t == 'default'})
+        self.assertTrue(nx_graph.has_edge('a', 'g11'))
+        self.assertEqual(list(range(1, 13)), sorted(int(g[1:]) for g in membership.get_genes('a')))
+
+    def _get_chain_graph(self, num_chains, chain_length):
+        # root -> chain<N>-0 -> ... -> chain<N>-<chain_length - 1> where
+        # each term in a chain has one more gene than the next
+        nx_graph = nx.DiGraph()
+        hiergeneset = set()
+        for chain in range(num_chains):
+            parent = 'root'
+            for depth in range(chain_length):
+                term = 'chain' + str(chain) + '-' + str(depth)
+                nx_graph.add_edge(parent, term, type='default')
+                gene = 'g' + str(chain) + '-' + str(depth)
+                nx_graph.add_edge(term, gene, type=HiDeFHierarchyRefiner.GENE_TYPE)
+                hiergeneset.add(gene)
+                parent = term
+            for gene in range(4):
+                gene = 'g' + str(chain) + '-leaf' + str(gene)
+                nx_graph.add_edge(parent, gene, type=HiDeFHierarchyRefiner.GENE_TYPE)
+                hiergeneset.add(gene)
+        return nx_graph, hiergeneset
+
+    def test_collapse_redundant(self):
+        nx_graph, hiergeneset = self._get_chain_graph(2, 6)
+        membership = TermMembership(nx_graph, hiergeneset)
+        refiner = HiDeFHierarchyRefiner()
+        self.assertFalse(refiner._collapse_redundant(nx_graph, membership, 1))
+
+        # terms in each chain differ by one gene, so every other term is
+        # removed as pairs are collapsed one at a time in edge order
+        self.assertTrue(refiner._collapse_redundant(nx_graph, membership, 2))
+        self.assertEqual(['root', 'chain0-0', 'chain0-2', 'chain0-4', 'chain1-0', 'chain1-2', 'chain1-4'],
+                         membership.get_terms())
+        self.assertEqual({('root', 'chain0-0'), ('chain0-0', 'chain0-2'), ('chain0-2', 'chain0-4'),
+                          ('root', 'chain1-0'), ('chain1-0', 'chain1-2'), ('chain1-2', 'chain1-4')},
+                         {(u, v) for u, v, t in nx_graph.edges(data='type') if t == 'default'})
+        self.assertTrue(nx_graph.has_edge('chain0-0', 'g0-1'))
+        self.assertTrue(nx_graph.has_edge('chain0-4', 'g0-leaf0'))
+        self.assertEqual(10, membership.get_size('chain0-0'))
+
+    def test_term_membership_gene_order(self):
+        nx_graph = nx.DiGraph()
+        for gene in ['10', '2', 'b', '1', 'a']:
+            nx_graph.add_edge('root', gene, type=HiDeFHierarchyRefiner.GENE_TYPE)
+        membership = TermMembership(nx_graph, {'10', '2', 'b', '1', 'a'})
+        # node ids are in numeric order
+        self.assertEqual(['1', '2', '10', 'a', 'b'], membership.get_genes('root'))
+
+    def test_refine_hierarchy_with_min_diff(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            outprefix = os.path.join(temp_dir, 'hidef_output')
+            data_dir = os.path.join(os.path.dirname(__file__), 'data')
+            for suffix in [HiDeFHierarchyRefiner.NODES_SUFFIX, HiDeFHierarchyRefiner.EDGES_SUFFIX]:
+                shutil.copyfile(os.path.join(data_dir, 'hidef_output' + suffix), outprefix + suffix)
+
+            refiner = HiDeFHierarchyRefiner(ji_thre=1.0, min_diff=2, provenance_utils=None)
+            self.assertEqual([], refiner.refine_hierarchy(outprefix))
+            nodes = pd.read_csv(outprefix + '.pruned.nodes', sep='\t', header=None)
+            self.assertEqual(['Cluster2-6', 'Cluster3-3'], nodes[0].tolist())
+            for genes in nodes[2]:
+                node_ids = [int(g) for g in genes.split(' ')]
+                self.assertEqual(sorted(node_ids), node_ids)
+
+            # Cluster2-6 has just 2 more genes than Cluster3-3
+            refiner = HiDeFHierarchyRefiner(ji_thre=1.0, min_diff=3, provenance_utils=None)
+            refiner.refine_hierarchy(outprefix)
+            nodes = pd.read_csv(outprefix + '.pruned.nodes', sep='\t', header=None)
+            self.assertEqual(['Cluster2-6'], nodes[0].tolist())
+            self.assertEqual(6, nodes[1][0])
+            self.assertEqual(36, nodes[3][0])
+            self.assertEqual(0, os.path.getsize(outprefix + '.pruned.edges'))
+        finally:
+            shutil.rmtree(temp_dir)
+
+    @unittest.skipUnless(os.getenv('CELLMAPS_GENERATE_HIERARCHY_BENCHMARK') is not None,
+                         'Set environment variable CELLMAPS_GENERATE_HIERARCHY_BENCHMARK to run')
+    def test_collapse_redundant_benchmark(self):
+        for num_chains, chain_length in [(100, 20), (500, 20), (1000, 40)]:
+            nx_graph, hiergeneset = self._get_chain_graph(num_chains, chain_length)
+            start = time.time()
+            membership = TermMembership(nx_graph, hiergeneset)
+            HiDeFHierarchyRefiner()._collapse_redundant(nx_graph, membership, 2)
+            duration = time.time() - start
+            self.assertEqual(num_chains * chain_length // 2 + 1, len(membership.get_terms()))
+            print('\n' + str(num_chains) + ' chains of ' + str(chain_length) + ' terms collapsed in ' +
+                  '{:.2f}'.format(duration) + ' seconds')
@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `PPINetworkEdges`, `EdgeTable`, `GeneIndex` and `EdgeStore`."""
+
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+import ndex2
+from cellmaps_utils import constants
+from cellmaps_generate_hierarchy.exceptions import CellmapsGenerateHierarchyError
+from cellmaps_generate_hierarchy.ppi import GeneIndex
+from cellmaps_generate_hierarchy.ppi import EdgeTable
+from cellmaps_generate_hierarchy.ppi import PPINetworkEdges
+from cellmaps_generate_hierarchy.ppi import EdgeStore
+from cellmaps_generate_hierarchy.ppi import PPINetworkGenerator
+
+
+class TestPPINetworkEdges(unittest.TestCase):
+    """Tests for `PPINetworkEdges`."""
+
+    def setUp(self):
+        """Set up test fixtures, if any."""
+
+    def tearDown(self):
+        """Tear down test fixtures, if any."""
+
+    def get_edges(self):
+        return pd.DataFrame({constants.PPI_EDGELIST_GENEA_COL: ['A', 'B', 'A'],
+                             constants.PPI_EDGELIST_GENEB_COL: ['B', 'C', 'C'],
+                             constants.WEIGHTED_PPI_EDGELIST_WEIGHT_COL: [0.9, 0.5, 0.25]})
+
+    def test_getters(self):
+        edges = PPINetworkEdges(self.get_edges(), name='foo', description='desc',
+                                attributes={'cutoff': '0.1'})
+        self.assertEqual(3, edges.get_num_edges())
+        self.assertEqual('foo', edges.get_name())
+        self.assertEqual({'n': 'cutoff', 'v': '0.1'}, edges.get_network_attribute('cutoff'))
+        self.assertEqual({'n': 'description', 'v': 'desc'}, edges.get_network_attribute('description'))
+        self.assertIsNone(edges.get_network_attribute('bar'))
+
+    def test_get_network_and_from_network(self):
+        edges = PPINetworkEdges(self.get_edges(), name='foo', description='desc',
+                                attributes={'cutoff': '0.1', 'k': '5'})
+        net = edges.get_network()
+        self.assertEqual('foo', net.get_name())
+        self.assertEqual('desc', net.get_network_attribute('description')['v'])
+        self.assertEqual('0.1', net.get_network_attribute('cutoff')['v'])
+        self.assertEqual('5', net.get_network_attribute('k')['v'])
+        self.assertEqual(3, len(net.get_nodes()))
+        self.assertEqual(3, len(net.get_edges()))
+
+        res = PPINetworkEdges.from_network(net)
+        self.assertEqual('foo', res.get_name())
+        self.assertEqual({'n': 'k', 'v': '5'}, res.get_network_attribute('k'))
+        self.assertEqual({'n': 'description', 'v': 'desc'}, res.get_network_attribute('description'))
+        pd.testing.assert_frame_equal(self.get_edges(), res.get_edges())
+
+    def test_base_generator_get_next_network_edges(self):
+        net = PPINetworkEdges(self.get_edges()[[constants.PPI_EDGELIST_GENEA_COL,
+                                                constants.PPI_EDGELIST_GENEB_COL]],
+                              name='foo', attributes={'cutoff': '0.1'}).get_network()
+
+        class FakeGenerator(PPINetworkGenerator):
+            def get_next_network(self):
+                yield net
+
+        res = list(FakeGenerator().get_next_network_edges())
+        self.assertEqual(1, len(res))
+        self.assertEqual('foo', res[0].get_name())
+        self.assertEqual(['A', 'B', 'A'], res[0].get_edges()[constants.PPI_EDGELIST_GENEA_COL].tolist())
+        self.assertFalse(constants.WEIGHTED_PPI_EDGELIST_WEIGHT_COL in res[0].get_edges().columns)
+
+    def test_gene_index(self):
+        gene_index = GeneIndex(['A', 'B', 'C'])
+        self.assertEqual(3, len(gene_index))
+        self.assertEqual([2, -1, 0], gene_index.get_ids(['C', 'X', 'A']).tolist())
+        self.assertEqual({'A': 0, 'C': 2}, gene_index.get_name_to_id_dict(ids=np.array([0, 2])))
+        with self.assertRaises(CellmapsGenerateHierarchyError):
+            GeneIndex(['A', 'B', 'A'])
+
+    def test_edge_table_from_dataframe_matches_network_ids(self):
+        df = self.get_edges()
+        edge_table = EdgeTable.from_dataframe(df)
+        self.assertEqual(['A', 'B', 'C'], edge_table.get_gene_index().get_names().tolist())
+        self.assertEqual([0, 1, 0], edge_table.get_sources().tolist())
+        self.assertEqual([1, 2, 2], edge_table.get_targets().tolist())
+        self.assertEqual(np.int32, edge_table.get_sources().dtype)
+        self.assertEqual(np.float32, edge_table.get_weights().dtype)
+        pd.testing.assert_frame_equal(df, edge_table.to_dataframe(), check_exact=False, rtol=1e-6)
+
+        # node ids match those assigned by ndex2
+        net = ndex2.create_nice_cx_from_pandas(df, source_field=constants.PPI_EDGELIST_GENEA_COL,
+                                               target_field=constants.PPI_EDGELIST_GENEB_COL)
+        for node_id, node_obj in net.get_nodes():
+            self.assertEqual(node_id, edge_table.get_gene_index().get_ids([node_obj['n']])[0])
+
+    def test_edge_table_head_shares_gene_index(self):
+        edge_table = EdgeTable.from_dataframe(self.get_edges())
+        head = edge_table.head(2)
+        self.assertEqual(2, len(head))
+        self.assertIs(edge_table.get_gene_index(), head.get_gene_index())
+        self.assertEqual([0, 1], head.get_sources().tolist())
+        self.assertEqual([0, 1, 2], head.get_node_ids().tolist())
+
+    def test_get_network_uses_gene_ids(self):
+        gene_index = GeneIndex(['A', 'B', 'C', 'D', 'E'])
+        edges = PPINetworkEdges(EdgeTable(gene_index, [4, 1], [1, 3], weights=[0.5, np.nan]),
+                                name='foo')
+        net = edges.get_network()
+        self.assertEqual({1: 'B', 3: 'D', 4: 'E'},
+                         {node_id: node_obj['n'] for node_id, node_obj in net.get_nodes()})
+        self.assertEqual(0.5, net.get_edge_attribute(0, constants.WEIGHTED_PPI_EDGELIST_WEIGHT_COL)['v'])
+        self.assertEqual((None, None), net.get_edge_attribute(1, constants.WEIGHTED_PPI_EDGELIST_WEIGHT_COL))
+        self.assertEqual({'B': 1, 'D': 3, 'E': 4}, edges.get_name_to_id_dict())
+        self.assertEqual(5, net.create_node('F'))
+
+    def test_edge_store_stores_nested_networks_once(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            gene_index = GeneIndex(['A', 'B', 'C', 'D'])
+            edge_table = EdgeTable(gene_index, [0, 1, 2, 0], [1, 2, 3, 3], weights=[0.9, 0.8, 0.7, 0.6])
+            network_edges = [PPINetworkEdges(edge_table.head(n), name='net' + str(n),
+                                             description='desc' + str(n),
+                                             attributes={'cutoff': str(n / 4)})
+                             for n in [1, 4, 2]]
+            store = EdgeStore.create(os.path.join(temp_dir, 'ppi_edges'), network_edges)
+            edges_file, index_file = store.get_files()
+            self.assertEqual(os.path.join(temp_dir, 'ppi_edges.npy'), edges_file)
+            self.assertEqual(4, len(np.load(edges_file)))
+            self.assertTrue(os.path.isfile(index_file))
+
+            res = EdgeStore(os.path.join(temp_dir, 'ppi_edges')).get_all_network_edges()
+            self.assertEqual(3, len(res))
+            for exp, edges in zip(network_edges, res):
+                self.assertEqual(exp.get_name(), edges.get_name())
+                self.assertEqual(exp.get_network_attribute('cutoff'), edges.get_network_attribute('cutoff'))
+                self.assertEqual(exp.get_network_attribute('description'),
+                                 edges.get_network_attribute('description'))
+                pd.testing.assert_frame_equal(exp.get_edges(), edges.get_edges())
+            # all networks share gene index of store
+            self.assertIs(res[0].get_edge_table().get_gene_index(), res[1].get_edge_table().get_gene_index())
+            self.assertIs(store.get_gene_index(), store.get_all_network_edges()[0].get_edge_table().get_gene_index())
+            self.assertEqual(['A', 'B', 'C', 'D'], store.get_gene_index().get_names().tolist())
+            self.assertTrue(res[0].get_edge_table().is_prefix_of(res[1].get_edge_table()))
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_edge_store_with_networks_that_are_not_nested(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            first = PPINetworkEdges(self.get_edges(), name='first', attributes={'k': '1'})
+            second_df = pd.DataFrame({constants.PPI_EDGELIST_GENEA_COL: ['C', 'D'],
+                                      constants.PPI_EDGELIST_GENEB_COL: ['D', 'A']})
+            second = PPINetworkEdges(second_df, name='second')
+            store = EdgeStore.create(os.path.join(temp_dir, 'ppi_edges'), [first, second])
+            self.assertEqual(5, len(np.load(store.get_files()[0])))
+            res = EdgeStore(os.path.join(temp_dir, 'ppi_edges')).get_all_network_edges()
+            pd.testing.assert_frame_equal(first.get_edges(), res[0].get_edges())
+            self.assertEqual(['C', 'D'], res[1].get_edges()[constants.PPI_EDGELIST_GENEA_COL].tolist())
+            self.assertEqual(['D', 'A'], res[1].get_edges()[constants.PPI_EDGELIST_GENEB_COL].tolist())
+            self.assertTrue(np.all(np.isnan(res[1].get_edges()[constants.WEIGHTED_PPI_EDGELIST_WEIGHT_COL])))
+            self.assertEqual(['A', 'B', 'C', 'D'],
+                             res[0].get_edge_table().get_gene_index().get_names().tolist())
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_edge_store_errors(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            with self.assertRaises(CellmapsGenerateHierarchyError):
+                EdgeStore.create(os.path.join(temp_dir, 'foo'), [])
+            with self.assertRaises(CellmapsGenerateHierarchyError):
+                EdgeStore(os.path.join(temp_dir, 'foo')).get_num_networks()
+        finally:
+            shutil.rmtree(temp_dir)
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `termoverlap` module."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+from scipy import sparse
+
+from cellmaps_generate_hierarchy.exceptions import CellmapsGenerateHierarchyError
+from cellmaps_generate_hierarchy.termoverlap import TermIncidence
+from cellmaps_generate_hierarchy.termoverlap import TermOverlap
+
+
+class TestTermOverlap(unittest.TestCase):
+    """Tests for `termoverlap` module."""
+
+    def setUp(self):
+        """Set up test fixtures, if any."""
+        self._temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """Tear down test fixtures, if any."""
+        shutil.rmtree(self._temp_dir)
+
+    def _write_nodes_file(self, name, terms):
+        nodes_file = os.path.join(self._temp_dir, name)
+        with open(nodes_file, 'w') as f:
+            for term_name, members in terms:
+                f.write(term_name + '\t' + str(len(members)) + '\t' + ' '.join(members) + '\t0\n')
+        return nodes_file
+
+    def _get_random_terms(self, rng, num_terms, num_genes):
+        terms = []
+        for i in range(num_terms):
+            size = rng.integers(1, num_genes // 2)
+            members = rng.choice(num_genes, size=size, replace=False)
+            terms.append(('Cluster' + str(i), ['G' + str(m) for m in members]))
+        return terms
+
+    @staticmethod
+    def _jaccard(a, b):
+        return len(set(a) & set(b)) / len(set(a) | set(b))
+
+    def test_term_incidence_shape_mismatch(self):
+        with self.assertRaises(CellmapsGenerateHierarchyError):
+            TermIncidence(['a'], sparse.csr_matrix((2, 3)), ['x', 'y', 'z'])
+
+    def test_from_nodes_files(self):
+        ref_file = self._write_nodes_file('ref.nodes', [('C0', ['A', 'B', 'C']),
+                                                        ('C1', ['B', 'B'])])
+        other_file = self._write_nodes_file('other.nodes', [('D0', ['C', 'D'])])
+        empty_file = self._write_nodes_file('empty.nodes', [])
+        ref, other, empty = TermIncidence.from_nodes_files([ref_file, other_file, empty_file])
+        self.assertEqual(['A', 'B', 'C', 'D'], ref.get_gene_names())
+        self.assertEqual(ref.get_gene_names(), other.get_gene_names())
+        self.assertEqual(['C0', 'C1'], ref.get_term_names())
+        self.assertEqual(2, ref.get_num_terms())
+        self.assertEqual([3, 1], ref.get_term_sizes().tolist())
+        self.assertEqual([[1, 1, 1, 0], [0, 1, 0, 0]], ref.get_matrix().toarray().tolist())
+        self.assertEqual([[0, 0, 1, 1]], other.get_matrix().toarray().tolist())
+        self.assertEqual((0, 4), empty.get_matrix().shape)
+
+    def test_matches_python_sets(self):
+        rng = np.random.default_rng(3)
+        ref_terms = self._get_random_terms(rng, 40, 60)
+        other_terms = self._get_random_terms(rng, 30, 60)
+        ref, other = TermIncidence.from_nodes_files([self._write_nodes_file('ref.nodes', ref_terms),
+                                                     self._write_nodes_file('other.nodes', other_terms)])
+        term_overlap = TermOverlap()
+        overlap = term_overlap.get_overlap_matrix(ref, other).toarray()
+        jaccard = term_overlap.get_jaccard_matrix(ref, other).toarray()
+        for i, (_, a) in enumerate(ref_terms):
+            for j, (_, b) in enumerate(other_terms):
+                self.assertEqual(len(set(a) & set(b)), overlap[i, j])
+                self.assertAlmostEqual(self._jaccard(a, b), jaccard[i, j])
+
+        best_idx, best_jaccard = term_overlap.get_best_matches(ref, other)
+        table = term_overlap.get_best_match_table(ref, other)
+        for i, (name, a) in enumerate(ref_terms):
+            expected = max([self._jaccard(a, b) for _, b in other_terms])
+            self.assertAlmostEqual(expected, best_jaccard[i])
+            if expected > 0:
+                self.assertAlmostEqual(expected, self._jaccard(a, other_terms[best_idx[i]][1]))
+                self.assertEqual(other_terms[best_idx[i]][0], table['best_match'][i])
+            else:
+                self.assertEqual(-1, best_idx[i])
+            self.assertEqual(name, table['term'][i])
+            self.assertEqual(len(a), table['size'][i])
+
+    def test_get_best_matches_no_overlap(self):
+        ref, other = TermIncidence.from_nodes_files([self._write_nodes_file('ref.nodes', [('C0', ['A'])]),
+                                                     self._write_nodes_file('other.nodes', [('D0', ['B'])])])
+        best_idx, best_jaccard = TermOverlap().get_best_matches(ref, other)
+        self.assertEqual([-1], best_idx.tolist())
+        self.assertEqual([0.0], best_jaccard.tolist())
+        table = TermOverlap().get_best_match_table(ref, other)
+        self.assertIsNone(table['best_match'][0])
+        self.assertEqual(0, table['best_match_size'][0])
+
+    def test_different_genes(self):
+        ref = TermIncidence.from_nodes_files([self._write_nodes_file('ref.nodes', [('C0', ['A'])])])[0]
+        other = TermIncidence.from_nodes_files([self._write_nodes_file('other.nodes', [('D0', ['B'])])])[0]
+        with self.assertRaises(CellmapsGenerateHierarchyError):
+            TermOverlap().get_overlap_matrix(ref, other)
+
+    def test_compare_nodes_files(self):
+        ref_file = self._write_nodes_file('ref.nodes', [('C0', ['A', 'B', 'C', 'D']),
+                                                        ('C1', ['A', 'B'])])
+        files = [self._write_nodes_file('1.nodes', [('D0', ['A', 'B', 'C', 'D']), ('D1', ['A', 'B', 'E'])]),
+                 self._write_nodes_file('2.nodes', [('D0', ['A', 'B', 'C'])]),
+                 self._write_nodes_file('3.nodes', [])]
+        res = TermOverlap(jaccard_threshold=0.75).compare_nodes_files(ref_file, files)
+        self.assertEqual(['C0', 'C1'], res['term'].tolist())
+        self.assertEqual([4, 2], res['size'].tolist())
+        self.assertEqual([2 / 3, 0.0], res['support'].tolist())
+        self.assertAlmostEqual((1.0 + 0.75) / 3, res['mean_best_jaccard'][0])
+        self.assertAlmostEqual((2 / 3 + 2 / 3) / 3, res['mean_best_jaccard'][1])
+
+        res = TermOverlap(jaccard_threshold=0.6).compare_nodes_files(ref_file, files)
+        self.assertEqual([2 / 3, 2 / 3], res['support'].tolist())
@@ -11,6 +11,7 @@ import unittest
 from unittest.mock import MagicMock, patch
 
 import ndex2
+import numpy as np
 from cellmaps_utils import constants
 
 from cellmaps_generate_hierarchy import cellmaps_generate_hierarchycmd
@@ -105,17 +106,17 @@ class TestWeightedEdgelist(unittest.TestCase):
 
     def test_removed_edges_file_includes_weight_column(self):
         """The bootstrap-removed edges file must also carry the weight column
-        in weighted mode. random.sample is patched so exactly the first edge
-        is flagged for removal, deterministically."""
+        in weighted mode. The random generator is mocked so exactly the first
+        edge is flagged for removal, deterministically."""
         prefix = self._write_network('wnet',
                                      [('n1', 'n2', 0.9), ('n2', 'n5', 0.5)])
         gen = self._make_generator(weighted_mode=True)
         gen._bootstrap_edges = 50  # threshold int(2 * 0.5) == 1 -> one removed
 
         # force the (0, 1) edge to be the one sampled for removal
-        with patch('cellmaps_generate_hierarchy.hierarchy.random.sample',
-                   return_value=[(0, 1)]):
-            gen._create_edgelist_files_for_networks([prefix])
+        gen._rng = MagicMock()
+        gen._rng.choice = MagicMock(return_value=np.array([0]))
+        gen._create_edgelist_files_for_networks([prefix])
 
         removed_path = prefix + '_removed_edges.tsv'
         self.assertTrue(os.path.isfile(removed_path))
@@ -154,6 +155,40 @@ class TestWeightedEdgelist(unittest.TestCase):
         self.assertEqual('0\t1\t0.9\n', self._read_edgelist(small))
         self.assertEqual('0\t1\t0.3\n1\t2\t0.7\n', self._read_edgelist(large))
 
+    def test_weights_written_with_fixed_precision(self):
+        prefix = self._write_network('wnet',
+                                     [('n1', 'n2', 0.123456789), ('n2', 'n5', 1.0),
+                                      ('n5', 'n6', np.float32(0.9).item())])
+        gen = self._make_generator(weighted_mode=True)
+        gen._create_edgelist_files_for_networks([prefix])
+        self.assertEqual('0\t1\t0.123457\n1\t2\t1\n2\t3\t0.9\n', self._read_edgelist(prefix))
+
+    def test_write_edgelist_file(self):
+        dest = os.path.join(self._temp_dir, 'foo.tsv')
+        CDAPSHiDeFHierarchyGenerator._write_edgelist_file(dest, np.array([0, 10]), np.array([1, 2]),
+                                                          weights=np.array([np.nan, 0.25]))
+        with open(dest) as f:
+            self.assertEqual('0\t1\n10\t2\t0.25\n', f.read())
+
+        CDAPSHiDeFHierarchyGenerator._write_edgelist_file(dest, np.array([], dtype=np.int64),
+                                                          np.array([], dtype=np.int64),
+                                                          weights=np.array([]))
+        with open(dest) as f:
+            self.assertEqual('', f.read())
+
+    def test_multiple_workers_write_same_files(self):
+        networks = [self._write_network('net' + str(i),
+                                        [('n' + str(j), 'n' + str(j + 1), j / 10.0) for j in range(i + 2)])
+                    for i in range(3)]
+        results = []
+        for workers in [1, 3]:
+            gen = self._make_generator(weighted_mode=True, workers=workers)
+            gen._create_edgelist_files_for_networks(networks)
+            results.append([self._read_edgelist(n) for n in networks])
+            self.assertEqual(3, gen._provenance_utils.register_dataset.call_count)
+        self.assertEqual(results[0], results[1])
+        self.assertEqual('0\t1\t0\n1\t2\t0.1\n', results[1][0])
+
 
 class TestWeightedEdgelistCmd(unittest.TestCase):
     """Tests for the --weighted_edgelist argument and its wiring in main()."""